@@ -27,10 +27,14 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import os
 import re
+import shutil
 import logging
 import pickle
 
+from multiprocessing import Pool
+
 from yaml import load
 
 import pandas as pd
@@ -41,64 +45,176 @@ from sklearn.preprocessing import LabelEncoder
 from sklearn.ensemble import GradientBoostingClassifier as gbm
 from sklearn.externals.joblib import Parallel, delayed
 
+import tsvcache
+import rankindex
+import predictionstore
+
+## Default number of articles per shard of predictions
+SHARD_SIZE = 250000
+
+## Default number of articles predicted at a time
+PREDICTION_CHUNK_SIZE = 10000
+
+## Columns of each table, by configuration key, needed to merge and filter
+## the tables and to calculate the derived features. The first column is
+## the page ID the table is split into shards by.
+MERGE_COLUMNS = {
+    'snapshot file': ['art_page_id', 'talk_is_archive', 'art_is_redirect'],
+    'dataset': ['page_id', 'num_inlinks', 'num_views'],
+    'clickstream file': ['page_id', 'n_clicks', 'n_from_art', 'n_act_links'],
+    'disambiguation file': ['page_id'],
+}
+
+## Per-article inputs the predictors are calculated from. When predicting
+## incrementally, an article is predicted again if one of these changed.
+## The rank percentiles are not among them, as they change with every
+## other article in the dataset.
+REPREDICTION_FEATURES = ['num_inlinks', 'num_views', 'n_clicks',
+                         'n_from_art', 'n_act_links']
+
+## Predictor used by the worker processes, set by `_init_worker`
+_predictor = None
+
+def _init_worker(config_file, model_version):
+    '''
+    Set up the predictor of a worker process. It reads the configuration,
+    the model, and the global data written by the main process itself,
+    so no datasets are passed to the worker.
+    '''
+    global _predictor
+    _predictor = GlobalPredictor()
+    _predictor.load_model(config_file)
+    _predictor.model_version = model_version
+    _predictor.read_global_data()
+
+def _predict_shard(shard):
+    '''
+    Predict and write a shard in a worker.
+    '''
+    return(_predictor.predict_shard(*shard))
+
 class GlobalPredictor:
     def __init__(self):
         self.config = None
         self.model = None
         self.le = None
 
-    def calc_views(self, pg):
+        ## View estimates of the new pages and the rank index of each
+        ## ranked column, which depend on the whole dataset,
+        ## see `calc_global_data`
+        self.newpage_views = None
+        self.rank_indexes = None
+
+        ## Store of previous predictions and the current model's version,
+        ## used when predicting incrementally
+        self.store = None
+        self.model_version = None
+
+    def calc_views(self, newpage_views):
         '''
-        Calculate views for a "new" page based on the given group of page data.
-        
-        :param pg: group of page data (page_id, number of views, etc)
-        :type pg: `pandas.GroupBy`
+        Calculate views for all "new" pages from their daily views. Days in
+        the dataset's date range without data count as zero views, except
+        days before a page's first day with views, when the page did not
+        exist yet. A page's views are the lower end of the confidence
+        interval of its mean daily views, or 0 if it only has two days of
+        data. Returns a data frame indexed by page ID with a `num_views`
+        column.
+
+        :param newpage_views: daily views of the new pages (page_id,
+                              view_date, num_views)
+        :type newpage_views: `pandas.DataFrame`
         '''
 
-        ## Index the page group by date, then reindex it by our full
-        ## date range to add NaN-rows, then turn all NaNs into 0.
-        pg.set_index(pd.to_datetime(pg.view_date), inplace=True)
-        pg = pg.reindex(self.date_range).fillna(0)
+        ## Pivot the views into a dense page × date matrix covering
+        ## the full date range of the dataset
+        (rows, page_ids) = pd.factorize(newpage_views.page_id, sort=True)
+        view_dates = pd.to_datetime(newpage_views.view_date)
+        cols = (view_dates - view_dates.min()).dt.days.values
+        views = np.zeros((len(page_ids), cols.max() + 1))
+        views[rows, cols] = newpage_views.num_views.values
+
+        ## Remove all days before the first day with views. At some point
+        ## in the date range, the page was created and therefore _must_ have
+        ## non-zero views at that point. Pages without views keep all days.
+        ## A page's remaining days are then the last `n_days` columns.
+        n_days = views.shape[1] - np.argmax(views != 0, axis=1)
+
+        ## Mean, standard error of the mean, and lower end of the confidence
+        ## interval as `scipy.stats.t.interval` calculates it, which is NaN
+        ## if the standard error is 0. Pages with the same number of days
+        ## are calculated together, over exactly those days.
+        mean = np.zeros(len(page_ids))
+        sem = np.zeros(len(page_ids))
+        for n in np.unique(n_days):
+            group = n_days == n
+            group_views = views[group, -n:]
+            mean[group] = group_views.sum(axis=1) / n
+            deviations = group_views - mean[group, np.newaxis]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sem[group] = np.sqrt((deviations * deviations).sum(axis=1)
+                                     / (n - 1)) / np.sqrt(n)
+
+        with np.errstate(invalid='ignore'):
+            sem[~(sem > 0)] = np.nan
+            low_bound = st.t.ppf(
+                (1 - self.config['confidence interval']/100) / 2,
+                n_days - 1) * sem + mean
 
-        ## From https://stackoverflow.com/questions/39352554/pandas-dataframe-delete-row-with-certain-value-until-that-value-changes
-        ## Remove all rows until the first non-zero row is encountered.
-        ## This works because at some point in the date range, the page was
-        ## created and therefore _must_ have non-zero views at that point.
-        pg = pg.loc[pg[(pg != 0).all(axis=1)].first_valid_index():]
-        
         ## If we only have two data points, the average views is 0,
         ## otherwise, it's the lower end of the confidence interval.
-        if len(pg.num_views) <= 2:
-            return(0.0)
-        else:
-            return(st.t.interval(self.config['confidence interval']/100,
-                                 len(pg.num_views)-1,
-                                 loc=np.mean(pg.num_views),
-                                 scale=st.sem(pg.num_views))[0])
+        low_bound[n_days <= 2] = 0.0
 
-    def load_datasets(self):
+        return(pd.DataFrame({'num_views': low_bound},
+                            index=pd.Index(page_ids, name='page_id')))
+
+    def read_tables(self, columns=None, first_id=None, last_id=None):
         '''
-        Load in the datasets defined in the configuration file, split them
-        into "new" and "old" pages. Make any necessary calculations. Return
-        both datasets.
-        
-        :param config: the global model configuration
-        :type config: dict
+        Read the snapshot, dataset, clickstream, and disambiguations.
+        Returns a dictionary of the data frames by configuration key.
+
+        :param columns: names of columns to read in addition to those
+                        needed to merge the tables, see `MERGE_COLUMNS`.
+                        Names not in a table are ignored.
+        :type columns: list
+
+        :param first_id: lowest page ID of the articles to read, by
+                         default all articles are read
+        :type first_id: int
+
+        :param last_id: highest page ID of the articles to read
+        :type last_id: int
         '''
-        
-        # read in snapshot
-        snapshot = pd.read_table(self.config['snapshot file'])
-        # read in dataset
-        dataset = pd.read_table(self.config['dataset'])
-        # read in clickstream
-        clickstream = pd.read_table(self.config['clickstream file'])
-        # read in disambiguations
-        disambiguations = pd.read_table(self.config['disambiguation file'])
-        # read in the "new" page views
-        newpage_views = pd.read_table(self.config['new page views'])
-
-        logging.info('loaded all datasets, processing and merging')
-        
+
+        tables = {}
+        for (table, merge_columns) in MERGE_COLUMNS.items():
+            value_range = None
+            if first_id is not None:
+                value_range = (merge_columns[0], first_id, last_id)
+            tables[table] = tsvcache.read_table(
+                self.config[table], columns=merge_columns + (columns or []),
+                value_range=value_range)
+        return(tables)
+
+    def merge_datasets(self, tables, newpage_views):
+        '''
+        Merge the given tables into a dataset of articles indexed by page
+        ID, filter out the articles we do not predict, copy in the view
+        estimates of the new pages, and calculate the derived features
+        other than the ranks.
+
+        :param tables: the tables, see `read_tables`
+        :type tables: dict
+
+        :param newpage_views: view estimates of the new pages, see
+                              `calc_views`
+        :type newpage_views: `pandas.DataFrame`
+        '''
+
+        snapshot = tables['snapshot file']
+        dataset = tables['dataset']
+        clickstream = tables['clickstream file']
+        disambiguations = tables['disambiguation file']
+
         # Log-transform number of inlinks, views, and calculate prop_proj_inlinks
         dataset['log_inlinks'] = np.log10(1 + dataset['num_inlinks'])
         
@@ -130,25 +246,9 @@ class GlobalPredictor:
         # filter out disambiguations
         res = res[res.art_page_id.isin(disambiguations.page_id) == False]
 
-        # Split out the new pages, calculate views for them, then copy those
-        # views back in.
-        logging.info('processing new page views')
-
-        ## We need to extend data for "new" pages so that all of them have
-        ## data for all days after their first day in the dataset.
-        self.date_range = pd.date_range(start=min(newpage_views.view_date),
-                                        end=max(newpage_views.view_date))
-
-        ## Calculate confidence intervals for all new page views. Set it to
-        ## 0 of it's below 0.
-        newpage_views = newpage_views.groupby('page_id').apply(self.calc_views)
-        newpage_views = newpage_views.to_frame()
-        newpage_views.columns = ['num_views']
-        newpage_views.num_views = newpage_views.num_views.apply(
-            lambda n: np.max(n, 0))
-
         ## Set all with negative views to NaN, create the index,
-        ## update, then set all rows with NaN to 0 views.
+        ## update with the new page views, then set all rows with
+        ## NaN to 0 views.
         ## Consider: df.num_views[df.num_views < 0] = np.nan
         res.loc[(res.num_views < 0), 'num_views'] = np.nan
         res.set_index('art_page_id', inplace=True)
@@ -162,16 +262,117 @@ class GlobalPredictor:
         # calculate proportion of active inlinks
         res['prop_act_inlinks'] = np.minimum(
             1.0, res['n_act_links']/(1 + res['num_inlinks']))
-        
-        # add rank variables for views and inlinks, and make them percentiles
-        res['rank_links'] = res.num_inlinks.rank(method='min')
-        res['rank_links_perc'] = res.num_inlinks.rank(method='min', pct=True)
-        res['rank_views'] = res.num_views.rank(method='min')
-        res['rank_views_perc'] = res.num_views.rank(method='min', pct=True)
 
-        # ok, done
         return(res)
 
+    def load_datasets(self, first_id=None, last_id=None):
+        '''
+        Load the articles in the given range of page IDs from the datasets
+        defined in the configuration file, with the columns needed to
+        predict and write out their ratings. Features that depend on the
+        whole dataset come from `calc_global_data` or `read_global_data`.
+        Returns a data frame indexed and sorted by page ID.
+
+        :param first_id: lowest page ID of the articles to load, by
+                         default all articles are loaded
+        :type first_id: int
+
+        :param last_id: highest page ID of the articles to load
+        :type last_id: int
+        '''
+
+        columns = (self.config['predictors']
+                   + self.config['prediction dataset columns']
+                   + self.reprediction_features())
+        tables = self.read_tables(columns, first_id, last_id)
+
+        newpage_views = self.newpage_views
+        if first_id is not None:
+            newpage_views = newpage_views.loc[first_id:last_id]
+
+        res = self.merge_datasets(tables, newpage_views)
+
+        # add rank variables for views and inlinks, and make them
+        # percentiles of the whole dataset
+        rankindex.add_ranks(res, self.rank_indexes)
+
+        ## Only keep the columns needed to predict and write out ratings,
+        ## and to decide which articles to predict again
+        columns = [col for col in res.columns if col in columns]
+        return(res[columns].sort_index())
+
+    def calc_global_data(self):
+        '''
+        Calculate the features that depend on the whole dataset: the view
+        estimates of the new pages and the rank index of the number of
+        inlinks and views. Only the columns needed to merge the datasets
+        are read. Both are written next to the prediction dataset for the
+        worker processes, see `read_global_data`. Returns the sorted page
+        IDs of all articles to predict.
+        '''
+
+        # Calculate views for the new pages, they are copied in when
+        # the datasets are merged.
+        logging.info('processing new page views')
+
+        ## Calculate confidence intervals for all new page views, extending
+        ## the data for "new" pages so that all of them have data for all
+        ## days after their first day in the dataset. Negative views are
+        ## set to 0 when merging.
+        self.newpage_views = self.calc_views(
+            tsvcache.read_table(self.config['new page views']))
+        with open(self.global_path('newpage-views'), 'wb') as outfile:
+            np.savez(outfile, page_id=self.newpage_views.index.values,
+                     num_views=self.newpage_views.num_views.values)
+
+        logging.info('ranking the number of inlinks and views')
+        res = self.merge_datasets(self.read_tables(), self.newpage_views)
+        self.rank_indexes = rankindex.add_ranks(res)
+        for (column, index) in self.rank_indexes.items():
+            index.save(self.global_path('rank-{}'.format(column)))
+
+        return(np.sort(res.index.values))
+
+    def read_global_data(self):
+        '''
+        Read the view estimates and rank indexes written by
+        `calc_global_data`.
+        '''
+
+        with np.load(self.global_path('newpage-views')) as views_data:
+            self.newpage_views = pd.DataFrame(
+                {'num_views': views_data['num_views']},
+                index=pd.Index(views_data['page_id'], name='page_id'))
+
+        self.rank_indexes = {
+            column: rankindex.RankIndex.load(
+                self.global_path('rank-{}'.format(column)))
+            for (column, rank_column) in rankindex.RANKED_COLUMNS}
+        return()
+
+    def global_path(self, name):
+        '''
+        Return the path to the given file of global data, see
+        `calc_global_data`.
+
+        :param name: name of the data
+        :type name: str
+        '''
+        return('{}.{}.npz'.format(self.config['prediction dataset'], name))
+
+    def remove_global_data(self):
+        '''
+        Delete the files written by `calc_global_data`, those that
+        were written if it failed.
+        '''
+        names = ['newpage-views'] + ['rank-{}'.format(column) for
+                                     (column, rank_column)
+                                     in rankindex.RANKED_COLUMNS]
+        for name in names:
+            if os.path.exists(self.global_path(name)):
+                os.remove(self.global_path(name))
+        return()
+
     def predict_ratings(self, dataset):
         '''
         Trim the given dataset down to the right columns, make predictions
@@ -181,12 +382,19 @@ class GlobalPredictor:
         :type dataset: `pandas.DataFrame`
         '''
         
-        X = dataset[self.config['predictors']].as_matrix()
-
-        logging.info('predicting importance ratings')
-        classes = self.model.predict(X)
-        logging.info('predicting rating probabilities')
-        probabilities = self.model.predict_proba(X)
+        X = dataset[self.config['predictors']].values
+
+        ## The predicted classes are the most probable ones, as the model's
+        ## `predict` would give, so the ensemble is only evaluated once,
+        ## in chunks of rows to bound memory use
+        logging.info('predicting importance ratings and probabilities')
+        chunk_size = self.config.get('prediction chunk size',
+                                     PREDICTION_CHUNK_SIZE)
+        probabilities = np.empty((X.shape[0], len(self.model.classes_)))
+        for start in range(0, X.shape[0], chunk_size):
+            probabilities[start:start + chunk_size] = \
+                self.model.predict_proba(X[start:start + chunk_size])
+        classes = self.model.classes_[probabilities.argmax(axis=1)]
 
         dataset['pred_rating'] = pd.Series(classes, index=dataset.index)
         for i in range(probabilities.shape[1]):
@@ -196,10 +404,13 @@ class GlobalPredictor:
         ## Return the dataset with predictions and probabilities added
         return(dataset)
     
-    def make_predictions(self, config_file):
+    def load_model(self, config_file):
         '''
-        Load in the datasets and models defined in the given configuration file,
-        then predict the importance of all articles in the datasets.
+        Load the configuration file, and the model and label encoder
+        it defines.
+
+        :param config_file: path to the global model configuration file
+        :type config_file: str
         '''
 
         logging.info('loading the configuration file')
@@ -217,20 +428,266 @@ class GlobalPredictor:
         with open(self.config['label encoder file'], 'rb') as infile:
             self.le = pickle.load(infile)
 
-        logging.info('reading in the datasets')
-        # read in the datasets
-        self.dataset = self.load_datasets()
+        return()
+
+    def make_predictions(self, config_file, n_processes=1):
+        '''
+        Load in the datasets and models defined in the given configuration file,
+        then predict the importance of all articles in the datasets.
+
+        The features that depend on the whole dataset are calculated
+        first, then the articles are predicted in shards of consecutive
+        page IDs. Each shard is read, merged, and predicted on its own,
+        by a pool of worker processes if more than one is used.
+
+        :param config_file: path to the global model configuration file
+        :type config_file: str
+
+        :param n_processes: number of processes making predictions
+        :type n_processes: int
+        '''
+
+        self.load_model(config_file)
+
+        ## The global data is only needed while predicting, and is
+        ## removed even if that fails
+        try:
+            logging.info('calculating view estimates and ranks of all articles')
+            page_ids = self.calc_global_data()
+
+            ## When predicting incrementally, only articles that are new,
+            ## whose inputs changed, or that were predicted by a different
+            ## model are predicted, the rest are carried forward from the
+            ## store.
+            if self.config.get('prediction store'):
+                self.store = predictionstore.PredictionStore(
+                    self.config['prediction store'])
+                self.model_version = self.config.get(
+                    'model version', predictionstore.model_version(
+                        self.config['model file'],
+                        self.config['label encoder file']))
+
+            # make predictions for all the pages, shard by shard, and
+            # write out a dataset
+            shards = self.make_shards(
+                page_ids, self.config.get('prediction shard size',
+                                          SHARD_SIZE))
+            logging.info('making predictions for {} articles in {} shards'.format(
+                len(page_ids), len(shards)))
+
+            ## Each shard is handed the part of the store it needs
+            if self.store is not None:
+                shards = [(shard, first_id, last_id,
+                           self.store.subset(first_id, last_id))
+                          for (shard, first_id, last_id) in shards]
+
+            pool = None
+            if n_processes > 1:
+                ## Workers read the datasets themselves, see `_init_worker`
+                pool = Pool(n_processes, initializer=_init_worker,
+                            initargs=(config_file, self.model_version))
+
+            try:
+                if pool:
+                    results = list(pool.imap(_predict_shard, shards))
+                else:
+                    results = [self.predict_shard(*shard)
+                               for shard in shards]
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
+
+            self.concatenate_shards([filename for (filename, predictions)
+                                     in results],
+                                    self.config['prediction dataset'])
+        finally:
+            self.remove_global_data()
+
+        if self.store is not None:
+            self.update_store([predictions for (filename, predictions)
+                               in results], page_ids)
+        return()
 
-        # make predictions for all the old pages and write out a dataset
-        logging.info('making predictions')
-        self.dataset = self.predict_ratings(self.dataset)
+    def reprediction_features(self):
+        '''
+        Return the features that decide whether an article is predicted
+        again when predicting incrementally, from the "reprediction
+        features" setting, by default `REPREDICTION_FEATURES`. They are
+        per-article values, so an article whose own data did not change
+        is carried forward.
+        '''
+        return(self.config.get('reprediction features',
+                               REPREDICTION_FEATURES))
+
+    def feature_tolerance(self, setting):
+        '''
+        Return the tolerance of changes in the reprediction features
+        before an article is predicted again, from the given setting:
+        "reprediction tolerance" for the absolute change and "reprediction
+        relative tolerance" for the change relative to the value the
+        article was predicted from, e.g. 0.05 for 5%. Either is a number,
+        used for all features, or a mapping of feature to tolerance where
+        features not listed have a tolerance of 0. Both default to 0, so
+        any change leads to a new prediction.
+
+        :param setting: name of the setting
+        :type setting: str
+        '''
+        tolerance = self.config.get(setting, 0.0)
+        if isinstance(tolerance, dict):
+            return(np.array([tolerance.get(feature, 0.0)
+                             for feature in self.reprediction_features()]))
+        return(tolerance)
+
+    def update_store(self, shard_predictions, page_ids):
+        '''
+        Add the new predictions made by each shard to the prediction store,
+        remove articles that are no longer in the dataset, and save it.
+
+        :param shard_predictions: the new predictions of each shard, in
+                                  order, see `predict_shard`
+        :type shard_predictions: list
+
+        :param page_ids: page IDs of all articles in the dataset
+        :type page_ids: `numpy.ndarray`
+        '''
+
+        predictions = pd.concat(shard_predictions)
+        proba_columns = [col for col in predictions.columns
+                         if col.startswith('proba_')]
+
+        self.store.update(
+            predictions.index.values,
+            predictions[self.reprediction_features()].values,
+            self.model_version,
+            predictions.pred_rating.values,
+            predictions[proba_columns].values,
+            proba_columns,
+            keep_page_ids=page_ids)
+        self.store.save()
+        return()
+
+    def make_shards(self, page_ids, shard_size):
+        '''
+        Split the given sorted page IDs into shards of consecutive page
+        IDs. Returns a list of (shard number, first page ID, last page ID)
+        tuples. There is always at least one shard, so an empty dataset
+        still gets a header.
+
+        :param page_ids: the sorted page IDs of the articles
+        :type page_ids: `numpy.ndarray`
+
+        :param shard_size: number of articles per shard
+        :type shard_size: int
+        '''
+        if not len(page_ids):
+            return([(0, 0, -1)])
+        return([(i, page_ids[start],
+                 page_ids[min(start + shard_size, len(page_ids)) - 1])
+                for (i, start) in enumerate(
+                        range(0, len(page_ids), shard_size))])
+
+    def shard_path(self, shard):
+        '''
+        Return the path to the file of predictions of the given shard.
+
+        :param shard: the shard number
+        :type shard: int
+        '''
+        return('{}.shard{:05d}'.format(self.config['prediction dataset'],
+                                       shard))
+
+    def predict_shard(self, shard, first_id, last_id, store=None):
+        '''
+        Load the articles in the given range of page IDs, predict their
+        importance and write them to the shard's file, as bz2-compressed
+        TSV with a header in the first shard only. When predicting
+        incrementally, only the stale articles are predicted. Returns a
+        tuple of the path to the shard's file and a data frame of the new
+        predictions (features, ratings and probabilities) when predicting
+        incrementally, otherwise `None`.
+
+        :param shard: the shard number
+        :type shard: int
+
+        :param first_id: lowest page ID of the shard
+        :type first_id: int
+
+        :param last_id: highest page ID of the shard
+        :type last_id: int
+
+        :param store: the previous predictions of the shard's articles,
+                      when predicting incrementally
+        :type store: `predictionstore.PredictionStore`
+        '''
+
+        shard_data = self.load_datasets(first_id, last_id)
+        new_predictions = None
+        if store is None:
+            shard_data = self.predict_ratings(shard_data)
+        else:
+            features = self.reprediction_features()
+            stale = store.stale(
+                shard_data.index.values, shard_data[features].values,
+                self.model_version,
+                tolerance=self.feature_tolerance('reprediction tolerance'),
+                relative_tolerance=self.feature_tolerance(
+                    'reprediction relative tolerance'))
+            logging.info('{} of {} articles in shard {} need new predictions'.format(stale.sum(), len(stale), shard))
+
+            predicted = self.predict_ratings(shard_data[stale].copy())
+            proba_columns = [col for col in predicted.columns
+                             if col.startswith('proba_')]
+            new_predictions = predicted[features + ['pred_rating']
+                                        + proba_columns]
+
+            ## Carry forward the stored predictions of the other articles
+            if not stale.all():
+                carried = shard_data[~stale].copy()
+                (ratings, probabilities) = store.lookup(carried.index.values)
+                carried['pred_rating'] = ratings
+                for (i, col_name) in enumerate(store.proba_columns):
+                    carried[col_name] = probabilities[:,i]
+
+                predicted = pd.concat([predicted, carried]).sort_index(
+                    kind='stable')
+            shard_data = predicted
 
         # reset the index so the page id column exists before writing it out
-        self.dataset.reset_index(inplace=True)
-        self.dataset[self.config['prediction dataset columns']].to_csv(
-            self.config['prediction dataset'], sep='\t', index=False,
+        shard_data = shard_data.reset_index()
+        filename = self.shard_path(shard)
+        shard_data[self.config['prediction dataset columns']].to_csv(
+            filename, sep='\t', index=False, header=(shard == 0),
             compression='bz2')
 
+        logging.info('wrote predictions for page IDs {} to {} to {}'.format(
+            first_id, last_id, filename))
+        return((filename, new_predictions))
+
+    def concatenate_shards(self, shard_files, output_filename):
+        '''
+        Concatenate the given shard files into the output file, then
+        delete them. A sequence of bz2 streams is a valid bz2 file, so the
+        shards are not decompressed. The output file is replaced
+        atomically once all shards are written.
+
+        :param shard_files: paths to the shard files, in order
+        :type shard_files: list
+
+        :param output_filename: path to the output file
+        :type output_filename: str
+        '''
+
+        tmp_filename = '{}-tmp{}'.format(output_filename, os.getpid())
+        with open(tmp_filename, 'wb') as outfile:
+            for filename in shard_files:
+                with open(filename, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile)
+        os.replace(tmp_filename, output_filename)
+
+        for filename in shard_files:
+            os.remove(filename)
         return()
 
 def main():
@@ -247,14 +704,18 @@ def main():
     ## YAML configuration file for the global model
     cli_parser.add_argument('config_file',
                             help='path to the global model YAML configuration file')
-    
+
+    cli_parser.add_argument('-p', '--processes', type=int, default=1,
+                            help='number of processes making predictions (default: 1)')
+
     args = cli_parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
     predictor = GlobalPredictor()
-    predictor.make_predictions(args.config_file)
+    predictor.make_predictions(args.config_file,
+                               n_processes=args.processes)
     
     return()
 
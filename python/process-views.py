@@ -25,23 +25,233 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+
 import logging
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 
 import numpy as np
+import pandas as pd
 import scipy.stats as st
 
-class ArticleData:
-    def __init__(self, page_id, view_date, num_views):
-        self.page_id = page_id
-
-        ## dict mapping date to views
-        self.views = {view_date: num_views}
+## Confidence level of the t-intervals used to label trends
+CONFIDENCE = 0.99
+
+## Windows of days that statistics are calculated for, as tuples of name and
+## the first and last day of the window, counted in days before the end date
+## of the dataset (so (6, 0) is the last seven days). A first day of None is
+## the first day of the dataset. Each window gives an average and standard
+## deviation column, "{name}_avg" and "{name}_sdev".
+WINDOWS = [('tot', None, 0),
+           ## three blocks of 28 days, oldest first
+           ('first28', 83, 56),
+           ('second28', 55, 28),
+           ('third28', 27, 0),
+           ## the four weeks of the last 28 days, oldest first
+           ('week1', 27, 21),
+           ('week2', 20, 14),
+           ('week3', 13, 7),
+           ('week4', 6, 0),
+           ## the last week, and the four and eight weeks preceding it
+           ('last_1', 6, 0),
+           ('last_4', 34, 7),
+           ('last_8', 62, 7)]
+
+## Trend labels, as tuples of the label's column name, a window, and a
+## baseline window. The label is "+" if the average of the window is above
+## the t-interval of the baseline window's average, "-" if it is below,
+## and "0" otherwise. The column follows the columns of the later of the
+## two windows.
+COMPARISONS = [('week1_label', 'week1', 'second28'),
+               ('week2_label', 'week2', 'second28'),
+               ('week3_label', 'week3', 'second28'),
+               ('week4_label', 'week4', 'second28'),
+               ('last_4_label', 'last_1', 'last_4'),
+               ('last_8_label', 'last_1', 'last_8')]
+
+def window_columns(first, last, num_days):
+    '''
+    Return the columns of a window in a matrix of `num_days` days (oldest
+    first) as a tuple of the first column and one past the last column,
+    clipped to the days in the matrix.
+
+    :param first: first day of the window, in days before the end date,
+                  or None for the first day of the matrix
+    :type first: int
+
+    :param last: last day of the window, in days before the end date
+    :type last: int
+
+    :param num_days: number of days in the matrix
+    :type num_days: int
+    '''
+    start = 0 if first is None else max(0, num_days - 1 - first)
+    end = max(start, num_days - last)
+    return((start, end))
+
+def window_statistics(views, windows=WINDOWS, comparisons=COMPARISONS,
+                      confidence=CONFIDENCE):
+    '''
+    Calculate the average and standard deviation of the views in every
+    window, and the trend labels of every comparison, for all articles
+    at once. Returns a list of tuples of column name and an array with
+    the column's value for every article.
+
+    The views are summed once into prefix sums of the views and their
+    squares, so each window costs two column differences no matter how
+    long it is or how many windows overlap.
+
+    :param views: the views, one row per article and one column per day,
+                  oldest first
+    :type views: numpy.ndarray
+
+    :param windows: the windows, see `WINDOWS`
+    :type windows: list
+
+    :param comparisons: the trend labels, see `COMPARISONS`
+    :type comparisons: list
+
+    :param confidence: confidence level of the t-intervals
+    :type confidence: float
+    '''
+
+    (num_articles, num_days) = views.shape
+
+    ## Prefix sums with a leading zero column, so a window's sum is the
+    ## difference of two columns. Squares are of the deviations from each
+    ## article's average rounded to an integer, which leaves the variance
+    ## unchanged but keeps the sums small enough to be exact.
+    views = views.astype(np.int64)
+    shift = np.rint(views.mean(axis=1)).astype(np.int64)[:, np.newaxis]
+    deviations = views - shift
+    sums = np.zeros((num_articles, num_days + 1), dtype=np.int64)
+    np.cumsum(views, axis=1, out=sums[:, 1:])
+    dev_sums = np.zeros((num_articles, num_days + 1), dtype=np.int64)
+    np.cumsum(deviations, axis=1, out=dev_sums[:, 1:])
+
+    ## n * sum of squares - sum^2 is exact in 64-bit integers unless
+    ## deviations are enormous, in which case we use floating point
+    max_deviation = float(np.abs(deviations).max()) if views.size else 0.0
+    square_type = np.int64
+    if (num_days * max_deviation) ** 2 >= 2 ** 62:
+        logging.warning('views deviate too much for exact variances, using floating point')
+        square_type = np.float64
+    deviations = deviations.astype(square_type)
+    sq_sums = np.zeros((num_articles, num_days + 1), dtype=square_type)
+    np.cumsum(deviations * deviations, axis=1, out=sq_sums[:, 1:])
+    del(deviations)
+
+    ## Average, number of days, and n² × variance of every window
+    stats = {}
+    for (name, first, last) in windows:
+        (start, end) = window_columns(first, last, num_days)
+        n_days = end - start
+        if n_days < (num_days if first is None else first + 1) - last:
+            logging.warning('window {} has only {} days of data'.format(name, n_days))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            avg = (sums[:, end] - sums[:, start]) / n_days
+        dev_sum = dev_sums[:, end] - dev_sums[:, start]
+        sq_sum = sq_sums[:, end] - sq_sums[:, start]
+        stats[name] = (avg, n_days, n_days * sq_sum - dev_sum * dev_sum)
+
+    def sdev(name):
+        (avg, n_days, var_num) = stats[name]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return(np.sqrt(var_num / (n_days * n_days)))
+
+    def t_interval(name):
+        ## as scipy.stats.t.interval, the bounds are NaN if there
+        ## is no variation
+        (avg, n_days, var_num) = stats[name]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sem = np.sqrt(var_num / (n_days * n_days * (n_days - 1)))
+            sem[var_num <= 0] = np.nan
+            quantile = st.t.ppf((1 + confidence) / 2, n_days - 1)
+        return((avg - quantile * sem, avg + quantile * sem))
+
+    ## Columns in window order, labels after the later of their windows
+    window_order = {name: i for (i, (name, first, last))
+                    in enumerate(windows)}
+    columns = []
+    for (name, first, last) in windows:
+        columns.extend([('{}_avg'.format(name), stats[name][0]),
+                        ('{}_sdev'.format(name), sdev(name))])
+        for (label, window, baseline) in comparisons:
+            if max(window_order[window], window_order[baseline]) \
+               == window_order[name]:
+                (low_bound, high_bound) = t_interval(baseline)
+                columns.append((label, trend_labels(stats[window][0],
+                                                    low_bound, high_bound)))
+
+    return(columns)
+
+def trend_labels(avg, low_bound, high_bound):
+    '''
+    Label each of the given averages "-" if it is below the low bound of the
+    interval, "+" if it is above the high bound, and "0" otherwise.
+
+    :param avg: the averages
+    :type avg: numpy.ndarray
+
+    :param low_bound: low bounds of the intervals
+    :type low_bound: numpy.ndarray
+
+    :param high_bound: high bounds of the intervals
+    :type high_bound: numpy.ndarray
+    '''
+    with np.errstate(invalid='ignore'):
+        return(np.where(avg < low_bound, '-',
+                        np.where(avg > high_bound, '+', '0')))
 
 class ViewProcessor:
     def __init__(self):
         pass
 
+    def read_views(self, input_filename, end_date, num_days):
+        '''
+        Read a dataset of view data into a dense matrix of views with one row
+        per article and one column per day, the oldest day first. Days without
+        data have zero views. Returns a tuple of an array of page IDs (as
+        strings, in the order they first appear in the dataset) and the
+        matrix.
+
+        :parameter input_filename: path to the input TSV file
+        :type input_filename: str
+
+        :parameter end_date: last day of data in the dataset
+        :type end_date: datetime.date
+
+        :parameter num_days: number of days of data in the dataset
+        :type num_days: int
+        '''
+
+        data = pd.read_csv(input_filename, sep='\t', header=0,
+                           names=['page_id', 'view_date', 'num_views'],
+                           dtype={'page_id': str, 'view_date': str,
+                                  'num_views': np.int64},
+                           keep_default_na=False)
+
+        ## Page IDs are numbered in the order they first appear,
+        ## and dates are parsed once per distinct date
+        (rows, page_ids) = pd.factorize(data['page_id'])
+        (date_codes, dates) = pd.factorize(data['view_date'])
+        start_date = end_date - timedelta(days=num_days -1)
+        date_cols = np.array(
+            [(datetime.strptime(view_date, '%Y-%m-%d').date() - start_date).days
+             for view_date in dates], dtype=np.int64)
+        cols = date_cols[date_codes]
+
+        in_window = (cols >= 0) & (cols < num_days)
+        if not in_window.all():
+            logging.warning('ignoring {} rows of data outside the {} days ending {}'.format((~in_window).sum(), num_days, end_date))
+
+        views = np.zeros((len(page_ids), num_days), dtype=np.int32)
+        views[rows[in_window], cols[in_window]] = data['num_views'].values[in_window]
+
+        logging.info('read {} rows of views for {} articles, {} days without data were set to zero'.format(len(data), len(page_ids), views.size - in_window.sum()))
+
+        return((np.asarray(page_ids), views))
+
     def process_views(self, input_filename, output_filename,
                       end_date, num_days):
         '''
@@ -65,217 +275,24 @@ class ViewProcessor:
 
         ## parse the end date
         end_date_obj = datetime.strptime(end_date, '%Y%m%d').date()
-        
-        ## mapping page ID to page data
-        articles = {}
-
-        ## slurp in the data
-        with open(input_filename, 'r', encoding='utf-8') as infile:
-            infile.readline() # skip header
-            for line in infile:
-                (page_id, view_date, num_views) = line.strip().split('\t')
-                view_date = datetime.strptime(view_date, '%Y-%m-%d').date()
-
-                if page_id in articles:
-                    articles[page_id].views[view_date] = int(num_views)
-                else:
-                    articles[page_id] = ArticleData(page_id,
-                                                    view_date,
-                                                    int(num_views))
 
+        (page_ids, views) = self.read_views(input_filename, end_date_obj,
+                                            num_days)
         logging.info('slurped in data')
 
-        # helpful single day delta
-        one_day = timedelta(days=1)
-        
-        ## process the data
-        ## first: go through everything and add zero views where missing
-        for art_data in articles.values():
-            sorted_views = [] # processing is easier with a sorted list
-            cur_date = end_date_obj - timedelta(days=num_days -1)
-            while cur_date <= end_date_obj:
-                if not cur_date in art_data.views:
-                    logging.info('found {} missing data, adding zero'.format(cur_date))
-                    art_data.views[cur_date] = 0
-
-                sorted_views.append(art_data.views[cur_date])
-                cur_date += one_day
-
-
-            # flip it around so the most recent data is first.
-            sorted_views.reverse()
-            art_data.sorted_views = sorted_views
-                
-        ## For each article, I want to know:
-        ## avg views across the whole timespan
-        ## avg views for first, second, and third set of 28 days
-        ## avg views for each of the last four weeks
-        for art_data in articles.values():
-            logging.info('processing {}'.format(art_data.page_id))
-
-            start_date = end_date_obj - timedelta(days=num_days -1)
-            end_first_28 = start_date + timedelta(days=27)
-            start_second_28 = start_date + timedelta(days=28)
-            end_second_28 = start_second_28 + timedelta(days=27)
-            start_third_28 = start_second_28 + timedelta(days=28)
-
-            start_week_1 = end_date_obj - timedelta(days=27)
-            end_week_1 = start_week_1 + timedelta(days=6)
-            start_week_2 = end_date_obj - timedelta(days=20)
-            end_week_2 = start_week_2 + timedelta(days=6)
-            start_week_3 = end_date_obj - timedelta(days=13)
-            end_week_3 = start_week_3 + timedelta(days=6)
-            start_week_4 = end_date_obj - timedelta(days=6)
-           
-            first_28 = []
-            cur_date = start_date
-            while cur_date <= end_first_28:
-                first_28.append(art_data.views[cur_date])
-                cur_date += one_day
-
-            logging.info('populated first_28 with {} values'.format(len(first_28)))
-            
-            second_28 = []
-            cur_date = start_second_28
-            while cur_date <= end_second_28:
-                second_28.append(art_data.views[cur_date])
-                cur_date += one_day
-
-            logging.info('populated second_28 with {} values'.format(len(second_28)))
-                
-            third_28 = []
-            cur_date = start_third_28
-            while cur_date <= end_date_obj:
-                third_28.append(art_data.views[cur_date])
-                cur_date += one_day
-
-            logging.info('populated third_28 with {} values'.format(len(third_28)))
-            
-            week_1 = []
-            cur_date = start_week_1
-            while cur_date <= end_week_1:
-                week_1.append(art_data.views[cur_date])
-                cur_date += one_day
-            
-            week_2 = []
-            cur_date = start_week_2
-            while cur_date <= end_week_2:
-                week_2.append(art_data.views[cur_date])
-                cur_date += one_day
-            
-            week_3 = []
-            cur_date = start_week_3
-            while cur_date <= end_week_3:
-                week_3.append(art_data.views[cur_date])
-                cur_date += one_day
-            
-            week_4 = []
-            cur_date = start_week_4
-            while cur_date <= end_date_obj:
-                week_4.append(art_data.views[cur_date])
-                cur_date += one_day
-
-            art_data.tot_avg = np.mean(list(art_data.views.values()))
-            art_data.tot_sdev = np.std(list(art_data.views.values()))
-            
-            art_data.first28_avg = np.mean(first_28)
-            art_data.first28_sdev = np.std(first_28)
-            
-            art_data.second28_avg = np.mean(second_28)
-            art_data.second28_sdev = np.std(second_28)
-            
-            art_data.third28_avg = np.mean(third_28)
-            art_data.third28_sdev = np.std(third_28)
-            
-            art_data.week1_avg = np.mean(week_1)
-            art_data.week1_sdev = np.std(week_1)
-            
-            art_data.week2_avg = np.mean(week_2)
-            art_data.week2_sdev = np.std(week_2)
-            
-            art_data.week3_avg = np.mean(week_3)
-            art_data.week3_sdev = np.std(week_3)
-            
-            art_data.week4_avg = np.mean(week_4)
-            art_data.week4_sdev = np.std(week_4)
-
-            ## New approach:
-            ## Calculate a 99% confidence interval based on the second
-            ## 28-day interval. Then use that to label each of the four
-            ## weeks succeeding it.
-            (low_bound, high_bound) = st.t.interval(0.99,
-                                                    len(second_28)-1,
-                                                    loc=np.mean(second_28),
-                                                    scale=st.sem(second_28))
-            art_data.week1_label = "0"
-            if art_data.week1_avg < low_bound:
-                art_data.week1_label = "-"
-            elif art_data.week1_avg > high_bound:
-                art_data.week1_label = "+"
-
-            art_data.week2_label = "0"
-            if art_data.week2_avg < low_bound:
-                art_data.week2_label = "-"
-            elif art_data.week2_avg > high_bound:
-                art_data.week2_label = "+"
-
-            art_data.week3_label = "0"
-            if art_data.week3_avg < low_bound:
-                art_data.week3_label = "-"
-            elif art_data.week3_avg > high_bound:
-                art_data.week3_label = "+"
-
-            art_data.week4_label = "0"
-            if art_data.week4_avg < low_bound:
-                art_data.week4_label = "-"
-            elif art_data.week4_avg > high_bound:
-                art_data.week4_label = "+"
-
-            ## Newer approach:
-            ## Calculate the mean of the most recent week,
-            ## then calculate the mean of the four & eight weeks preceeding.
-            ## Calculate a 99% CI for the second mean and check if the first
-            ## is outside of it. If it's positive, label it "+", negative
-            ## label it "-", otherwise label it "0"
-            ## I also want std.dev of the last week as a ratio of the mean
-            ## of the four/eight weeks preceeding it, but I can just calculate
-            ## that in R.
-            sorted_views = art_data.sorted_views
-
-            art_data.last_1_avg = np.mean(sorted_views[:7])
-            art_data.last_1_sdev = np.std(sorted_views[:7])
-
-            last_4 = sorted_views[7:35]
-            art_data.last_4_avg = np.mean(last_4)
-            art_data.last_4_sdev = np.std(last_4)
-            (low_bound, high_bound) = st.t.interval(0.99,
-                                                    len(last_4)-1,
-                                                    loc=np.mean(last_4),
-                                                    scale=st.sem(last_4))
-            art_data.last_4_label = "0"
-            if art_data.last_1_avg < low_bound:
-                art_data.last_4_label = "-"
-            elif art_data.last_1_avg > high_bound:
-                art_data.last_4_label = "+"
-
-            last_8 = sorted_views[7:63]
-            art_data.last_8_avg = np.mean(last_8)
-            art_data.last_8_sdev = np.std(last_8)
-            (low_bound, high_bound) = st.t.interval(0.99,
-                                                    len(last_8)-1,
-                                                    loc=np.mean(last_8),
-                                                    scale=st.sem(last_8))
-            art_data.last_8_label = "0"
-            if art_data.last_1_avg < low_bound:
-                art_data.last_8_label = "-"
-            elif art_data.last_1_avg > high_bound:
-                art_data.last_8_label = "+"
-                            
-        ## write out new data
+        columns = window_statistics(views)
+        logging.info('calculated statistics for {} articles'.format(
+            len(page_ids)))
+
+        ## write out new data, formatting numbers as Python does
+        col_values = [page_ids.tolist()] + \
+                     [[str(value) for value in values.tolist()]
+                      for (name, values) in columns]
         with open(output_filename, 'w', encoding='utf-8') as outfile:
-            outfile.write('page_id\ttot_avg\ttot_sdev\tfirst28_avg\tfirst28_sdev\tsecond28_avg\tsecond28_sdev\tthird28_avg\tthird28_sdev\tweek1_avg\tweek1_sdev\tweek1_label\tweek2_avg\tweek2_sdev\tweek2_label\tweek3_avg\tweek3_sdev\tweek3_label\tweek4_avg\tweek4_sdev\tweek4_label\tlast_1_avg\tlast_1_sdev\tlast_4_avg\tlast_4_sdev\tlast_4_label\tlast_8_avg\tlast_8_sdev\tlast_8_label\n') # write header
-            for art_data in articles.values():
-                outfile.write('{0.page_id}\t{0.tot_avg}\t{0.tot_sdev}\t{0.first28_avg}\t{0.first28_sdev}\t{0.second28_avg}\t{0.second28_sdev}\t{0.third28_avg}\t{0.third28_sdev}\t{0.week1_avg}\t{0.week1_sdev}\t{0.week1_label}\t{0.week2_avg}\t{0.week2_sdev}\t{0.week2_label}\t{0.week3_avg}\t{0.week3_sdev}\t{0.week3_label}\t{0.week4_avg}\t{0.week4_sdev}\t{0.week4_label}\t{0.last_1_avg}\t{0.last_1_sdev}\t{0.last_4_avg}\t{0.last_4_sdev}\t{0.last_4_label}\t{0.last_8_avg}\t{0.last_8_sdev}\t{0.last_8_label}\n'.format(art_data))
+            outfile.write('page_id\t{}\n'.format(
+                '\t'.join([name for (name, values) in columns]))) # write header
+            for row in zip(*col_values):
+                outfile.write('{}\n'.format('\t'.join(row)))
 
         # ok, done!
         return()
@@ -28,7 +28,8 @@ SOFTWARE.
 import logging
 
 import requests
-from time import sleep
+
+import wdcache
 
 class WikidataItem:
     def __init__(self, qid):
@@ -80,46 +81,29 @@ class WDResolver:
 
                 all_items[item.qid] = item
 
-        # query Wikidata for the English label associated with these items
+        # query Wikidata for the English label associated with these items,
+        # reading through the entity store
+        entity_store = wdcache.open_store()
         wd_session = requests.Session()
         i = 0
         item_list = list(all_items.values())
         while i < len(item_list):
             subset = item_list[i : i + self.slice_size]
-            item_url = "{base}{idlist}".format(
-                base=self.wd_url, idlist="|".join([i.qid for i in subset]))
-            response = wd_session.get(item_url)
-            sleep(0.01)
-            if response.status_code != 200:
-                logging.warning('Wikidata returned status {}'.format(response.status_code))
-                continue
-
-            try:
-                content = response.json()
-                entity_data = content['entities']
-            except ValueError:
-                logging.warning('Unable to decode Wikidata response as JSON')
-            except KeyError:
-                logging.warning("Wikidata response keys not as expected")
+            entity_data = entity_store.get_entities(
+                [i.qid for i in subset],
+                fetch=lambda qids, props: wdcache.fetch_entities(
+                    qids, props, session=wd_session))
 
             ## Iterate over the entities
             ## The QID is in entity['id']
-            for entity in entity_data.values():
-                try:
-                    qid = entity['id']
-                except KeyError:
-                    logging.warning('unable to get QID for {}'.format(entity['id']))
-                    continue
-
+            for (qid, entity) in entity_data.items():
                 item = all_items[qid]
 
                 try:
-                    label = entity['labels']['en']['value']
+                    item.label = entity['labels']['en']['value']
                 except KeyError:
                     logging.warning('unable to get label for {}'.format(qid))
 
-                item.label = label
-                    
             i += self.slice_size
 
         with open(output_filename, 'w', encoding='utf-8') as outfile:
@@ -0,0 +1,317 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Script to benchmark the "slice" and "set" sync modes of `Viewrates` (see
+`sync_mode` in the configuration) against a MySQL/MariaDB server, e.g. a
+local stand-in for the analytics database.
+
+Creates synthetic page, snapshot, and new page tables (using the table names
+from the configuration file with a prefix, so existing tables are never
+touched), then for each mode loads the same data, times deleting pages,
+adding pages, and checking new pages, and checks that both modes leave
+the tables in the same state.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import time
+import random
+import hashlib
+import logging
+import datetime as dt
+
+import db
+
+from update_viewrates import Viewrates, MAWindow, INSERT_BATCH_SIZE
+
+## Configuration keys of the tables used in the benchmark, these get
+## the benchmark prefix added to their names
+BENCH_TABLES = ['page_table', 'newpage_table', 'newpage_data_table',
+                'page_snapshot_table', 'redirect_snapshot_table',
+                'temp_diff_table']
+
+## Queries to create the benchmark tables, matching dbstore-tables.sql
+## and the snapshots created by `Viewrates.make_snapshots`
+CREATE_QUERIES = [
+    '''CREATE TABLE {page_table} (
+         page_id INT UNSIGNED NOT NULL PRIMARY KEY,
+         page_title VARCHAR(255) BINARY NOT NULL,
+         num_views INT DEFAULT 0)''',
+    '''CREATE TABLE {newpage_table} (
+         page_id INT UNSIGNED NOT NULL PRIMARY KEY,
+         first_edit DATETIME)''',
+    '''CREATE TABLE {newpage_data_table} (
+         page_id INT UNSIGNED NOT NULL,
+         view_date DATE NOT NULL,
+         num_views INT DEFAULT 0,
+         PRIMARY KEY (page_id, view_date))''',
+    '''CREATE TABLE {page_snapshot_table} (
+         page_id INT UNSIGNED NOT NULL,
+         page_title VARBINARY(255) NOT NULL,
+         INDEX (page_id))''',
+    '''CREATE TABLE {redirect_snapshot_table} (
+         rd_from INT UNSIGNED NOT NULL,
+         rd_to INT UNSIGNED NOT NULL,
+         INDEX rd_from_to (rd_from, rd_to),
+         INDEX rd_to_from (rd_to, rd_from))''']
+
+## Queries to insert the synthetic data, in the order of `make_data`
+INSERT_QUERIES = [
+    '''INSERT INTO {page_table} VALUES (%s, %s, %s)''',
+    '''INSERT INTO {newpage_table} VALUES (%s, %s)''',
+    '''INSERT INTO {newpage_data_table} VALUES (%s, %s, %s)''',
+    '''INSERT INTO {page_snapshot_table} VALUES (%s, %s)''',
+    '''INSERT INTO {redirect_snapshot_table} VALUES (%s, %s)''']
+
+## Queries used to compare the state of the tables after a sync
+DIGEST_QUERIES = [
+    '''SELECT page_id, page_title, num_views FROM {page_table}
+       ORDER BY page_id''',
+    '''SELECT page_id, first_edit FROM {newpage_table} ORDER BY page_id''',
+    '''SELECT page_id, view_date, num_views FROM {newpage_data_table}
+       ORDER BY page_id, view_date''',
+    '''SELECT rd_from, rd_to FROM {redirect_snapshot_table}
+       ORDER BY rd_from, rd_to''']
+
+def make_data(n_pages, churn, newpage_share, today, k, seed):
+    '''
+    Make a synthetic dataset of our tables and a snapshot that differs
+    from them. Returns a tuple of lists of rows for the page, new page,
+    new page data, page snapshot, and redirect snapshot tables.
+
+    :param n_pages: number of pages in our page table
+    :type n_pages: int
+
+    :param churn: share of pages deleted, and of pages added, in the snapshot
+    :type churn: float
+
+    :param newpage_share: share of pages that are new pages
+    :type newpage_share: float
+
+    :param today: date of the synthetic update
+    :type today: datetime.date
+
+    :param k: size of the moving average window, in days
+    :type k: int
+
+    :param seed: seed of the random number generator
+    :type seed: int
+    '''
+    rng = random.Random(seed)
+
+    pages = [(page_id, 'Page_{}'.format(page_id), rng.randint(0, 10000))
+             for page_id in range(1, n_pages + 1)]
+
+    ## New pages were created within the past two windows, so about half
+    ## of them are old enough to be moved out of the new page tables.
+    newpages = []
+    newpage_data = []
+    for (page_id, page_title, num_views) in pages:
+        if rng.random() >= newpage_share:
+            continue
+        age = rng.randint(0, 2 * k)
+        newpages.append((page_id, dt.datetime.combine(
+            today - dt.timedelta(days=age), dt.time(rng.randint(0, 23)))))
+        for i in range(min(age, k) + 1):
+            newpage_data.append((page_id, today - dt.timedelta(days=i),
+                                 rng.randint(0, 100)))
+
+    ## The snapshot has all pages except the deleted ones, plus new pages
+    ## and new redirects, some of which point to new pages. Some redirects
+    ## originate outside the main namespace (their page isn't in the
+    ## snapshot) and should be deleted.
+    n_churn = int(n_pages * churn)
+    deleted = set(rng.sample(range(1, n_pages + 1), n_churn))
+    snapshot = [(page_id, page_title.encode('utf-8'))
+                for (page_id, page_title, num_views) in pages
+                if page_id not in deleted]
+    redirects = []
+    for page_id in range(n_pages + 1, n_pages + n_churn + 1):
+        snapshot.append((page_id, 'Page_{}'.format(page_id).encode('utf-8')))
+        if rng.random() < 0.3:
+            redirects.append((page_id, rng.randint(1, n_pages + n_churn)))
+    for page_id in range(n_pages + n_churn + 1,
+                         n_pages + n_churn + n_churn // 10 + 1):
+        redirects.append((page_id, rng.randint(1, n_pages)))
+
+    return((pages, newpages, newpage_data, snapshot, redirects))
+
+def load_tables(rates, data):
+    '''
+    Drop and recreate the benchmark tables and load the given data.
+
+    :param rates: the view rate updater, with benchmark table names
+    :type rates: `update_viewrates.Viewrates`
+
+    :param data: rows of the tables, see `make_data`
+    :type data: tuple
+    '''
+
+    with db.cursor(rates.db_conn) as db_cursor:
+        drop_tables(rates, db_cursor)
+        for (create_query, insert_query, rows) in zip(CREATE_QUERIES,
+                                                      INSERT_QUERIES, data):
+            db_cursor.execute(create_query.format_map(rates.config))
+            insert_query = insert_query.format_map(rates.config)
+            i = 0
+            while i < len(rows):
+                db_cursor.executemany(insert_query,
+                                      rows[i : i + INSERT_BATCH_SIZE])
+                i += INSERT_BATCH_SIZE
+    rates.db_conn.commit()
+    return()
+
+def drop_tables(rates, db_cursor):
+    '''
+    Drop the benchmark tables.
+    '''
+    for table in BENCH_TABLES:
+        if table != 'temp_diff_table':
+            db_cursor.execute('DROP TABLE IF EXISTS {}'.format(
+                rates.config[table]))
+    return()
+
+def digest_tables(rates):
+    '''
+    Return a digest of the contents of the tables changed by a sync.
+
+    :param rates: the view rate updater, with benchmark table names
+    :type rates: `update_viewrates.Viewrates`
+    '''
+    digest = hashlib.sha1()
+    with db.cursor(rates.db_conn, 'ss') as db_cursor:
+        for digest_query in DIGEST_QUERIES:
+            db_cursor.execute(digest_query.format_map(rates.config))
+            for row in db_cursor:
+                digest.update(repr(row).encode('utf-8'))
+    return(digest.hexdigest())
+
+def run_sync(rates, sliding_window):
+    '''
+    Run the parts of an update that sync our tables with the snapshot,
+    returning a list of tuples of step name and its time in seconds.
+
+    :param rates: the view rate updater, with benchmark table names
+    :type rates: `update_viewrates.Viewrates`
+
+    :param sliding_window: the moving average sliding window
+    :type sliding_window: dict
+    '''
+    timings = []
+    steps = [('delete_pages_and_redirects', rates.delete_pages_and_redirects),
+             ('add_pages', rates.add_pages),
+             ('check_new_pages',
+              lambda: rates.check_new_pages(sliding_window))]
+    for (step, method) in steps:
+        start = time.perf_counter()
+        method()
+        timings.append((step, time.perf_counter() - start))
+    return(timings)
+
+def main():
+    import argparse
+
+    cli_parser = argparse.ArgumentParser(
+        description="script to benchmark the slice and set sync modes of the view rate updater"
+    )
+
+    # Verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='write informational output')
+
+    # YAML configuration file
+    cli_parser.add_argument('config_file',
+                            help='path to the YAML configuration file, with the database to benchmark against')
+
+    cli_parser.add_argument('-n', '--pages', type=int, default=100000,
+                            help='number of pages in the synthetic page table (default: 100,000)')
+
+    cli_parser.add_argument('--churn', type=float, default=0.05,
+                            help='share of pages deleted and added in the snapshot (default: 0.05)')
+
+    cli_parser.add_argument('--newpage-share', type=float, default=0.02,
+                            help='share of pages that are new pages (default: 0.02)')
+
+    cli_parser.add_argument('--prefix', type=str, default='bench_',
+                            help='prefix added to the table names (default: bench_)')
+
+    cli_parser.add_argument('--seed', type=int, default=42,
+                            help='seed of the random number generator')
+
+    cli_parser.add_argument('--keep', action='store_true',
+                            help='keep the benchmark tables afterwards')
+
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    rates = Viewrates(args.config_file)
+    for table in BENCH_TABLES:
+        rates.config[table] = '{}{}'.format(args.prefix, rates.config[table])
+
+    today = dt.date.today()
+    k = rates.config['k']
+    sliding_window = {'old': MAWindow(today - dt.timedelta(days=k),
+                                      today - dt.timedelta(days=1)),
+                      'new': MAWindow(today - dt.timedelta(days=k - 1),
+                                      today)}
+
+    data = make_data(args.pages, args.churn, args.newpage_share,
+                     today, k, args.seed)
+
+    rates.db_conn = db.connect(rates.config['db_server'],
+                               rates.config['db_name'],
+                               rates.config['db_config_file'])
+
+    results = {}
+    for sync_mode in ['slice', 'set']:
+        rates.config['sync_mode'] = sync_mode
+        load_tables(rates, data)
+        timings = run_sync(rates, sliding_window)
+        results[sync_mode] = (timings, digest_tables(rates))
+
+    if not args.keep:
+        with db.cursor(rates.db_conn) as db_cursor:
+            drop_tables(rates, db_cursor)
+        rates.db_conn.commit()
+    db.disconnect(rates.db_conn)
+
+    print('{} pages, {} deleted, {} added, {} new pages'.format(
+        args.pages, int(args.pages * args.churn),
+        int(args.pages * args.churn), len(data[1])))
+    print('{:<30}{:>12}{:>12}'.format('step', 'slice (s)', 'set (s)'))
+    for ((step, slice_time), (step, set_time)) in zip(results['slice'][0],
+                                                     results['set'][0]):
+        print('{:<30}{:>12.2f}{:>12.2f}'.format(step, slice_time, set_time))
+    print('{:<30}{:>12.2f}{:>12.2f}'.format(
+        'total', sum(t for (s, t) in results['slice'][0]),
+        sum(t for (s, t) in results['set'][0])))
+
+    if results['slice'][1] == results['set'][1]:
+        print('both modes left the tables in the same state')
+    else:
+        print('WARNING: the modes left the tables in different states')
+
+    return()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+-- Adds the columns used to checkpoint an update in progress to a status
+-- table created before updates could be resumed (see dbstore-tables.sql)
+ALTER TABLE nettrom_vr_status
+    ADD COLUMN run_timestamp DATETIME DEFAULT NULL,
+    ADD COLUMN run_stage VARCHAR(32) DEFAULT NULL,
+    ADD COLUMN run_data MEDIUMTEXT DEFAULT NULL;
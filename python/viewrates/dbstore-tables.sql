@@ -4,9 +4,12 @@ DROP TABLE IF EXISTS nettrom_vr_newpage;
 DROP TABLE IF EXISTS nettrom_vr_newpage_data;
 
 CREATE TABLE nettrom_vr_status (
-    latest_update DATETIME DEFAULT NULL
+    latest_update DATETIME DEFAULT NULL,
+    run_timestamp DATETIME DEFAULT NULL,
+    run_stage VARCHAR(32) DEFAULT NULL,
+    run_data MEDIUMTEXT DEFAULT NULL
 );
-INSERT INTO nettrom_vr_status VALUES (NULL);
+INSERT INTO nettrom_vr_status (latest_update) VALUES (NULL);
 
 CREATE TABLE nettrom_vr_page (
     page_id INT UNSIGNED NOT NULL PRIMARY KEY,
@@ -0,0 +1,158 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for a local cache of the time of the first edit of pages, so that
+a page's first edit only has to be looked up in the database once.
+
+The cache is a single NumPy `.npz` file with two arrays: page IDs, sorted,
+and the timestamp of each page's first edit as an integer on the form
+YYYYMMDDHHMMSS (MediaWiki's timestamp format). The first edit of a page
+is assumed not to change once it has been seen.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import logging
+import datetime as dt
+
+import numpy as np
+
+def parse_timestamp(timestamp):
+    '''
+    Convert a MediaWiki timestamp (YYYYMMDDHHMMSS, as bytes, str, or int)
+    to a `datetime.datetime` object.
+
+    :param timestamp: the timestamp
+    :type timestamp: bytes, str, or int
+    '''
+    if isinstance(timestamp, bytes):
+        timestamp = timestamp.decode('utf-8')
+    return(dt.datetime.strptime(str(timestamp), '%Y%m%d%H%M%S'))
+
+class FirstEditCache:
+    '''
+    A local cache of the first edit of pages.
+    '''
+    def __init__(self, path):
+        '''
+        :param path: path to the cache file, which is created when the cache
+                     is first saved
+        :type path: str
+        '''
+        self.path = os.path.expanduser(path)
+        self.page_ids = np.array([], dtype=np.int64)
+        self.timestamps = np.array([], dtype=np.int64)
+
+        ## First edits added since the cache was read
+        self.new_page_ids = []
+        self.new_timestamps = []
+
+        if os.path.exists(self.path):
+            with np.load(self.path) as cache_data:
+                self.page_ids = cache_data['page_id']
+                self.timestamps = cache_data['timestamp']
+            logging.info('read first edits of {} pages from {}'.format(
+                len(self.page_ids), self.path))
+
+    def __len__(self):
+        return(len(self.page_ids))
+
+    def lookup(self, page_ids):
+        '''
+        Look up the first edits of the given pages. Returns a tuple of a list
+        of (page ID, first edit) tuples of the pages in the cache, where the
+        first edit is a `datetime.datetime` object, and a list of the page
+        IDs of the pages that are not in the cache.
+
+        :param page_ids: page IDs of the pages to look up
+        :type page_ids: list
+        '''
+
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        if not len(self.page_ids) or not len(page_ids):
+            return(([], page_ids.tolist()))
+
+        pos = np.searchsorted(self.page_ids, page_ids)
+        pos[pos == len(self.page_ids)] = 0
+        found = self.page_ids[pos] == page_ids
+
+        first_edits = [(page_id, parse_timestamp(timestamp))
+                       for (page_id, timestamp)
+                       in zip(page_ids[found].tolist(),
+                              self.timestamps[pos[found]].tolist())]
+        return((first_edits, page_ids[~found].tolist()))
+
+    def add(self, page_id, timestamp):
+        '''
+        Add the first edit of a page to the cache. The cache file is not
+        updated until `save` is called.
+
+        :param page_id: the page's ID
+        :type page_id: int
+
+        :param timestamp: MediaWiki timestamp of the page's first edit
+        :type timestamp: bytes, str, or int
+        '''
+        if isinstance(timestamp, bytes):
+            timestamp = timestamp.decode('utf-8')
+        self.new_page_ids.append(page_id)
+        self.new_timestamps.append(int(timestamp))
+        return()
+
+    def save(self):
+        '''
+        Merge the first edits added since the cache was read into it and
+        write the cache file. The file is replaced atomically, so an
+        interrupted save leaves the previous cache intact.
+        '''
+
+        if not self.new_page_ids:
+            return()
+
+        page_ids = np.concatenate(
+            (self.page_ids, np.array(self.new_page_ids, dtype=np.int64)))
+        timestamps = np.concatenate(
+            (self.timestamps, np.array(self.new_timestamps, dtype=np.int64)))
+
+        ## Sort on page ID, keeping the most recently added first edit
+        ## of pages that were added more than once
+        order = np.argsort(page_ids, kind='stable')
+        page_ids = page_ids[order]
+        timestamps = timestamps[order]
+        last = np.concatenate((page_ids[1:] != page_ids[:-1], [True]))
+        self.page_ids = page_ids[last]
+        self.timestamps = timestamps[last]
+        self.new_page_ids = []
+        self.new_timestamps = []
+
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = '{}-tmp{}'.format(self.path, os.getpid())
+        with open(tmp_path, 'wb') as outfile:
+            np.savez(outfile, page_id=self.page_ids,
+                     timestamp=self.timestamps)
+        os.replace(tmp_path, self.path)
+
+        logging.info('saved first edits of {} pages to {}'.format(
+            len(self.page_ids), self.path))
+        return()
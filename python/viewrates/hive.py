@@ -25,15 +25,24 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import time
 import logging
 import subprocess
 
 from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+## Number of table rows per sqoop mapper, and the most mappers
+## a transfer uses, see `mappers_for_rows`
+ROWS_PER_MAPPER = 1000000
+MAX_MAPPERS = 8
 
 def make_where_datespan(start_date, end_date, prefix=''):
     '''
     The data in Hadoop might be partitioned by year, month, and day,
     so we'll have to have all dates in the range in our where clause.
+    An empty range (`start_date` after `end_date`) gives a condition
+    that is always false.
 
     :param start_date: first date to include in the range
     :type start_date datetime.date
@@ -54,9 +63,34 @@ def make_where_datespan(start_date, end_date, prefix=''):
 
         i += one_day
 
+    if not dates:
+        return('FALSE')
+
     return(' OR '.join(dates))
 
-def exec_beeline(query, output_file=None, priority=False):
+def run_command(command):
+    '''
+    Run the given shell command, returning its exit code, or None if it could
+    not be run. This is the default command runner of the functions in this
+    module, any function that takes a command and returns an exit code can
+    be used in its place (e.g. to run fake `sqoop` and `beeline` scripts).
+
+    :param command: the shell command to run
+    :type command: str
+    '''
+
+    retcode = None
+    try:
+        retcode = subprocess.call(command, shell=True)
+        if retcode < 0:
+            logging.error("child was terminated by signal {}".format(-retcode))
+        else:
+            logging.info("child returned {}".format(retcode))
+    except OSError as e:
+        logging.error("Execution of `{}` failed: {}".format(command, e))
+    return(retcode)
+
+def exec_beeline(query, output_file=None, priority=False, runner=run_command):
     '''
     Execute a call to `beeline` to execute the given query, as priority
     if set.
@@ -69,6 +103,9 @@ def exec_beeline(query, output_file=None, priority=False):
 
     :param priority: ask to give this query priority?
     :type priority: bool
+
+    :param runner: function used to run the command, see `run_command`
+    :type runner: function
     '''
 
     if priority:
@@ -79,18 +116,9 @@ def exec_beeline(query, output_file=None, priority=False):
         command = "{} > {}".format(command, output_file)
         
     logging.info('executing {}'.format(command))
-    retcode = None
-    try:
-        retcode = subprocess.call(command, shell=True)
-        if retcode < 0:
-            logging.error("child was terminated by signal {}".format(-retcode))
-        else:
-            logging.info("child returned {}".format(retcode))
-    except OSError as e:
-        logging.error("Beeline execution failed: {}".format(e))
-    return(retcode)
+    return(runner(command))
 
-def exec_hql(hql_file, output_file=None):
+def exec_hql(hql_file, output_file=None, runner=run_command):
     '''
     Execute a call to `beeline` so that the given HQL file is an input file
     with query commands.  Optionally redirecting the output to the given
@@ -101,6 +129,9 @@ def exec_hql(hql_file, output_file=None):
 
     :param output_file: path to the output file
     :type output_file: str
+
+    :param runner: function used to run the command, see `run_command`
+    :type runner: function
     '''
 
     command = 'beeline -f {}'.format(hql_file)
@@ -108,20 +139,60 @@ def exec_hql(hql_file, output_file=None):
         command = '{} > {}'.format(command, output_file)
 
     logging.info('`executing {}`'.format(command))
-    retcode = None
-    try:
-        retcode = subprocess.call(command, shell=True)
-        if retcode < 0:
-            logging.error("child was terminated by signal {}".format(-retcode))
-        else:
-            logging.info("child returned {}".format(retcode))
-    except OSError as e:
-        logging.error("Beeline HQL file execution failed: {}".format(e))
-    return(retcode)
+    return(runner(command))
+
+def mappers_for_rows(n_rows, rows_per_mapper=ROWS_PER_MAPPER,
+                     max_mappers=MAX_MAPPERS):
+    '''
+    Choose the number of sqoop mappers for a transfer of a table with the
+    given number of rows: one per `rows_per_mapper` rows, at least one
+    and at most `max_mappers`.
+
+    :param n_rows: number of rows in the table
+    :type n_rows: int
+
+    :param rows_per_mapper: number of rows per mapper
+    :type rows_per_mapper: int
+
+    :param max_mappers: the most mappers to use
+    :type max_mappers: int
+    '''
+    n_mappers = -(-n_rows // rows_per_mapper) # rounds up
+    return(max(1, min(max_mappers, n_mappers)))
+
+def make_export_command(hostname, dest_db, target_table, hive_table_path,
+                        username, password_file, extra_opts=None,
+                        num_mappers=None):
+    '''
+    Make the `sqoop export` command that exports a table from Hadoop into
+    a MySQL database, see `sqoop_export_table`.
+
+    :param num_mappers: number of mappers to use, the sqoop default if None
+    :type num_mappers: int
+    '''
+
+    sqoop_command = """sqoop export \
+  --connect jdbc:mysql://{hostname}/{database} \
+  --username {username} \
+  --password-file {pwd_file} \
+  --export-dir {hive_table_path} \
+  --table {target_table} \
+  --input-fields-terminated-by '\001' \
+  --mysql-delimiters""".format(hostname=hostname, database=dest_db,
+                               username=username, pwd_file=password_file,
+                               hive_table_path=hive_table_path,
+                               target_table=target_table)
+    if num_mappers:
+        sqoop_command = "{} --num-mappers {}".format(sqoop_command,
+                                                      num_mappers)
+    if extra_opts:
+        sqoop_command = "{} {}".format(sqoop_command, extra_opts)
+
+    return(sqoop_command)
 
 def sqoop_export_table(hostname, dest_db, target_table, hive_table_path,
                        username, password_file,
-                       extra_opts=None):
+                       extra_opts=None, num_mappers=None, runner=run_command):
     '''
     Use `sqoop export` to export a datable from Hadoop into a MySQL database.
     The table has to exist in the database before running the export.
@@ -147,36 +218,54 @@ def sqoop_export_table(hostname, dest_db, target_table, hive_table_path,
 
     :param extra_opts: additional options to pass to `sqoop`
     :type extrap_opts: str
+
+    :param num_mappers: number of mappers to use, the sqoop default if None
+    :type num_mappers: int
+
+    :param runner: function used to run the command, see `run_command`
+    :type runner: function
+    '''
+
+    return(runner(make_export_command(hostname, dest_db, target_table,
+                                      hive_table_path, username,
+                                      password_file, extra_opts=extra_opts,
+                                      num_mappers=num_mappers)))
+
+def make_import_command(hostname, src_db, query, hive_db, hive_table,
+                        split_column, username, password_file, temp_directory,
+                        num_mappers=None):
     '''
+    Make the `sqoop import` command that imports the result of a query into
+    a Hive table, see `sqoop_import_table`.
 
-    scoop_command = """sqoop export \
+    :param num_mappers: number of mappers to use, the sqoop default if None
+    :type num_mappers: int
+    '''
+
+    sqoop_command = """sqoop import \
   --connect jdbc:mysql://{hostname}/{database} \
+  --target-dir {temp_dir} \
   --username {username} \
   --password-file {pwd_file} \
-  --export-dir {hive_table_path} \
-  --table {target_table} \
-  --input-fields-terminated-by '\001' \
-  --mysql-delimiters""".format(hostname=hostname, database=dest_db,
-                               username=username, pwd_file=password_file,
-                               hive_table_path=hive_table_path,
-                               target_table=target_table)
-    if extra_opts:
-        scoop_command = "{} {}".format(sqoop_command, extra_opts)
+  --split-by {split_column} \
+  --hive-import \
+  --hive-database {hive_db} \
+  --create-hive-table \
+  --hive-table {hive_table} \
+  --hive-delims-replacement ' ' \
+  --query '{query}'""".format(
+      hostname=hostname, database=src_db, temp_dir=temp_directory,
+      username=username, pwd_file=password_file, split_column=split_column,
+      hive_db=hive_db, hive_table=hive_table, query=query)
+    if num_mappers:
+        sqoop_command = "{} --num-mappers {}".format(sqoop_command,
+                                                      num_mappers)
 
-    retcode = None
-    try:
-        retcode = subprocess.call(scoop_command, shell=True)
-        if retcode < 0:
-            logging.warning("child was terminated by signal {}".format(-retcode))
-        else:
-            logging.info("child returned {}".format(retcode))
-    except OSError as e:
-        logging.error("Sqoop execution failed: {}".format(e))
+    return(sqoop_command)
 
-    return(retcode)
-    
 def sqoop_import_table(hostname, src_db, query, hive_db, hive_table,
-                       split_column, username, password_file, temp_directory):
+                       split_column, username, password_file, temp_directory,
+                       num_mappers=None, runner=run_command):
     '''
     Use `sqoop import` to import a table from a database using a specific query.
     The table is imported into the given Hive database and table and split on
@@ -209,33 +298,78 @@ def sqoop_import_table(hostname, src_db, query, hive_db, hive_table,
 
     :param password_file: path to the password file to use when authenticating
     :type password_file: str
+
+    :param temp_directory: directory sqoop imports the data into before
+                           loading it into Hive, one per concurrent import
+    :type temp_directory: str
+
+    :param num_mappers: number of mappers to use, the sqoop default if None
+    :type num_mappers: int
+
+    :param runner: function used to run the command, see `run_command`
+    :type runner: function
     '''
 
-    scoop_command = """sqoop import \
-  --connect jdbc:mysql://{hostname}/{database} \
-  --target-dir {temp_dir} \
-  --username {username} \
-  --password-file {pwd_file} \
-  --split-by {split_column} \
-  --hive-import \
-  --hive-database {hive_db} \
-  --create-hive-table \
-  --hive-table {hive_table} \
-  --hive-delims-replacement ' ' \
-  --query '{query}'"""
+    return(runner(make_import_command(hostname, src_db, query, hive_db,
+                                      hive_table, split_column, username,
+                                      password_file, temp_directory,
+                                      num_mappers=num_mappers)))
 
-    retcode = None
-    try:
-        retcode = subprocess.call(scoop_command.format(
-            hostname=hostname, database=src_db, temp_dir=temp_directory,
-            username=username, pwd_file=password_file, split_column=split_column,
-            hive_db=hive_db, hive_table=hive_table, query=query),
-                                  shell=True)
-        if retcode < 0:
-            logging.warning("child was terminated by signal {}".format(-retcode))
-        else:
-            logging.info("child returned {}".format(retcode))
-    except OSError as e:
-        logging.error("Sqoop execution failed: {}".format(e))
+class Transfer:
+    '''
+    A transfer of a table with `sqoop`, and once it has been run by
+    `run_transfers`, its exit code and how many seconds it took.
 
-    return(retcode)
+    :param name: name of the transfer, used when logging
+    :type name: str
+
+    :param command: the command that runs the transfer, e.g. from
+                    `make_import_command` or `make_export_command`
+    :type command: str
+    '''
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+        self.retcode = None
+        self.seconds = None
+
+    def succeeded(self):
+        '''
+        Did the transfer run and exit successfully?
+        '''
+        return(self.retcode == 0)
+
+def run_transfers(transfers, n_parallel=None, runner=run_command):
+    '''
+    Run the given independent transfers concurrently, at most `n_parallel`
+    at a time (all of them if None), and set their exit codes and timings.
+    Returns the transfers.
+
+    :param transfers: the transfers to run
+    :type transfers: list of `Transfer`
+
+    :param n_parallel: the most transfers to run at the same time
+    :type n_parallel: int
+
+    :param runner: function used to run the commands, see `run_command`
+    :type runner: function
+    '''
+
+    def run_transfer(transfer):
+        logging.info('starting transfer {}'.format(transfer.name))
+        start = time.perf_counter()
+        transfer.retcode = runner(transfer.command)
+        transfer.seconds = time.perf_counter() - start
+        logging.info('transfer {} returned {} after {:.1f} seconds'.format(
+            transfer.name, transfer.retcode, transfer.seconds))
+        return(transfer)
+
+    if not transfers:
+        return(transfers)
+
+    ## The transfers are separate processes that we wait for,
+    ## so threads are enough to run them concurrently
+    with ThreadPool(min(n_parallel or len(transfers), len(transfers))) as pool:
+        pool.map(run_transfer, transfers)
+
+    return(transfers)
@@ -0,0 +1,151 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Script to ingest pageview dump files into the local daily view store used
+by `update_viewrates.py` (see the `pageviews` and `viewstore` modules).
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+
+from yaml import load
+
+import pageviews
+import viewstore
+
+def read_pairs(filename):
+    '''
+    Read a TSV file with a header and two columns, returning a list of
+    tuples where the first column is an integer. The second column is
+    an integer too if it only contains digits.
+
+    :param filename: path to the TSV file
+    :type filename: str
+    '''
+    pairs = []
+    with open(filename, 'r', encoding='utf-8') as infile:
+        infile.readline() # skip header
+        for line in infile:
+            (first, second) = line.rstrip('\n').split('\t')[:2]
+            if second.isdigit():
+                second = int(second)
+            pairs.append((int(first), second))
+    return(pairs)
+
+def read_pages_from_db(config):
+    '''
+    Read all pages and redirects in the main namespace from the Wikipedia
+    database given in the configuration, returning a tuple of lists of
+    (page ID, page title) and (redirect page ID, target page ID) tuples.
+
+    :param config: the view rate configuration
+    :type config: dict
+    '''
+    import db
+
+    page_query = '''SELECT page_id, page_title
+                    FROM {lang}wiki.page
+                    WHERE page_namespace=0'''
+
+    redirect_query = '''SELECT rd_from, page_id AS rd_to
+                        FROM {lang}wiki.redirect
+                        JOIN {lang}wiki.page
+                        ON (rd_namespace=page_namespace
+                        AND rd_title=page_title)
+                        WHERE rd_namespace=0'''
+
+    db_conn = db.connect(config['db_server'], config['db_name'],
+                         config['db_config_file'])
+    with db.cursor(db_conn, 'ss') as db_cursor:
+        db_cursor.execute(page_query.format_map(config))
+        pages = [(page_id, page_title.decode('utf-8'))
+                 for (page_id, page_title) in db_cursor]
+        db_cursor.execute(redirect_query.format_map(config))
+        redirects = list(db_cursor)
+    db.disconnect(db_conn)
+
+    return((pages, redirects))
+
+def main():
+    import argparse
+
+    cli_parser = argparse.ArgumentParser(
+        description="script to ingest pageview dump files into the local view store"
+    )
+
+    # Verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='write informational output')
+
+    # YAML configuration file
+    cli_parser.add_argument('config_file',
+                            help='path to the YAML configuration file')
+
+    cli_parser.add_argument('dump_files', nargs='+',
+                            help='paths to the pageview dump files (hourly or daily)')
+
+    cli_parser.add_argument('--pages', type=str,
+                            help='TSV file of page ID and title of all pages in the main namespace, read from the database if not given')
+
+    cli_parser.add_argument('--redirects', type=str,
+                            help='TSV file of page ID of every redirect and the page ID of its target')
+
+    cli_parser.add_argument('-p', '--processes', type=int, default=1,
+                            help='number of processes reading dump files (default: 1)')
+
+    cli_parser.add_argument('--replace', action='store_true',
+                            help='replace days that are already in the store')
+
+    cli_parser.add_argument('--allow-partial', action='store_true',
+                            help='ingest days that have fewer than 24 hourly files')
+
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    with open(args.config_file) as infile:
+        config = load(infile)
+
+    if args.pages:
+        pages = read_pairs(args.pages)
+        redirects = read_pairs(args.redirects) if args.redirects else []
+    else:
+        (pages, redirects) = read_pages_from_db(config)
+
+    title_map = pageviews.make_title_map(pages, redirects)
+    logging.info('mapped {} titles, {} of them redirects'.format(
+        len(title_map), len(redirects)))
+    del(pages, redirects)
+
+    pageviews.ingest(args.dump_files,
+                     '{}.wikipedia'.format(config['lang']),
+                     title_map,
+                     viewstore.DailyViewStore(config['view_store']),
+                     n_processes=args.processes,
+                     replace=args.replace,
+                     allow_partial=args.allow_partial)
+
+    return()
+
+if __name__ == '__main__':
+    main()
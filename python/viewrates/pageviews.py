@@ -0,0 +1,284 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for ingesting the public pageview dump files into the local daily
+view store (see the `viewstore` module).
+
+Both the hourly `pageviews-YYYYMMDD-HH0000.gz` files (lines of domain code,
+title, views, and response size) and the daily "pageview complete" files
+(lines of wiki code, title, page ID, access method, daily views, and hourly
+views) are understood. Files are decompressed and scanned in parallel by a
+pool of worker processes, each keeping only the lines of one project and
+mapping titles to page IDs. Views of redirects are added to the page they
+redirect to, so a page's views in the store are its direct views plus
+those of its redirects.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import re
+import bz2
+import gzip
+import logging
+import datetime as dt
+
+from multiprocessing import Pool
+
+import numpy as np
+
+## Domain code suffixes used in the hourly dumps for each type of project,
+## e.g. "en.d" is en.wiktionary. Mobile views add ".m" after the language.
+PROJECT_SUFFIXES = {'wikipedia': '',
+                    'wiktionary': '.d',
+                    'wikibooks': '.b',
+                    'wikinews': '.n',
+                    'wikiquote': '.q',
+                    'wikisource': '.s',
+                    'wikiversity': '.v',
+                    'wikivoyage': '.voy'}
+
+## Pattern matching the date in the name of a dump file
+FILENAME_DATE = re.compile(r'pageviews-(\d{8})')
+
+## Number of hourly files in a complete day
+HOURS_PER_DAY = 24
+
+## Project codes and title map used by the worker processes,
+## set by `_init_worker`
+_codes = None
+_title_map = None
+
+def project_codes(project):
+    '''
+    Return the set of codes used for the given project (e.g. "en.wikipedia")
+    in the hourly and daily dump files.
+
+    :param project: the project, as language code and project type
+    :type project: str
+    '''
+    (lang, project_type) = project.split('.', 1)
+    suffix = PROJECT_SUFFIXES[project_type]
+    return(set([project,
+                '{}{}'.format(lang, suffix),
+                '{}.m{}'.format(lang, suffix)]))
+
+def file_date(filename):
+    '''
+    Return the date of the given dump file, from its name.
+
+    :param filename: path to the dump file
+    :type filename: str
+    '''
+    match = FILENAME_DATE.search(os.path.basename(filename))
+    if not match:
+        raise(ValueError('unable to find the date of {}'.format(filename)))
+    return(dt.datetime.strptime(match.group(1), '%Y%m%d').date())
+
+def is_hourly(filename):
+    '''
+    Is the given dump file an hourly file?
+
+    :param filename: path to the dump file
+    :type filename: str
+    '''
+    return(re.search(r'pageviews-\d{8}-\d{6}',
+                     os.path.basename(filename)) is not None)
+
+def open_dump(filename):
+    '''
+    Open the given dump file for reading text, decompressing it if its
+    name ends in ".gz" or ".bz2".
+
+    :param filename: path to the dump file
+    :type filename: str
+    '''
+    if filename.endswith('.gz'):
+        return(gzip.open(filename, 'rt', encoding='utf-8', errors='replace'))
+    elif filename.endswith('.bz2'):
+        return(bz2.open(filename, 'rt', encoding='utf-8', errors='replace'))
+    return(open(filename, 'r', encoding='utf-8', errors='replace'))
+
+def make_title_map(pages, redirects=None):
+    '''
+    Make a map of page title to page ID, where the titles of redirects
+    map to the page ID of the page they redirect to.
+
+    :param pages: (page ID, page title) tuples of all pages, including
+                  redirects, with titles as in the page table
+                  (underscores rather than spaces)
+    :type pages: iterable
+
+    :param redirects: (page ID of redirect, page ID of its target) tuples
+    :type redirects: iterable
+    '''
+    targets = dict(redirects or [])
+    return({page_title:targets.get(page_id, page_id)
+            for (page_id, page_title) in pages})
+
+def scan_lines(lines, codes, title_map):
+    '''
+    Add up the views in the given dump lines of the given project codes per
+    page. Returns a tuple of an array of page IDs and an array of their
+    views, and the number of views of titles not in the title map.
+
+    :param lines: lines of an hourly or daily dump file
+    :type lines: iterable
+
+    :param codes: the project's codes, see `project_codes`
+    :type codes: set
+
+    :param title_map: map of page title to page ID, see `make_title_map`
+    :type title_map: dict
+    '''
+
+    views = {}
+    n_unknown = 0
+    for line in lines:
+        cols = line.split(' ')
+        if cols[0] not in codes:
+            continue
+
+        try:
+            if len(cols) == 6:
+                n = int(cols[4]) # daily "pageview complete" file
+            else:
+                n = int(cols[2]) # hourly file
+            page_id = title_map[cols[1]]
+        except (IndexError, ValueError):
+            continue
+        except KeyError:
+            n_unknown += n
+            continue
+
+        views[page_id] = views.get(page_id, 0) + n
+
+    return((np.fromiter(views.keys(), dtype=np.int64, count=len(views)),
+            np.fromiter(views.values(), dtype=np.int64, count=len(views)),
+            n_unknown))
+
+def scan_file(filename, codes, title_map):
+    '''
+    Scan the given dump file, see `scan_lines`.
+
+    :param filename: path to the dump file
+    :type filename: str
+    '''
+    with open_dump(filename) as infile:
+        return(scan_lines(infile, codes, title_map))
+
+def _init_worker(codes, title_map):
+    '''
+    Set the project codes and title map of a worker process.
+    '''
+    global _codes, _title_map
+    _codes = codes
+    _title_map = title_map
+
+def _scan_file(filename):
+    '''
+    Scan a dump file in a worker.
+    '''
+    return(scan_file(filename, _codes, _title_map))
+
+def group_by_date(filenames):
+    '''
+    Group the given dump files by date. Returns a list of tuples of date
+    and the files of that date, sorted by date.
+
+    :param filenames: paths to the dump files
+    :type filenames: list
+    '''
+    days = {}
+    for filename in filenames:
+        days.setdefault(file_date(filename), []).append(filename)
+    return(sorted(days.items()))
+
+def ingest(filenames, project, title_map, store, n_processes=1,
+           replace=False, allow_partial=False):
+    '''
+    Ingest the given dump files into the given daily view store.
+
+    :param filenames: paths to the dump files, hourly or daily
+    :type filenames: list
+
+    :param project: the project to keep views for (e.g. "en.wikipedia")
+    :type project: str
+
+    :param title_map: map of page title to page ID, see `make_title_map`
+    :type title_map: dict
+
+    :param store: the store to write the daily views to
+    :type store: `viewstore.DailyViewStore`
+
+    :param n_processes: number of worker processes reading dump files
+    :type n_processes: int
+
+    :param replace: replace days that already are in the store
+    :type replace: bool
+
+    :param allow_partial: ingest days with fewer than 24 hourly files
+    :type allow_partial: bool
+    '''
+
+    codes = project_codes(project)
+    days = []
+    for (date, day_files) in group_by_date(filenames):
+        if store.has_day(date) and not replace:
+            logging.info('{} is already in the store, skipping it'.format(date))
+            continue
+
+        n_hourly = sum(1 for filename in day_files if is_hourly(filename))
+        if n_hourly and n_hourly < HOURS_PER_DAY and not allow_partial:
+            logging.warning('only {} hourly files for {}, skipping it'.format(n_hourly, date))
+            continue
+
+        days.append((date, day_files))
+
+    if not days:
+        return()
+
+    pool = None
+    if n_processes > 1:
+        ## The title map is large, it is set once per worker
+        pool = Pool(n_processes, initializer=_init_worker,
+                    initargs=(codes, title_map))
+
+    try:
+        for (date, day_files) in days:
+            if pool:
+                results = list(pool.imap_unordered(_scan_file, day_files))
+            else:
+                results = [scan_file(filename, codes, title_map)
+                           for filename in day_files]
+
+            page_ids = np.concatenate([r[0] for r in results])
+            views = np.concatenate([r[1] for r in results])
+            n_unknown = sum(r[2] for r in results)
+
+            store.write_day(date, page_ids, views, replace=replace)
+            logging.info('ingested {} views for {} ({} views of unknown titles)'.format(views.sum(), date, n_unknown))
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return()
@@ -24,17 +24,38 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import os
 import sys
+import json
 import logging
 import datetime as dt
 
 import db
 import hive
+import firstedit
+import viewstore
 
 from yaml import load
 from tempfile import TemporaryDirectory
 
 import MySQLdb
+import numpy as np
+
+## Number of rows inserted per query when loading views calculated
+## from the local view store into MySQL
+INSERT_BATCH_SIZE = 10000
+
+## Number of pages per query when looking up first edits, unless
+## `first_edit_batch_size` is set in the configuration
+FIRST_EDIT_BATCH_SIZE = 10000
+
+## Stages of an update, in order. Each completed stage is recorded in the
+## status table, so that rerunning a failed update resumes at the stage
+## that failed, see `Viewrates.update`.
+STAGES = ['snapshot', 'sync_pages', 'newpages', 'export_tables',
+          'local_views', 'hadoop_export', 'hive_oldpage_views',
+          'hive_newpage_views', 'hadoop_import', 'update_stats',
+          'check_new_pages']
 
 class MAWindow:
     '''
@@ -58,6 +79,28 @@ class MAWindow:
         if isinstance(self.end, dt.datetime):
             self.end = self.end.date()
 
+def window_edges(sliding_window):
+    '''
+    Return the date ranges on the two edges of the given sliding window
+    as a tuple of `MAWindow` objects: the days that are leaving the window
+    (in the old window but not in the new one), and the days that are
+    entering it (in the new window but not in the old one). If the windows
+    do not overlap, these are the old and new windows themselves. An edge
+    with no days has a start later than its end.
+
+    :param sliding_window: the sliding window used to calculate the
+                           moving average view rates
+    :type sliding_window: dict
+    '''
+
+    one_day = dt.timedelta(days=1)
+    (old, new) = (sliding_window['old'], sliding_window['new'])
+
+    leaving = MAWindow(old.start, min(old.end, new.start - one_day))
+    entering = MAWindow(max(new.start, old.end + one_day), new.end)
+
+    return((leaving, entering))
+
 class SnapshotError(Exception):
     '''
     Exception raised if we fail to create snapshots
@@ -71,6 +114,12 @@ class SqoopError(Exception):
     to Hadoop using `sqoop` failed.
     '''
     pass
+
+class HiveError(Exception):
+    '''
+    Exception raised if a Hive query run with `beeline` failed.
+    '''
+    pass
             
 class Viewrates:
     def __init__(self, config_file):
@@ -79,14 +128,21 @@ class Viewrates:
             self.config = load(infile)
         
         self.db_conn = None
+
+        ## Function running `sqoop` and `beeline` commands, see
+        ## `hive.run_command`
+        self.runner = hive.run_command
         
     def make_snapshots(self):
         '''
         Create a snapshot of the `page` and 'redirect'tables from the given
         language Wikipedia so we can use them to compare and update our local
-        `vr_page` table.
+        `vr_page` table. Snapshots left behind by a failed run are dropped.
         '''
 
+        drop_snapshot_query = '''DROP TABLE IF EXISTS {page_snapshot_table},
+                                                      {redirect_snapshot_table}'''
+
         page_snapshot_query = '''CREATE TABLE {page_snapshot_table}
                                  SELECT page_id, page_title
                                  FROM {lang}wiki.page
@@ -110,6 +166,8 @@ class Viewrates:
 
         try:
             with db.cursor(self.db_conn, 'dict') as db_cursor:
+                db_cursor.execute(
+                    drop_snapshot_query.format_map(self.config))
                 db_cursor.execute(
                     page_snapshot_query.format_map(self.config))
                 db_cursor.execute(
@@ -132,8 +190,12 @@ class Viewrates:
         Compare the page snapshot to the page table to find pages that
         no longer exists, and compare the redirect table to the page table
         to remove redirects that originate from outside the main namespace.
+        Runs `delete_pages_and_redirects_set` instead if `sync_mode` is "set".
         '''
 
+        if self.config.get('sync_mode', 'slice') == 'set':
+            return(self.delete_pages_and_redirects_set())
+
         ## Query to compare our list of pages against the snapshot
         ## to identify pages that should be deleted.
         find_query = '''SELECT p.page_id
@@ -210,12 +272,104 @@ class Viewrates:
         self.db_conn.commit()
         return()
 
+    def stage_page_ids(self, db_cursor, select_query):
+        '''
+        (Re)create the temporary diff table and fill it with the page IDs
+        returned by the given query, so the diff can be applied with joins
+        rather than lists of IDs. Returns the number of staged pages.
+
+        :param db_cursor: cursor of our database connection
+        :type db_cursor: MySQLdb.cursors.Cursor
+
+        :param select_query: query selecting a single `page_id` column
+        :type select_query: str
+        '''
+
+        drop_query = '''DROP TEMPORARY TABLE IF EXISTS {temp_diff_table}'''
+
+        stage_query = '''CREATE TEMPORARY TABLE {temp_diff_table}
+                         (page_id INT UNSIGNED NOT NULL PRIMARY KEY)
+                         IGNORE {select_query}'''
+
+        db_cursor.execute(drop_query.format_map(self.config))
+        db_cursor.execute(stage_query.format(
+            temp_diff_table=self.config['temp_diff_table'],
+            select_query=select_query.format_map(self.config)))
+        return(db_cursor.rowcount)
+
+    def drop_diff_table(self, db_cursor):
+        '''
+        Drop the temporary diff table created by `stage_page_ids`.
+
+        :param db_cursor: cursor of our database connection
+        :type db_cursor: MySQLdb.cursors.Cursor
+        '''
+        db_cursor.execute('''DROP TEMPORARY TABLE IF EXISTS {temp_diff_table}'''.format_map(self.config))
+        return()
+
+    def delete_pages_and_redirects_set(self):
+        '''
+        Set-based version of `delete_pages_and_redirects`. Stages the pages
+        that no longer exist in the temporary diff table and deletes them
+        from the page and new page tables with multi-table DELETEs, using
+        a constant number of queries regardless of how many pages changed.
+        '''
+
+        ## Query to identify pages that should be deleted, as in
+        ## `delete_pages_and_redirects`
+        find_query = '''SELECT p.page_id
+                        FROM {page_table} p
+                        LEFT JOIN {page_snapshot_table} ps
+                        USING (page_id)
+                        WHERE ps.page_id IS NULL'''
+
+        ## Queries to delete the staged pages from our tables
+        delete_queries = ['''DELETE p FROM {page_table} p
+                             JOIN {temp_diff_table} d
+                             USING (page_id)''',
+                          '''DELETE nd FROM {newpage_data_table} nd
+                             JOIN {temp_diff_table} d
+                             USING (page_id)''',
+                          '''DELETE n FROM {newpage_table} n
+                             JOIN {temp_diff_table} d
+                             USING (page_id)''']
+
+        ## Query to delete redirects that originate outside the main namespace
+        redirect_query = '''DELETE r FROM {redirect_snapshot_table} r
+                            LEFT JOIN {page_snapshot_table} p
+                            ON r.rd_from=p.page_id
+                            WHERE p.page_id IS NULL'''
+
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            n_pages = self.stage_page_ids(db_cursor, find_query)
+            if n_pages:
+                logging.info('deleting {} pages'.format(n_pages))
+                for delete_query in delete_queries:
+                    db_cursor.execute(delete_query.format_map(self.config))
+            self.drop_diff_table(db_cursor)
+
+            db_cursor.execute(redirect_query.format_map(self.config))
+            logging.info('deleted {} redirects from outside the main namespace'.format(db_cursor.rowcount))
+
+        # ok, done
+        self.db_conn.commit()
+        return()
+
     def add_pages(self):
         '''
         Compare our page table with the page snapshot to identify new
-        pages that should be added.
+        pages that should be added. Runs `add_pages_set` instead
+        if `sync_mode` is "set".
+
+        The new pages are also added to the `newpage` table without a first
+        edit, in the same transaction, so they are known to need a first
+        edit lookup (see `pending_newpages`) even if the update fails
+        before it is done.
         '''
 
+        if self.config.get('sync_mode', 'slice') == 'set':
+            return(self.add_pages_set())
+
         # Query to compare our list of pages against the snapshot
         # to identify pages that should be added. We left join with
         # redirects so we can prevent adding any of them.
@@ -233,6 +387,13 @@ class Viewrates:
                           SELECT page_id, page_title
                           FROM {page_snapshot_table}
                           WHERE page_id IN ({idlist})'''
+
+        ## Query to add a set of pages to the newpage table, pending
+        ## the lookup of their first edit
+        insert_pending_query = '''INSERT INTO {newpage_table} (page_id)
+                                  SELECT page_id
+                                  FROM {page_snapshot_table}
+                                  WHERE page_id IN ({idlist})'''
         
         pages_to_add = list()
         with db.cursor(self.db_conn, 'dict') as db_cursor:
@@ -247,10 +408,15 @@ class Viewrates:
             i = 0
             while i < len(pages_to_add):
                 subset = pages_to_add[i : i + self.config['slice_size']]
+                idlist = ','.join([str(p) for p in subset])
                 db_cursor.execute(insert_query.format(
                     page_table=self.config['page_table'],
                     page_snapshot_table=self.config['page_snapshot_table'],
-                    idlist=','.join([str(p) for p in subset])))
+                    idlist=idlist))
+                db_cursor.execute(insert_pending_query.format(
+                    newpage_table=self.config['newpage_table'],
+                    page_snapshot_table=self.config['page_snapshot_table'],
+                    idlist=idlist))
 
                 i += self.config['slice_size']
 
@@ -259,6 +425,55 @@ class Viewrates:
         ## Return the list of added pages because it will be used later
         return(pages_to_add)
 
+    def add_pages_set(self):
+        '''
+        Set-based version of `add_pages`. Stages the new pages in the
+        temporary diff table and adds them with a single INSERT ... SELECT,
+        and adds them to the `newpage` table pending the lookup of their
+        first edit. Returns the list of added page IDs, as `add_pages` does.
+        '''
+
+        ## Query to identify pages that should be added, as in `add_pages`
+        find_query = '''SELECT s.page_id
+                        FROM {page_snapshot_table} s
+                        LEFT JOIN {redirect_snapshot_table} r
+                        ON (s.page_id=r.rd_from)
+                        LEFT JOIN {page_table} p
+                        ON (s.page_id=p.page_id)
+                        WHERE r.rd_from IS NULL
+                        AND p.page_id IS NULL'''
+
+        ## Query to insert the staged pages into the page table
+        insert_query = '''INSERT INTO {page_table} (page_id, page_title)
+                          SELECT s.page_id, s.page_title
+                          FROM {page_snapshot_table} s
+                          JOIN {temp_diff_table} d
+                          USING (page_id)'''
+
+        ## Query to add the staged pages to the newpage table,
+        ## pending the lookup of their first edit
+        insert_pending_query = '''INSERT INTO {newpage_table} (page_id)
+                                  SELECT page_id FROM {temp_diff_table}'''
+
+        ## Query to get the staged page IDs
+        get_pages_query = '''SELECT page_id FROM {temp_diff_table}'''
+
+        with db.cursor(self.db_conn, 'ss') as db_cursor:
+            n_pages = self.stage_page_ids(db_cursor, find_query)
+            logging.info('adding {} pages'.format(n_pages))
+
+            db_cursor.execute(insert_query.format_map(self.config))
+            db_cursor.execute(insert_pending_query.format_map(self.config))
+            db_cursor.execute(get_pages_query.format_map(self.config))
+            pages_to_add = [row[0] for row in db_cursor]
+
+            self.drop_diff_table(db_cursor)
+
+        self.db_conn.commit()
+
+        ## Return the list of added pages because it will be used later
+        return(pages_to_add)
+
     def update_titles(self):
         '''
         Update all page titles in our local page table to match the snapshot.
@@ -284,14 +499,16 @@ class Viewrates:
         '''
         Add all `pages` to the `newpage` table. Expects `pages` to be a list
         of tuples where the first element is the page ID and the second element
-        is the first edit (as a `datetime.datetime` object)
+        is the first edit (as a `datetime.datetime` object). Pages already
+        in the table, e.g. pending ones, get their first edit set.
 
         :param pages: page IDs and first edits of the new pages to add
         :type pages: list
         '''
 
         insert_query = '''INSERT INTO {newpage_table}
-                          (page_id, first_edit) VALUES (%s, %s)'''
+                          (page_id, first_edit) VALUES (%s, %s)
+                          ON DUPLICATE KEY UPDATE first_edit=VALUES(first_edit)'''
         
         with db.cursor(self.db_conn, 'dict') as db_cursor:
             i = 0
@@ -308,6 +525,37 @@ class Viewrates:
         # ok, done
         return()
         
+    def pending_newpages(self):
+        '''
+        Return the list of page IDs of the pages that were added to the
+        `newpage` table by `add_pages` and still need their first edit
+        looked up.
+        '''
+
+        pending_query = '''SELECT page_id
+                           FROM {newpage_table}
+                           WHERE first_edit IS NULL'''
+
+        with db.cursor(self.db_conn, 'ss') as db_cursor:
+            db_cursor.execute(pending_query.format_map(self.config))
+            return([row[0] for row in db_cursor])
+
+    def delete_pending_newpages(self):
+        '''
+        Delete pages still pending a first edit from the `newpage` table,
+        i.e. pages that turned out not to be new, or whose first edit
+        could not be found.
+        '''
+
+        delete_query = '''DELETE FROM {newpage_table}
+                          WHERE first_edit IS NULL'''
+
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            db_cursor.execute(delete_query.format_map(self.config))
+            logging.info('removed {} pages without a first edit from the new pages'.format(db_cursor.rowcount))
+        self.db_conn.commit()
+        return()
+
     def initialize_newpage(self, cutoff_time):
         '''
         The initial run is slightly different from an update because
@@ -330,29 +578,20 @@ class Viewrates:
         
         # go through all pages, find their first edit, if it's
         # recent enough, add them to the newpage table
-        with db.cursor(self.db_conn, 'dict') as db_cursor:
-            all_pages = list()
+        with db.cursor(self.db_conn, 'ss') as db_cursor:
             db_cursor.execute(allpages_query.format_map(self.config))
-            done = False
-            while not done:
-                rows = db_cursor.fetchmany(self.config['slice_size'])
-                if not rows:
-                    done = True
-                    continue
-
-                for row in rows:
-                    all_pages.append(row['page_id'])
-
-            logging.info('checking {} pages for the first edit'.format(
-                len(all_pages)))
-
-            pages_to_add = list()
-            for (page_id, first_edit) in self.find_first_edits(all_pages):
-                if first_edit >= cutoff_time:
-                    # Add it as a tuple we can pass to executemany()
-                    pages_to_add.append(
-                        (page_id, first_edit)
-                    )
+            all_pages = [row[0] for row in db_cursor]
+
+        logging.info('checking {} pages for the first edit'.format(
+            len(all_pages)))
+
+        pages_to_add = list()
+        for (page_id, first_edit) in self.find_first_edits(all_pages):
+            if first_edit >= cutoff_time:
+                # Add it as a tuple we can pass to executemany()
+                pages_to_add.append(
+                    (page_id, first_edit)
+                )
 
         ## Add all those pages
         self.add_newpages(pages_to_add)
@@ -364,6 +603,11 @@ class Viewrates:
         list of tuples of the form (page_id, first_edit), where the first edit
         has been converted to a datetime.datetime object.
 
+        Pages are looked up `first_edit_batch_size` at a time with a single
+        grouped query per batch, read with a server-side cursor. If
+        `first_edit_cache` is set, first edits are cached locally (see the
+        `firstedit` module) so a page is only looked up once across updates.
+
         :param pages: list of page IDs of pages to find first edits for
         :type pages: list
         '''
@@ -374,23 +618,33 @@ class Viewrates:
                                WHERE rev_page IN ({idlist})
                                GROUP BY rev_page'''
 
+        batch_size = self.config.get('first_edit_batch_size',
+                                     FIRST_EDIT_BATCH_SIZE)
+
+        cache = None
         pages_with_edits = list()
+        if self.config.get('first_edit_cache'):
+            cache = firstedit.FirstEditCache(self.config['first_edit_cache'])
+            (pages_with_edits, pages) = cache.lookup(pages)
+            logging.info('found {} first edits in the cache, looking up {}'.format(len(pages_with_edits), len(pages)))
 
-        with db.cursor(self.db_conn, 'dict') as db_cursor:
+        with db.cursor(self.db_conn, 'ss') as db_cursor:
             i = 0
             while i < len(pages):
-                subset = pages[i : i + self.config['slice_size']]
+                subset = pages[i : i + batch_size]
                 db_cursor.execute(recent_edit_query.format(
                     lang=self.config['lang'],
                     idlist=','.join([str(p) for p in subset])))
-                for row in db_cursor.fetchall():
-                    page_id = row['rev_page']
-                    first_edit = dt.datetime.strptime(
-                        row['first_edit'].decode('utf-8'), '%Y%m%d%H%M%S')
+                for (page_id, first_edit) in db_cursor:
                     pages_with_edits.append(
-                        (page_id, first_edit)
+                        (page_id, firstedit.parse_timestamp(first_edit))
                         )
-                i += self.config['slice_size']
+                    if cache is not None:
+                        cache.add(page_id, first_edit)
+                i += batch_size
+
+        if cache is not None:
+            cache.save()
 
         return(pages_with_edits)
 
@@ -504,49 +758,110 @@ FROM {temp_newpage_table} n
 WHERE $CONDITIONS'''.format_map(self.config)
         
         # call the creation of the database and deletion of the target table
-        if hive.exec_hql(self.config['create_hive_file']) is None:
+        if hive.exec_hql(self.config['create_hive_file'],
+                         runner=self.runner) != 0:
             logging.error('unable to create/update Hive target tables')
-            return()
+            raise(HiveError)
+
+        ## The number of mappers of each import is chosen from its table size
+        rows = self.count_rows([self.config['temp_oldpage_table'],
+                                self.config['temp_newpage_table']])
 
         # create the temporary directory
         with TemporaryDirectory(prefix=self.config['tempdir_prefix']) \
              as temp_dir:
             logging.info('sqoop is using temporary directory {}'.format(temp_dir))
-            # call the import
-            # first, export vr_page - vr_newpage (aka `vr_oldpage`), which
+            # import vr_page - vr_newpage (aka `vr_oldpage`), which
             # are all the existing pages for which we'll normal just do
-            # incremental updates
-            sqoop = hive.sqoop_import_table(self.config['db_server'],
-                                            self.config['db_name'],
-                                            oldpage_query,
-                                            self.config['hive_database'],
-                                            self.config['hive_oldpage_table'],
-                                            'page_id',
-                                            self.config['db_username'],
-                                            self.config['sqoop_password_file'],
-                                            temp_dir)
-            if sqoop is None:
-                logging.error('sqoop import of oldpage table failed')
-                raise(ScoopException)
-            
-            # second, export `vr_newpage` so we can get recent view data for
-            # those
-            sqoop = hive.sqoop_import_table(self.config['db_server'],
-                                            self.config['db_name'],
-                                            newpage_query,
-                                            self.config['hive_database'],
-                                            self.config['hive_newpage_table'],
-                                            'page_id',
-                                            self.config['db_username'],
-                                            self.config['sqoop_password_file'],
-                                            temp_dir)
-            if sqoop is None:
-                logging.error('sqoop import of newpage table failed')
-                raise(ScoopException)
+            # incremental updates, and `vr_newpage` so we can get recent
+            # view data for those. The two are independent and run
+            # concurrently, each with its own target directory.
+            transfers = []
+            for (name, query, hive_table, table) in [
+                    ('oldpage import', oldpage_query,
+                     self.config['hive_oldpage_table'],
+                     self.config['temp_oldpage_table']),
+                    ('newpage import', newpage_query,
+                     self.config['hive_newpage_table'],
+                     self.config['temp_newpage_table'])]:
+                transfers.append(hive.Transfer(name, hive.make_import_command(
+                    self.config['db_server'],
+                    self.config['db_name'],
+                    query,
+                    self.config['hive_database'],
+                    hive_table,
+                    'page_id',
+                    self.config['db_username'],
+                    self.config['sqoop_password_file'],
+                    os.path.join(temp_dir, hive_table),
+                    num_mappers=self.num_mappers(rows[table]))))
+
+            self.run_transfers(transfers)
 
         # ok, done
         return()
 
+    def count_rows(self, tables):
+        '''
+        Count the rows of the given tables, returning a dictionary mapping
+        table name to number of rows. Connects to the database for the
+        duration if we are not connected, as during Hive stages.
+
+        :param tables: names of the tables
+        :type tables: list
+        '''
+
+        count_query = '''SELECT COUNT(*) AS num_rows FROM {}'''
+
+        connected = self.db_conn is not None
+        self.connect()
+        rows = {}
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            for table in tables:
+                db_cursor.execute(count_query.format(table))
+                rows[table] = db_cursor.fetchone()['num_rows']
+        if not connected:
+            self.disconnect()
+        return(rows)
+
+    def num_mappers(self, n_rows):
+        '''
+        Choose the number of sqoop mappers for a table with the given number
+        of rows, using `rows_per_mapper` and `max_mappers` from the
+        configuration if set (see `hive.mappers_for_rows`).
+
+        :param n_rows: number of rows in the table
+        :type n_rows: int
+        '''
+        return(hive.mappers_for_rows(
+            n_rows,
+            rows_per_mapper=self.config.get('rows_per_mapper',
+                                            hive.ROWS_PER_MAPPER),
+            max_mappers=self.config.get('max_mappers', hive.MAX_MAPPERS)))
+
+    def run_transfers(self, transfers):
+        '''
+        Run the given sqoop transfers concurrently (at most
+        `transfer_processes` at a time), raising `SqoopError`
+        if any of them failed.
+
+        :param transfers: the transfers to run
+        :type transfers: list of `hive.Transfer`
+        '''
+
+        hive.run_transfers(transfers,
+                           n_parallel=self.config.get('transfer_processes'),
+                           runner=self.runner)
+
+        failed = [transfer.name for transfer in transfers
+                  if not transfer.succeeded()]
+        if failed:
+            logging.error('sqoop transfers failed: {}'.format(
+                ', '.join(failed)))
+            raise(SqoopError)
+
+        return()
+
     def get_newpage_views(self, sliding_window):
         '''
         Use Hive to get views for all pages in the `vr_newpage` table that
@@ -558,7 +873,10 @@ WHERE $CONDITIONS'''.format_map(self.config)
         :type sliding_window: dict
         '''
 
-        newpage_query = '''CREATE TABLE \
+        ## The data table is dropped first in case a failed update created it
+        newpage_query = '''DROP TABLE IF EXISTS \
+{hive_database}.{newpage_data_table}; \
+CREATE TABLE \
 {hive_database}.{newpage_data_table} AS \
 SELECT a.page_id, year, month, day, sum(view_count) AS num_views \
 FROM {hive_database}.{newpage_table} AS a \
@@ -572,14 +890,17 @@ GROUP BY a.page_id, year, month, day'''
         # get views per day from the end day in the old side of the sliding
         # window to the end day in the new side of the sliding window
         # (this is the shift in the most recent side of the window)
-        hive.exec_beeline(newpage_query.format(
+        retcode = hive.exec_beeline(newpage_query.format(
             hive_database=self.config['hive_database'],
             newpage_data_table=self.config['hive_newpage_data_table'],
             newpage_table=self.config['hive_newpage_table'],
             date_range=hive.make_where_datespan(
                 sliding_window['old'].end,
                 sliding_window['new'].end),
-            lang=self.config['lang']))
+            lang=self.config['lang']), runner=self.runner)
+        if retcode != 0:
+            logging.error('Hive query for new page views failed')
+            raise(HiveError)
 
         # ok, done
         return()
@@ -616,80 +937,191 @@ GROUP BY a.page_id'''.format(
         sliding_window['new'].end),
     lang=self.config['lang'])
         else:
-            ## Query to update both ends of the sliding window
+            ## Query to update both ends of the sliding window. Scans the
+            ## page views once for the days on both edges of the window,
+            ## and sums each row's views as leaving (old_views) or entering
+            ## (new_views) the window depending on its date.
+            (leaving, entering) = window_edges(sliding_window)
+            leaving_range = hive.make_where_datespan(
+                leaving.start, leaving.end, prefix='b.')
+            entering_range = hive.make_where_datespan(
+                entering.start, entering.end, prefix='b.')
+
             oldpage_query = '''
 CREATE TABLE \
 {hive_database}.{oldpage_data_table} AS \
-SELECT a.page_id, SUM(b.view_count) AS old_views, SUM(c.view_count) AS new_views
+SELECT a.page_id, \
+SUM(IF({leaving_range}, b.view_count, 0)) AS old_views, \
+SUM(IF({entering_range}, b.view_count, 0)) AS new_views \
 FROM {hive_database}.{oldpage_table} AS a \
 JOIN wmf.pageview_hourly AS b \
 ON (a.page_title=b.page_title) \
-JOIN wmf.pageview_hourly AS c \
-ON (a.page_title=c.page_title) \
-WHERE ({date_range_b}) \
-AND ({date_range_c}) \
+WHERE (({leaving_range}) OR ({entering_range})) \
 AND b.project='{lang}.wikipedia' \
-AND c.project='{lang}.wikipedia' \
 GROUP BY a.page_id'''.format(
     hive_database=self.config['hive_database'],
     oldpage_data_table=self.config['hive_oldpage_data_table'],
     oldpage_table=self.config['hive_oldpage_table'],
-    date_range_b=hive.make_where_datespan(
-        sliding_window['old'].start,
-        sliding_window['new'].start, prefix='b.'),
-    date_range_c=hive.make_where_datespan(
-        sliding_window['old'].end,
-        sliding_window['old'].start, prefix='c.'),
+    leaving_range=leaving_range,
+    entering_range=entering_range,
     lang=self.config['lang'])
 
-        # Execute the Hive query
-        hive.exec_beeline(oldpage_query)
+        # Execute the Hive query, dropping the data table first in case
+        # a failed update created it
+        retcode = hive.exec_beeline('''DROP TABLE IF EXISTS \
+{hive_database}.{oldpage_data_table}; {query}'''.format(
+    hive_database=self.config['hive_database'],
+    oldpage_data_table=self.config['hive_oldpage_data_table'],
+    query=oldpage_query.strip()), runner=self.runner)
+        if retcode != 0:
+            logging.error('Hive query for old page views failed')
+            raise(HiveError)
 
         # ok, done
         return()
 
+    def calculate_local_views(self, sliding_window):
+        '''
+        Calculate the views of the pages in the two export tables from the
+        local view store (see the `viewstore` module) instead of Hive, and
+        load them into the same MySQL tables that `hadoop_to_mysql` fills,
+        so that `update_stats` works the same for both.
+
+        Returns True if the views were calculated, and False if the store
+        is missing data for some of the days, in which case nothing is
+        changed and the Hive path should be used.
+
+        :param sliding_window: the sliding window used to calculate the
+                               moving average view rates
+        :type sliding_window: dict
+        '''
+
+        ## Query to get all page IDs in an export table
+        page_id_query = '''SELECT page_id FROM {}'''
+
+        insert_oldpage_query = '''INSERT INTO {temp_oldpage_table}
+                                   (page_id, old_views, new_views)
+                                   VALUES (%s, %s, %s)'''
+
+        insert_newpage_query = '''INSERT INTO {temp_newpage_table}
+                                   (page_id, view_year, view_month, view_day,
+                                    num_views)
+                                   VALUES (%s, %s, %s, %s, %s)'''
+
+        store = viewstore.DailyViewStore(self.config['view_store'])
+
+        ## The days we need, see `get_oldpage_views` and `get_newpage_views`
+        if not sliding_window['old'].start:
+            leaving = viewstore.date_range(sliding_window['old'].end,
+                                           sliding_window['new'].end)
+            entering = []
+        else:
+            (leaving, entering) = [viewstore.date_range(edge.start, edge.end)
+                                   for edge in window_edges(sliding_window)]
+        newpage_days = viewstore.date_range(sliding_window['old'].end,
+                                            sliding_window['new'].end)
+
+        missing = [day for day in sorted(set(leaving + entering + newpage_days))
+                   if not store.has_day(day)]
+        if missing:
+            logging.warning('local view store has no data for {} day(s) starting with {}'.format(len(missing), missing[0]))
+            return(False)
+
+        def read_page_ids(table):
+            with db.cursor(self.db_conn, 'ss') as db_cursor:
+                db_cursor.execute(page_id_query.format(table))
+                return(np.fromiter((row[0] for row in db_cursor),
+                                   dtype=np.int64))
+
+        oldpage_ids = read_page_ids(self.config['temp_oldpage_table'])
+        newpage_ids = read_page_ids(self.config['temp_newpage_table'])
+        logging.info('calculating views for {} pages and {} new pages'.format(
+            len(oldpage_ids), len(newpage_ids)))
+
+        ## Views leaving and entering the window for "old" pages,
+        ## only pages with views are stored, as with the Hive query
+        old_views = np.zeros(len(oldpage_ids), dtype=np.int64)
+        for day in leaving:
+            old_views += store.day_views(day, oldpage_ids)
+        new_views = np.zeros(len(oldpage_ids), dtype=np.int64)
+        for day in entering:
+            new_views += store.day_views(day, oldpage_ids)
+
+        has_views = (old_views > 0) | (new_views > 0)
+        oldpage_rows = list(zip(oldpage_ids[has_views].tolist(),
+                                old_views[has_views].tolist(),
+                                new_views[has_views].tolist()))
+
+        ## Views per day for new pages
+        newpage_rows = []
+        for day in newpage_days:
+            views = store.day_views(day, newpage_ids)
+            has_views = views > 0
+            newpage_rows.extend(
+                (page_id, day.year, day.month, day.day, n)
+                for (page_id, n) in zip(newpage_ids[has_views].tolist(),
+                                        views[has_views].tolist()))
+
+        # Execute a SQL file to drop and recreate the target tables
+        db.execute_sql(self.config['create_mysql_file'],
+                       self.config['db_server'], self.config['db_name'],
+                       self.config['db_config_file'])
+
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            for (query, rows) in [(insert_oldpage_query, oldpage_rows),
+                                  (insert_newpage_query, newpage_rows)]:
+                query = query.format_map(self.config)
+                i = 0
+                while i < len(rows):
+                    db_cursor.executemany(query,
+                                          rows[i : i + INSERT_BATCH_SIZE])
+                    i += INSERT_BATCH_SIZE
+            self.db_conn.commit()
+
+        logging.info('loaded views of {} pages and {} days of new page views'.format(len(oldpage_rows), len(newpage_rows)))
+
+        # ok, done
+        return(True)
+
     def hadoop_to_mysql(self):
         '''
         Use `sqoop` to export the data tables from Hadoop back into MySQL.
         '''
 
+        ## The number of mappers of each export is chosen from the size of
+        ## the table of pages it has views for, counted before the target
+        ## tables replace the export tables of the same name
+        rows = self.count_rows([self.config['temp_oldpage_table'],
+                                self.config['temp_newpage_table']])
+
         # Execute a SQL file to drop and recreate the target tables
         db.execute_sql(self.config['create_mysql_file'],
                        self.config['db_server'], self.config['db_name'],
                        self.config['db_config_file'])
-        
-        # Path to the table is `hive_path`/`database_name`.db/`table_name`
-        sqoop = hive.sqoop_export_table(
-            self.config['db_server'],
-            self.config['db_name'],
-            self.config['temp_oldpage_table'],
-            '{path}/{database}.db/{table}'.format(
-                path=self.config['hive_path'],
-                database=self.config['hive_database'],
-                table=self.config['hive_oldpage_data_table']),
-            self.config['db_username'],
-            self.config['sqoop_password_file'])
-
-        if sqoop is None:
-            logging.error('sqoop export of oldpage table failed')
-            raise(ScoopException)
-        
-        sqoop = hive.sqoop_export_table(
-            self.config['db_server'],
-            self.config['db_name'],
-            self.config['temp_newpage_table'],
-            '{path}/{database}.db/{table}'.format(
-                path=self.config['hive_path'],
-                database=self.config['hive_database'],
-                table=self.config['hive_newpage_data_table']),
-            self.config['db_username'],
-            self.config['sqoop_password_file'])
-
-        if sqoop is None:
-            logging.error('sqoop export of oldpage table failed')
-            raise(ScoopException)
-
-       # ok, done
+
+        # Path to the table is `hive_path`/`database_name`.db/`table_name`,
+        # the two exports are independent and run concurrently
+        transfers = []
+        for (name, table, hive_table) in [
+                ('oldpage export', self.config['temp_oldpage_table'],
+                 self.config['hive_oldpage_data_table']),
+                ('newpage export', self.config['temp_newpage_table'],
+                 self.config['hive_newpage_data_table'])]:
+            transfers.append(hive.Transfer(name, hive.make_export_command(
+                self.config['db_server'],
+                self.config['db_name'],
+                table,
+                '{path}/{database}.db/{table}'.format(
+                    path=self.config['hive_path'],
+                    database=self.config['hive_database'],
+                    table=hive_table),
+                self.config['db_username'],
+                self.config['sqoop_password_file'],
+                num_mappers=self.num_mappers(rows[table]))))
+
+        self.run_transfers(transfers)
+
+        # ok, done
         return()
 
     def update_stats(self, sliding_window):
@@ -698,9 +1130,6 @@ GROUP BY a.page_id'''.format(
         to determine how we're updating  "old" pages.
         '''
 
-        ## Query to add an index on the `page_id` column to a table
-        add_index_query = '''ALTER TABLE {}
-                             ADD INDEX pid_idx (page_id)'''
         
         ## Query used to update old pages if it's the first calculation.
         ## Two left joins because a page might have 0 direct views, but
@@ -778,11 +1207,12 @@ GROUP BY a.page_id'''.format(
              GROUP BY page_id, view_year, view_month, view_day'''
 
         with db.cursor(self.db_conn, 'dict') as db_cursor:
-            # Execute SQL commands to add indexes to the two new tables.
-            db_cursor.execute(add_index_query.format(
-                self.config['temp_oldpage_table']))
-            db_cursor.execute(add_index_query.format(
-                self.config['temp_newpage_table']))
+            # Add indexes to the two new tables, unless a previous attempt
+            # at this stage did. ALTER TABLE commits implicitly, so they
+            # remain if the updates below fail.
+            for table in [self.config['temp_oldpage_table'],
+                          self.config['temp_newpage_table']]:
+                self.add_index(db_cursor, table, 'pid_idx', 'page_id')
 
             ## Update the "old" page table, either one side if first run,
             ## or both sides of the sliding window if updating.
@@ -804,16 +1234,78 @@ GROUP BY a.page_id'''.format(
         # ok, done
         return()
 
+    def export_tables_replaced(self):
+        '''
+        Return True if the export tables have been replaced by the empty
+        import tables, meaning an earlier attempt at loading the views
+        into MySQL failed after running `create_mysql_file`. The "old"
+        page import table is recognised by its `old_views` column.
+        '''
+
+        find_column_query = '''SELECT COUNT(*) AS num_columns
+                               FROM information_schema.columns
+                               WHERE table_schema=DATABASE()
+                               AND table_name=%(table)s
+                               AND column_name=%(column)s'''
+
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            db_cursor.execute(find_column_query,
+                              {'table': self.config['temp_oldpage_table'],
+                               'column': 'old_views'})
+            return(db_cursor.fetchone()['num_columns'] > 0)
+
+    def add_index(self, db_cursor, table, index_name, column):
+        '''
+        Add an index on the given column to the given table in our
+        database, unless the table already has an index of that name.
+
+        :param db_cursor: cursor to use
+        :type db_cursor: MySQLdb.cursors.DictCursor
+
+        :param table: name of the table
+        :type table: str
+
+        :param index_name: name of the index
+        :type index_name: str
+
+        :param column: the column to index
+        :type column: str
+        '''
+
+        find_index_query = '''SELECT COUNT(*) AS num_indexes
+                              FROM information_schema.statistics
+                              WHERE table_schema=DATABASE()
+                              AND table_name=%(table)s
+                              AND index_name=%(index)s'''
+
+        add_index_query = '''ALTER TABLE {table}
+                             ADD INDEX {index} ({column})'''
+
+        db_cursor.execute(find_index_query, {'table': table,
+                                             'index': index_name})
+        if db_cursor.fetchone()['num_indexes']:
+            logging.info('{} already has index {}'.format(table, index_name))
+            return()
+
+        db_cursor.execute(add_index_query.format(
+            table=table, index=index_name, column=column))
+        return()
+
     def check_new_pages(self, sliding_window):
         '''
         Get data on all new pages, if they were created before
         the beginning of the sliding window, update the page table
         and delete them from the new page tables.
 
+        Runs `check_new_pages_set` instead if `sync_mode` is "set".
+
         :param sliding_window: the moving average sliding window
         :type sliding_window: dict
         '''
 
+        if self.config.get('sync_mode', 'slice') == 'set':
+            return(self.check_new_pages_set(sliding_window))
+
         ## Query to get the page IDs of all new pages created before
         ## the beginning of the sliding window
         get_pages_query = '''SELECT page_id
@@ -856,6 +1348,68 @@ GROUP BY a.page_id'''.format(
         ## ok, done
         return()
 
+    def check_new_pages_set(self, sliding_window):
+        '''
+        Set-based version of `check_new_pages`. Updates all new pages
+        created before the beginning of the sliding window with a single
+        multi-table UPDATE, then deletes them from both new page tables.
+
+        :param sliding_window: the moving average sliding window
+        :type sliding_window: dict
+        '''
+
+        ## Query to set the views of all new pages created before the
+        ## beginning of the window to their views within the window.
+        ## Left join so pages without views are set to NULL, as the
+        ## subquery in `check_new_pages` does.
+        update_pages_query = '''UPDATE {page_table} p
+                                JOIN {newpage_table} n
+                                ON p.page_id=n.page_id
+                                LEFT JOIN (SELECT nd.page_id,
+                                                  SUM(nd.num_views) AS num_views
+                                           FROM {newpage_data_table} nd
+                                           JOIN {newpage_table} n2
+                                           ON nd.page_id=n2.page_id
+                                           WHERE n2.first_edit < %(beginning)s
+                                           AND nd.view_date BETWEEN %(start)s
+                                                            AND %(end)s
+                                           GROUP BY nd.page_id) AS v
+                                ON p.page_id=v.page_id
+                                SET p.num_views=v.num_views
+                                WHERE n.first_edit < %(beginning)s'''
+
+        ## Queries to delete those pages from both new page tables
+        delete_data_query = '''DELETE nd FROM {newpage_data_table} nd
+                               JOIN {newpage_table} n
+                               USING (page_id)
+                               WHERE n.first_edit < %(beginning)s'''
+
+        delete_newpage_query = '''DELETE FROM {newpage_table}
+                                  WHERE first_edit < %(beginning)s'''
+
+        ## Midnight at the earliest date of the current side of the window
+        beginning = dt.datetime.combine(sliding_window['old'].end, dt.time())
+        params = {'beginning': beginning,
+                  'start': sliding_window['old'].end,
+                  'end': sliding_window['new'].end}
+
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            db_cursor.execute(update_pages_query.format_map(self.config),
+                              params)
+            logging.info('updated {} pages that are no longer new'.format(
+                db_cursor.rowcount))
+
+            db_cursor.execute(delete_data_query.format_map(self.config),
+                              params)
+            db_cursor.execute(delete_newpage_query.format_map(self.config),
+                              params)
+            logging.info('deleted {} pages from the new page table'.format(
+                db_cursor.rowcount))
+
+            self.db_conn.commit()
+        ## ok, done
+        return()
+
     def delete_newpage(self, page_id):
         '''
         Delete the given page from the "newpage" and "newpage_data" tables.
@@ -908,152 +1462,271 @@ GROUP BY a.page_id'''.format(
         return()
 
     
-    def update(self):
+    def connect(self):
         '''
-        Update our view rate data using a current snapshot of the `page` table,
-        processing data from whenever our last update was.
+        Connect to our database server, if we are not connected.
+        '''
+        if self.db_conn is None:
+            self.db_conn = db.connect(self.config['db_server'],
+                                      self.config['db_name'],
+                                      self.config['db_config_file'])
+        return()
+
+    def disconnect(self):
+        '''
+        Disconnect from our database server, if we are connected.
+        '''
+        if self.db_conn is not None:
+            db.disconnect(self.db_conn)
+            self.db_conn = None
+        return()
+
+    def get_status(self):
+        '''
+        Get the row of the status table, with the time of the latest update
+        and the checkpoint of an update in progress (see `record_stage`).
         '''
 
-        ## Check and update status
-        get_status_query = '''SELECT latest_update
+        get_status_query = '''SELECT latest_update, run_timestamp,
+                                     run_stage, run_data
                               FROM {status_table}'''
 
-        update_status_query = '''UPDATE {status_table}
-                                 SET latest_update=%(new_timestamp)s'''
-        
-        # connect to database server
-        self.db_conn = db.connect(self.config['db_server'],
-                                  self.config['db_name'],
-                                  self.config['db_config_file'])
+        with db.cursor(self.db_conn, 'dict') as db_cursor:
+            db_cursor.execute(get_status_query.format_map(self.config))
+            return(db_cursor.fetchone())
 
-        ## Record the time we start updating, as that will be used both for
-        ## calculating deltas and stored in the database upon completion
-        update_timestamp = dt.datetime.now(dt.timezone.utc)
-        
-        # take a snapshot of non-redirecting articles
-        logging.info('taking a snapshot of the page and redirect tables')
-        try:
-            self.make_snapshots()
-        except SnapshotError:
-            logging.error('failed to snapshot the page table, unable to continue')
-            return()
-        
-        # Compare vr_page to page to identify pages that should be deleted,
-        # and delete those pages.
-        logging.info('finding pages to delete...')
-        self.delete_pages_and_redirects()
-
-        # compare vr_page to page to identify new pages
-        logging.info('finding pages to add...')
-        added_pages = self.add_pages()
-
-        # figure out the timespan since the last update and calculate the
-        # two sides of the sliding window
-        last_update = None
+    def record_stage(self, update_timestamp, stage, run_data):
+        '''
+        Record in the status table that the given stage of the update that
+        started at `update_timestamp` is completed, along with the data
+        later stages need (e.g. the pages added). Connects to the database
+        for the duration if we are not connected, as during Hive stages.
+
+        :param update_timestamp: time the update started
+        :type update_timestamp: datetime.datetime
+
+        :param stage: the completed stage, one of `STAGES`
+        :type stage: str
+
+        :param run_data: data passed between stages, stored as JSON
+        :type run_data: dict
+        '''
+
+        record_query = '''UPDATE {status_table}
+                          SET run_timestamp=%(run_timestamp)s,
+                              run_stage=%(run_stage)s,
+                              run_data=%(run_data)s'''
+
+        connected = self.db_conn is not None
+        self.connect()
         with db.cursor(self.db_conn, 'dict') as db_cursor:
-            db_cursor.execute(get_status_query.format(
-                status_table=self.config['status_table']))
-            row = db_cursor.fetchone()
-            last_update = row['latest_update']
+            db_cursor.execute(record_query.format_map(self.config),
+                              {'run_timestamp': update_timestamp,
+                               'run_stage': stage,
+                               'run_data': json.dumps(run_data)})
+        self.db_conn.commit()
+        if not connected:
+            self.disconnect()
+        return()
+
+    def make_sliding_window(self, last_update, update_timestamp):
+        '''
+        Make the two sides of the sliding window of an update. If we never
+        updated before, the old side has no start and spans the `k` days
+        we calculate views for.
+
+        :param last_update: time of the last update, or None
+        :type last_update: datetime.datetime
+
+        :param update_timestamp: time the update started
+        :type update_timestamp: datetime.datetime
+        '''
 
-        # If we never updated before, identify "new" pages
         if last_update is None:
             ## We fake the sliding window so we update our data across
             ## the past k days.
-            sliding_window = {'old': MAWindow(
+            return({'old': MAWindow(
                 None,
                 update_timestamp - dt.timedelta(days=self.config['delay_days']
                                                      + self.config['k'] -1)),
-                              'new': MAWindow(
+                    'new': MAWindow(
                 None,
-                update_timestamp - dt.timedelta(self.config['delay_days']))}
+                update_timestamp - dt.timedelta(self.config['delay_days']))})
+
+        # Create the sliding windows that allows us to easily calculate
+        # the time spans we are updating on either side.
+        # The oldest side is from last_update - delay_days - k + 1 day
+        # to today - delay_days - k + 1 day
+        # We have to add a day because the date range is _inclusive_.
+        return({'old': MAWindow(
+            last_update - dt.timedelta(days=self.config['delay_days']
+                                            + self.config['k'] -1),
+            last_update - dt.timedelta(days=self.config['delay_days'])),
+                # The most recent side is from
+                # last_update - delay_days
+                # to today - delay_days
+                'new': MAWindow(
+            update_timestamp - dt.timedelta(days=self.config['delay_days']
+                                                 + self.config['k'] -1),
+            update_timestamp - dt.timedelta(self.config['delay_days']))})
+
+    def update(self, restart=False):
+        '''
+        Update our view rate data using a current snapshot of the `page` table,
+        processing data from whenever our last update was.
 
-            logging.info('never updated before, identifying new pages')
-            self.initialize_newpage(sliding_window['old'].end)
-        else:
-            ## Update titles of the `page` table to match the snapshot
-            self.update_titles()
-
-            # Create the sliding windows that allows us to easily calculate
-            # the time spans we are updating on either side.
-            # The oldest side is from last_update - delay_days - k + 1 day
-            # to today - delay_days - k + 1 day
-            # We have to add a day because the date range is _inclusive_.
-            sliding_window  = {'old': MAWindow(
-                last_update - dt.timedelta(days=self.config['delay_days']
-                                                + self.config['k'] -1),
-                last_update - dt.timedelta(days=self.config['delay_days'])),
-                               # The most recent side is from
-                               # last_update - delay_days
-                               # to today - delay_days
-                               'new': MAWindow(
-                update_timestamp - dt.timedelta(days=self.config['delay_days']
-                                                     + self.config['k'] -1),
-                update_timestamp - dt.timedelta(self.config['delay_days']))}
-            
-            # find the first edit of all the new pages, then add them
-            logging.info('last update was {}, adding new pages')
-            self.add_newpages(self.find_first_edits(added_pages))
+        The update runs as the sequence of stages in `STAGES`, and each
+        completed stage is recorded in the status table. If an update fails,
+        e.g. because `sqoop` or `beeline` did, running it again resumes after
+        the last completed stage using the same update time, rather than
+        starting over with new snapshots.
 
-        ## Added pages is no longer useful and can be GCed if necessary
-        del(added_pages)
-            
-        ## Create the `page` and `newpage` tables that will be exported
-        ## to Hadoop to be used for queries.
-        logging.info('creating tables for export to Hadoop')
-        self.create_export_tables(sliding_window['new'].end)
-
-        ## The import/export process can take a while, so we disconnect
-        ## the database connection now and reconnect aftewards.
-        db.disconnect(self.db_conn)
-            
-        logging.info('exporting page data from MySQL to Hadoop')
-        try:
-            self.mysql_to_hadoop()
-        except ScoopException as e:
-            return()
+        :param restart: discard the checkpoint of a failed update and start
+                        over instead of resuming it
+        :type restart: bool
+        '''
 
-        # Use `beeline` to calculate views at either end of our
-        # view rate window for old pages
-        logging.info('calculating views for old pages with Hive')
-        self.get_oldpage_views(sliding_window)
+        ## Query to store the time of this update and clear the checkpoint
+        update_status_query = '''UPDATE {status_table}
+                                 SET latest_update=%(new_timestamp)s,
+                                     run_timestamp=NULL,
+                                     run_stage=NULL,
+                                     run_data=NULL'''
 
-        # Use `beeline` to calculate views at the most recent end
-        # of our view rate window for new pages
-        logging.info('calculating views for news pages with Hive')
-        self.get_newpage_views(sliding_window)
+        # connect to database server
+        self.connect()
 
-        # export the data we just generated from Hadoop to MySQL
-        logging.info('exporting data from Hadoop to MySQL')
-        try:
-            self.hadoop_to_mysql()
-        except ScoopException as e:
-            return()
+        status = self.get_status()
+        last_update = status['latest_update']
 
-        # grab the data we just generated and update our database
-        logging.info('updating database based on new data')
-        self.db_conn = db.connect(self.config['db_server'],
-                                  self.config['db_name'],
-                                  self.config['db_config_file'])
-        self.update_stats(sliding_window)
+        if status['run_stage'] and not restart:
+            ## Resume the failed update where it stopped
+            update_timestamp = status['run_timestamp']
+            run_data = json.loads(status['run_data'] or '{}')
+            completed = STAGES[:STAGES.index(status['run_stage']) + 1]
+            logging.info('resuming the update started at {} after stage {}'.format(update_timestamp, status['run_stage']))
+        else:
+            if status['run_stage']:
+                logging.info('discarding the update started at {}, dropping its tables'.format(status['run_timestamp']))
+                self.drop_temp_tables()
+
+            ## Record the time we start updating, as that will be used both
+            ## for calculating deltas and stored in the database upon
+            ## completion
+            update_timestamp = dt.datetime.now(dt.timezone.utc)
+            run_data = {}
+            completed = []
+
+        sliding_window = self.make_sliding_window(last_update,
+                                                  update_timestamp)
+
+        def sync_pages():
+            # Compare vr_page to page to identify pages that should be
+            # deleted, and delete those pages.
+            logging.info('finding pages to delete...')
+            self.delete_pages_and_redirects()
+
+            # compare vr_page to page to identify new pages, they are
+            # pending in the newpage table until their first edits are found
+            logging.info('finding pages to add...')
+            self.add_pages()
+
+        def newpages():
+            if last_update is None:
+                logging.info('never updated before, identifying new pages')
+                self.initialize_newpage(sliding_window['old'].end)
+            else:
+                ## Update titles of the `page` table to match the snapshot
+                self.update_titles()
+
+                # find the first edit of all the new pages, then add them.
+                # They are read from the newpage table rather than kept from
+                # `add_pages`, so a resumed update finds them too.
+                logging.info('last update was {}, adding new pages'.format(
+                    last_update))
+                self.add_newpages(self.find_first_edits(
+                    self.pending_newpages()))
+
+            ## Pages that are still pending are not new pages
+            self.delete_pending_newpages()
+
+        def local_views():
+            ## An earlier attempt at this stage may have replaced the
+            ## export tables before failing, they are then recreated
+            if self.export_tables_replaced():
+                logging.info('export tables were replaced by an earlier attempt, recreating them')
+                self.create_export_tables(sliding_window['new'].end)
+
+            ## Calculate views from the local view store if that is our
+            ## backend, falling back to Hive if the store is missing data
+            run_data['local_views'] = False
+            if self.config.get('view_backend', 'hive') == 'local':
+                logging.info('calculating views from the local view store')
+                run_data['local_views'] = self.calculate_local_views(
+                    sliding_window)
+                if not run_data['local_views']:
+                    logging.warning('falling back to calculating views with Hive')
+
+        ## The stages as tuples of name, whether it uses our database
+        ## connection, and the function that runs it. The Hive stages
+        ## can take a while, so we are disconnected while they run.
+        stages = [
+            ('snapshot', True, self.make_snapshots),
+            ('sync_pages', True, sync_pages),
+            ('newpages', True, newpages),
+            ('export_tables', True,
+             lambda: self.create_export_tables(sliding_window['new'].end)),
+            ('local_views', True, local_views),
+            ('hadoop_export', False, self.mysql_to_hadoop),
+            ('hive_oldpage_views', False,
+             lambda: self.get_oldpage_views(sliding_window)),
+            ('hive_newpage_views', False,
+             lambda: self.get_newpage_views(sliding_window)),
+            ('hadoop_import', False, self.hadoop_to_mysql),
+            ('update_stats', True,
+             lambda: self.update_stats(sliding_window)),
+            ('check_new_pages', True,
+             lambda: self.check_new_pages(sliding_window))]
+
+        hive_stages = set(['hadoop_export', 'hive_oldpage_views',
+                           'hive_newpage_views', 'hadoop_import'])
+
+        for (stage, uses_db, run_stage) in stages:
+            if stage in completed:
+                logging.info('stage {} is already completed'.format(stage))
+                continue
+            if stage in hive_stages and run_data.get('local_views'):
+                continue
+
+            if uses_db:
+                self.connect()
+            else:
+                self.disconnect()
+
+            logging.info('running stage {}'.format(stage))
+            try:
+                run_stage()
+            except (SnapshotError, SqoopError, HiveError):
+                logging.error('update failed in stage {}, rerun to resume it'.format(stage))
+                self.disconnect()
+                return()
 
-        # identify all new pages for which we have all data, update their
-        # values and delete their data from vr_newpage and vr_newpage_data
-        logging.info('checking new pages for complete data')
-        self.check_new_pages(sliding_window)
+            self.record_stage(update_timestamp, stage, run_data)
 
         ## Delete the four temporary tables we have been using
+        self.connect()
         self.drop_temp_tables()
-        
+
         # update the last_update timestamp
         logging.info('updating last update timestamp')
         with db.cursor(self.db_conn, 'dict') as db_cursor:
             db_cursor.execute(update_status_query.format(
                 status_table=self.config['status_table']),
                               {'new_timestamp': update_timestamp})
+        self.db_conn.commit()
 
         logging.info('all done!')
-        db.disconnect(self.db_conn)
+        self.disconnect()
         # ok, done
         return()
 
@@ -1071,6 +1744,9 @@ def main():
     # YAML configuration file
     cli_parser.add_argument('config_file',
                             help='path to the YAML configuration file')
+
+    cli_parser.add_argument('--restart', action='store_true',
+                            help='start over instead of resuming a failed update')
     
     args = cli_parser.parse_args()
 
@@ -1078,7 +1754,7 @@ def main():
         logging.basicConfig(level=logging.INFO)
 
     rates = Viewrates(args.config_file)
-    rates.update()
+    rates.update(restart=args.restart)
         
     return()
 
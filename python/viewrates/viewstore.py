@@ -0,0 +1,243 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for a local store of daily page views per page, partitioned by date,
+used to calculate view rates without exporting data to and from Hadoop.
+
+Every day is a directory `YYYY/MM/DD` holding two NumPy arrays: the page IDs
+with views that day, sorted, and the number of views of each. A day is
+written to a temporary directory that is renamed when complete, so a day
+is either fully present or missing.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import shutil
+import logging
+import datetime as dt
+
+import numpy as np
+
+class MissingDataError(Exception):
+    '''
+    The store does not have data for all the days asked for.
+    '''
+    def __init__(self, days):
+        self.days = days
+        super().__init__('no view data for {} day(s), first missing day is {}'.format(len(days), days[0]))
+
+def date_range(start, end):
+    '''
+    Return a list of the dates from `start` to `end`, inclusive.
+
+    :param start: first date in the range
+    :type start: datetime.date
+
+    :param end: last date in the range
+    :type end: datetime.date
+    '''
+    one_day = dt.timedelta(days=1)
+    dates = []
+    i = start
+    while i <= end:
+        dates.append(i)
+        i += one_day
+    return(dates)
+
+class DailyViewStore:
+    '''
+    A date-partitioned store of daily views per page.
+    '''
+    def __init__(self, path):
+        '''
+        :param path: path to the directory of the store, created if necessary
+        :type path: str
+        '''
+        self.path = os.path.expanduser(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def day_path(self, date):
+        '''
+        Return the path to the directory of the given day.
+
+        :param date: the day
+        :type date: datetime.date
+        '''
+        return(os.path.join(self.path, '{:04d}'.format(date.year),
+                            '{:02d}'.format(date.month),
+                            '{:02d}'.format(date.day)))
+
+    def has_day(self, date):
+        '''
+        Does the store have data for the given day?
+
+        :param date: the day
+        :type date: datetime.date
+        '''
+        return(os.path.isdir(self.day_path(date)))
+
+    def missing_days(self, start, end):
+        '''
+        Return a list of the days from `start` to `end` (inclusive)
+        that the store does not have data for.
+
+        :param start: first day
+        :type start: datetime.date
+
+        :param end: last day
+        :type end: datetime.date
+        '''
+        return([day for day in date_range(start, end)
+                if not self.has_day(day)])
+
+    def write_day(self, date, page_ids, views, replace=False):
+        '''
+        Write the views of the given day to the store. Views of the same
+        page are added up.
+
+        :param date: the day
+        :type date: datetime.date
+
+        :param page_ids: page ID of every entry
+        :type page_ids: numpy.ndarray
+
+        :param views: number of views of every entry
+        :type views: numpy.ndarray
+
+        :param replace: replace the day's data if the store already has it
+        :type replace: bool
+        '''
+
+        path = self.day_path(date)
+        if os.path.isdir(path) and not replace:
+            logging.warning('view data for {} already exists, not replacing it'.format(date))
+            return()
+
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        views = np.asarray(views, dtype=np.int64)
+
+        ## Sort on page ID and add up the views of every page
+        order = np.argsort(page_ids, kind='stable')
+        page_ids = page_ids[order]
+        views = views[order]
+        if len(page_ids):
+            starts = np.flatnonzero(np.concatenate(
+                ([True], page_ids[1:] != page_ids[:-1])))
+            views = np.add.reduceat(views, starts)
+            page_ids = page_ids[starts]
+
+        tmp_path = '{}-tmp{}'.format(path, os.getpid())
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'page_id.npy'), page_ids)
+        np.save(os.path.join(tmp_path, 'views.npy'), views)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+        return()
+
+    def read_day(self, date):
+        '''
+        Read the given day, returning a tuple of the sorted array of page IDs
+        and the array of the number of views of each page. The arrays are
+        memory-mapped.
+
+        :param date: the day
+        :type date: datetime.date
+        '''
+        path = self.day_path(date)
+        if not os.path.isdir(path):
+            raise(MissingDataError([date]))
+
+        return((np.load(os.path.join(path, 'page_id.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'views.npy'), mmap_mode='r')))
+
+    def day_views(self, date, page_ids):
+        '''
+        Return an array of the number of views on the given day of each
+        of the given pages.
+
+        :param date: the day
+        :type date: datetime.date
+
+        :param page_ids: the page IDs
+        :type page_ids: numpy.ndarray
+        '''
+        (day_ids, day_views) = self.read_day(date)
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        views = np.zeros(len(page_ids), dtype=np.int64)
+        if not len(day_ids):
+            return(views)
+
+        pos = np.searchsorted(day_ids, page_ids)
+        pos[pos == len(day_ids)] = 0
+        found = day_ids[pos] == page_ids
+        views[found] = day_views[pos[found]]
+        return(views)
+
+    def sum_views(self, page_ids, start, end):
+        '''
+        Return an array of the total number of views from `start` to `end`
+        (inclusive) of each of the given pages. Raises `MissingDataError` if
+        the store does not have all the days.
+
+        :param page_ids: the page IDs
+        :type page_ids: numpy.ndarray
+
+        :param start: first day
+        :type start: datetime.date
+
+        :param end: last day
+        :type end: datetime.date
+        '''
+        missing = self.missing_days(start, end)
+        if missing:
+            raise(MissingDataError(missing))
+
+        total = np.zeros(len(page_ids), dtype=np.int64)
+        for day in date_range(start, end):
+            total += self.day_views(day, page_ids)
+        return(total)
+
+    def daily_views(self, page_ids, start, end):
+        '''
+        Yield a tuple of the date and an array of the number of views of
+        each of the given pages for every day from `start` to `end`
+        (inclusive). Raises `MissingDataError` if the store does not have
+        all the days.
+
+        :param page_ids: the page IDs
+        :type page_ids: numpy.ndarray
+
+        :param start: first day
+        :type start: datetime.date
+
+        :param end: last day
+        :type end: datetime.date
+        '''
+        missing = self.missing_days(start, end)
+        if missing:
+            raise(MissingDataError(missing))
+
+        for day in date_range(start, end):
+            yield (day, self.day_views(day, page_ids))
@@ -0,0 +1,262 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library of counters for the number of unique items (typically the titles
+of referring articles) seen, used to count active inlinks with less
+memory than a Python set of strings.
+
+All counters support `add()`, `update()` and `len()` like a set, which
+means a plain `set` can be used where exact counts of a small number of
+items are wanted. Counters of the same type can be merged by passing one
+to the other's `update()`.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import math
+
+from array import array
+from hashlib import blake2b
+from functools import partial
+
+## Names of the available counter backends, see `counter_factory`
+BACKENDS = ['set', 'exact', 'sorted', 'hll']
+
+## Default relative standard error of the HyperLogLog counter
+HLL_ERROR = 0.01
+
+class Interner:
+    '''
+    Maps items to consecutive integer IDs so each item is only stored once
+    no matter how many counters have seen it.
+    '''
+    def __init__(self):
+        self.ids = {}
+        self.items = []
+
+    def intern(self, item):
+        '''
+        Return the integer ID of the given item, assigning one if needed.
+
+        :param item: the item to intern
+        :type item: str
+        '''
+        try:
+            return(self.ids[item])
+        except KeyError:
+            item_id = len(self.items)
+            self.ids[item] = item_id
+            self.items.append(item)
+            return(item_id)
+
+## The interner shared by all counters in a process. Integer IDs are only
+## valid within the process, counters are therefore pickled as items.
+_interner = Interner()
+
+class ExactCounter:
+    '''
+    Exact counter storing a set of interned integer IDs.
+    '''
+    __slots__ = ['ids']
+
+    def __init__(self, items=()):
+        self.ids = set()
+        self.update(items)
+
+    def add(self, item):
+        self.ids.add(_interner.intern(item))
+
+    def update(self, items):
+        if isinstance(items, ExactCounter):
+            self.ids.update(items.ids)
+        else:
+            for item in items:
+                self.ids.add(_interner.intern(item))
+
+    def __len__(self):
+        return(len(self.ids))
+
+    def __iter__(self):
+        return(_interner.items[item_id] for item_id in self.ids)
+
+    def __reduce__(self):
+        return((ExactCounter, (list(self),)))
+
+class SortedArrayCounter:
+    '''
+    Exact counter storing interned integer IDs in a compact array. New IDs
+    are appended, and the array is sorted and de-duplicated whenever it has
+    doubled in size since the last time, or when the count is needed.
+    '''
+    __slots__ = ['ids', 'n_compact']
+
+    def __init__(self, items=()):
+        self.ids = array('q')
+        self.n_compact = 0
+        self.update(items)
+
+    def add(self, item):
+        self.ids.append(_interner.intern(item))
+        if len(self.ids) > 2 * self.n_compact + 16:
+            self.compact()
+
+    def update(self, items):
+        if isinstance(items, SortedArrayCounter):
+            self.ids.extend(items.ids)
+            self.compact()
+        else:
+            for item in items:
+                self.add(item)
+
+    def compact(self):
+        '''
+        Sort and remove duplicates from the array of IDs.
+        '''
+        self.ids = array('q', sorted(set(self.ids)))
+        self.n_compact = len(self.ids)
+
+    def __len__(self):
+        if len(self.ids) != self.n_compact:
+            self.compact()
+        return(self.n_compact)
+
+    def __iter__(self):
+        if len(self.ids) != self.n_compact:
+            self.compact()
+        return(_interner.items[item_id] for item_id in self.ids)
+
+    def __reduce__(self):
+        return((SortedArrayCounter, (list(self),)))
+
+class HyperLogLog:
+    '''
+    Approximate counter using the HyperLogLog algorithm. Items are hashed
+    with a stable 64-bit hash so that counters built in different processes
+    can be merged. Until the counter has seen enough items to make the
+    registers the smaller representation, the hashes are kept in a set
+    and the count is exact.
+    '''
+    __slots__ = ['p', 'hashes', 'registers']
+
+    def __init__(self, items=(), error=HLL_ERROR):
+        '''
+        :param items: items to add to the counter
+        :type items: iterable
+
+        :param error: the relative standard error of the count
+        :type error: float
+        '''
+        ## The standard error is 1.04/sqrt(m) with m = 2**p registers
+        self.p = min(18, max(4, math.ceil(2 * math.log2(1.04 / error))))
+        self.hashes = set()
+        self.registers = None
+        self.update(items)
+
+    def add(self, item):
+        item_hash = int.from_bytes(
+            blake2b(item.encode('utf-8'), digest_size=8).digest(), 'big')
+        if self.registers is None:
+            self.hashes.add(item_hash)
+            ## A set uses in the order of 64 bytes per hash, the registers
+            ## use one byte each.
+            if len(self.hashes) > (1 << self.p) // 64:
+                self.densify()
+        else:
+            self.add_hash(item_hash)
+
+    def add_hash(self, item_hash):
+        '''
+        Update the registers with the given 64-bit hash.
+        '''
+        idx = item_hash >> (64 - self.p)
+        rest = item_hash & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def densify(self):
+        '''
+        Switch from storing hashes to storing registers.
+        '''
+        self.registers = bytearray(1 << self.p)
+        for item_hash in self.hashes:
+            self.add_hash(item_hash)
+        self.hashes = None
+
+    def update(self, items):
+        if not isinstance(items, HyperLogLog):
+            for item in items:
+                self.add(item)
+            return()
+
+        if items.p != self.p:
+            raise ValueError('cannot merge counters of different precision')
+
+        if items.registers is None:
+            if self.registers is None:
+                self.hashes.update(items.hashes)
+                if len(self.hashes) > (1 << self.p) // 64:
+                    self.densify()
+            else:
+                for item_hash in items.hashes:
+                    self.add_hash(item_hash)
+        else:
+            if self.registers is None:
+                self.densify()
+            self.registers = bytearray(map(max, self.registers,
+                                           items.registers))
+
+    def __len__(self):
+        if self.registers is None:
+            return(len(self.hashes))
+
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        ## Small range correction through linear counting
+        n_zero = self.registers.count(0)
+        if estimate <= 2.5 * m and n_zero:
+            estimate = m * math.log(m / n_zero)
+
+        return(int(round(estimate)))
+
+def counter_factory(backend='set', error=HLL_ERROR):
+    '''
+    Return a callable creating empty counters of the given backend.
+
+    :param backend: name of the backend, one of `BACKENDS`
+    :type backend: str
+
+    :param error: the relative standard error of the "hll" backend
+    :type error: float
+    '''
+
+    if backend == 'set':
+        return(set)
+    elif backend == 'exact':
+        return(ExactCounter)
+    elif backend == 'sorted':
+        return(SortedArrayCounter)
+    elif backend == 'hll':
+        return(partial(HyperLogLog, error=error))
+
+    raise ValueError('unknown counter backend {}'.format(backend))
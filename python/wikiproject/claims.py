@@ -0,0 +1,172 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for extracting the claims of Wikidata entities, as returned by the
+`wbgetentities` API (or found in the JSON dumps), as (QID, property, target)
+triples where the target is another Wikidata entity.
+
+Claims that do not point to an entity (e.g. "no value" claims, strings,
+quantities) or are malformed are skipped and counted in an optional
+`collections.Counter` of metrics, rather than logged one by one.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+## Names of the metrics counted when extracting claims
+ENTITIES = 'entities'          # entities processed
+CLAIMS = 'claims'              # claims with an allowed property
+TRIPLES = 'triples'            # claims extracted as triples
+NO_QID = 'no qid'              # entities without an ID
+NO_VALUE = 'no value'          # claims without a value ("no value" or
+                               # "some value" claims)
+NOT_ENTITY = 'not an entity'   # claims whose value is not an entity
+MALFORMED = 'malformed'        # claims that are not structured as expected
+
+def entity_triples(entity, properties=None, metrics=None):
+    '''
+    Return a list of (QID, property, target) triples for the claims of the
+    given entity that point to another entity.
+
+    :param entity: the entity, as returned by the Wikidata API
+    :type entity: dict
+
+    :param properties: only extract claims with these properties,
+                       or all claims if None
+    :type properties: set
+
+    :param metrics: counter the metrics are added to, see the constants
+                    of this module
+    :type metrics: collections.Counter
+    '''
+    return(triples({None: entity}, properties, metrics))
+
+def triples(entity_data, properties=None, metrics=None,
+            skip_redirects=False, targets=None):
+    '''
+    Return a list of (QID, property, target) triples for the claims of all
+    the given entities that point to another entity.
+
+    :param entity_data: the entities, as found in the `entities` part of
+                        a response from the Wikidata API
+    :type entity_data: dict
+
+    :param properties: only extract claims with these properties,
+                       or all claims if None
+    :type properties: set
+
+    :param metrics: counter the metrics are added to, see the constants
+                    of this module
+    :type metrics: collections.Counter
+
+    :param skip_redirects: skip entities the API resolved through a redirect
+    :type skip_redirects: bool
+
+    :param targets: only extract claims whose target is in the collection
+                    this maps the claim's property to, e.g. the rules
+                    of a side-chaining `Ruleset`. Implies `properties`.
+    :type targets: dict
+    '''
+
+    ## This is called for every API response and every line of a dump,
+    ## so the metrics are kept in local variables and the claims are
+    ## walked without helper calls.
+    result = []
+    append = result.append
+    n_entities = 0
+    n_claims = 0
+    n_no_qid = 0
+    n_no_value = 0
+    n_not_entity = 0
+    n_malformed = 0
+
+    if targets is not None:
+        properties = targets
+    allowed = None
+
+    for entity in entity_data.values():
+        if skip_redirects and 'redirects' in entity:
+            continue
+
+        n_entities += 1
+        qid = entity.get('id')
+        if qid is None:
+            n_no_qid += 1
+            continue
+
+        entity_claims = entity.get('claims')
+        if not entity_claims:
+            continue
+
+        for (prop, cdata) in entity_claims.items():
+            if properties is not None and prop not in properties:
+                continue
+
+            if isinstance(cdata, dict):
+                cdata = [cdata]
+            elif not isinstance(cdata, list):
+                n_claims += 1
+                n_malformed += 1
+                continue
+
+            if targets is not None:
+                allowed = targets[prop]
+
+            n_claims += len(cdata)
+            for c in cdata:
+                try:
+                    value = c['mainsnak']['datavalue']['value']
+                except KeyError:
+                    n_no_value += 1
+                    continue
+                except TypeError:
+                    n_malformed += 1
+                    continue
+
+                try:
+                    target = value['id']
+                except (KeyError, TypeError):
+                    n_not_entity += 1
+                    continue
+
+                if allowed is None or target in allowed:
+                    append((qid, prop, target))
+
+    if metrics is not None:
+        metrics[ENTITIES] += n_entities
+        metrics[CLAIMS] += n_claims
+        metrics[TRIPLES] += len(result)
+        metrics[NO_QID] += n_no_qid
+        metrics[NO_VALUE] += n_no_value
+        metrics[NOT_ENTITY] += n_not_entity
+        metrics[MALFORMED] += n_malformed
+
+    return(result)
+
+def format_metrics(metrics):
+    '''
+    Return a one-line summary of the given metrics, for logging.
+
+    :param metrics: the metrics
+    :type metrics: collections.Counter
+    '''
+    return(', '.join('{} {}'.format(metrics[name], name) for name in
+                     [ENTITIES, CLAIMS, TRIPLES, NO_QID, NO_VALUE,
+                      NOT_ENTITY, MALFORMED]))
@@ -0,0 +1,339 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for scanning the clickstream dataset in parallel, counting clicks
+for articles in one or more WikiProject snapshots.
+
+The dataset is split into chunks that are scanned by a pool of worker
+processes. Each worker returns partial counts per article, which are
+then merged into a single result. Uncompressed files are split into
+byte ranges aligned on line boundaries, while compressed files (bz2 or
+gzip) cannot be split that way and are instead decompressed in the main
+process and handed to the workers in batches of lines.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import bz2
+import gzip
+import logging
+
+from multiprocessing import Pool
+
+## Number of lines in a batch handed to a worker when reading
+## a compressed clickstream file.
+BATCH_SIZE = 500000
+
+## Number of chunks per worker process when splitting an uncompressed
+## file, more chunks than workers evens out the load.
+CHUNKS_PER_PROCESS = 4
+
+## Title index and inlink counter factory used by the worker processes,
+## set by `_init_worker`
+_title_index = None
+_counter_factory = set
+
+## Indexes into the partial counts of an article
+N_CLICKS = 0
+N_FROM_ARTICLES = 1
+ACTIVE_INLINKS = 2
+PROJECTS = 3
+
+## Indexes into the project-specific partial counts of an article
+N_FROM_PROJECT = 0
+PROJECT_INLINKS = 1
+
+def open_clickstream(filename, mode='rt'):
+    '''
+    Open the given clickstream file, decompressing it if its name ends
+    in ".bz2" or ".gz".
+
+    :param filename: path to the clickstream dataset
+    :type filename: str
+
+    :param mode: mode to open the file in
+    :type mode: str
+    '''
+
+    if filename.endswith('.bz2'):
+        opener = bz2.open
+    elif filename.endswith('.gz'):
+        opener = gzip.open
+    else:
+        opener = open
+
+    if 'b' in mode:
+        return(opener(filename, mode))
+    return(opener(filename, mode, encoding='utf-8'))
+
+def is_compressed(filename):
+    '''
+    Is the given clickstream file compressed?
+
+    :param filename: path to the clickstream dataset
+    :type filename: str
+    '''
+    return(filename.endswith('.bz2') or filename.endswith('.gz'))
+
+def chunk_ranges(filename, n_chunks):
+    '''
+    Split the given uncompressed clickstream file into at most `n_chunks`
+    byte ranges, each starting at the beginning of a line. The header
+    line is not part of any range. Returns a list of (start, end) tuples.
+
+    :param filename: path to the clickstream dataset
+    :type filename: str
+
+    :param n_chunks: number of chunks to split the file into
+    :type n_chunks: int
+    '''
+
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as infile:
+        infile.readline() # skip header
+        data_start = infile.tell()
+
+        offsets = [data_start]
+        for k in range(1, n_chunks):
+            pos = data_start + (file_size - data_start) * k // n_chunks
+            if pos <= offsets[-1]:
+                continue
+
+            ## Move to the beginning of the next line
+            infile.seek(pos)
+            infile.readline()
+            pos = infile.tell()
+            if pos >= file_size:
+                break
+            if pos > offsets[-1]:
+                offsets.append(pos)
+
+    offsets.append(file_size)
+    return([(start, end) for (start, end) in zip(offsets[:-1], offsets[1:])
+            if start < end])
+
+def make_title_index(title_maps):
+    '''
+    Build a title index for the scanner from the given projects' title maps.
+    The index maps a title to a tuple of the indexes of the projects
+    that contain it.
+
+    :param title_maps: list of mappings of title to article, one per project
+    :type title_maps: list
+    '''
+
+    title_index = {}
+    for (proj_idx, title_map) in enumerate(title_maps):
+        for title in title_map:
+            title_index.setdefault(title, []).append(proj_idx)
+
+    return({title:tuple(proj_idxs) for (title, proj_idxs)
+            in title_index.items()})
+
+def scan_lines(lines, title_index, counter_factory=set):
+    '''
+    Count clicks in the given clickstream lines for all titles in the
+    title index. Returns a dict mapping titles to partial counts as a list
+    of number of clicks, number of clicks from articles, the set of
+    referring articles, and a dict mapping project indexes to a list of
+    the number of clicks from project articles and the set of referring
+    project articles.
+
+    :param lines: the clickstream lines to process
+    :type lines: iterable
+
+    :param title_index: map of title to indexes of projects containing it
+    :type title_index: dict
+
+    :param counter_factory: callable creating the sets (or counters, see
+                            the `cardinality` module) of referring articles
+    :type counter_factory: callable
+    '''
+
+    partials = {}
+    for line in lines:
+        (prev, curr, click_type, n) = line.strip().split('\t')
+
+        # not in our dataset...
+        try:
+            proj_idxs = title_index[curr]
+        except KeyError:
+            continue
+
+        n = int(n)
+        try:
+            counts = partials[curr]
+        except KeyError:
+            counts = [0, 0, counter_factory(), {}]
+            partials[curr] = counts
+
+        counts[N_CLICKS] += n
+        if click_type != "link":
+            continue
+
+        counts[N_FROM_ARTICLES] += n
+        counts[ACTIVE_INLINKS].add(prev)
+
+        # The source is an article in one or more of the same WikiProjects
+        prev_idxs = title_index.get(prev, ())
+        for proj_idx in proj_idxs:
+            if proj_idx not in prev_idxs:
+                continue
+            try:
+                proj_counts = counts[PROJECTS][proj_idx]
+            except KeyError:
+                proj_counts = [0, counter_factory()]
+                counts[PROJECTS][proj_idx] = proj_counts
+
+            proj_counts[N_FROM_PROJECT] += n
+            proj_counts[PROJECT_INLINKS].add(prev)
+
+    return(partials)
+
+def merge_partials(total, partials):
+    '''
+    Merge the given partial counts into the total, modifying the total.
+
+    :param total: accumulated counts, as returned by `scan_lines`
+    :type total: dict
+
+    :param partials: partial counts, as returned by `scan_lines`
+    :type partials: dict
+    '''
+
+    for (title, counts) in partials.items():
+        try:
+            total_counts = total[title]
+        except KeyError:
+            total[title] = counts
+            continue
+
+        total_counts[N_CLICKS] += counts[N_CLICKS]
+        total_counts[N_FROM_ARTICLES] += counts[N_FROM_ARTICLES]
+        total_counts[ACTIVE_INLINKS].update(counts[ACTIVE_INLINKS])
+
+        for (proj_idx, proj_counts) in counts[PROJECTS].items():
+            try:
+                total_proj = total_counts[PROJECTS][proj_idx]
+            except KeyError:
+                total_counts[PROJECTS][proj_idx] = proj_counts
+                continue
+
+            total_proj[N_FROM_PROJECT] += proj_counts[N_FROM_PROJECT]
+            total_proj[PROJECT_INLINKS].update(proj_counts[PROJECT_INLINKS])
+
+    return(total)
+
+def _init_worker(title_index, counter_factory):
+    '''
+    Set the title index and inlink counter factory of a worker process.
+    '''
+    global _title_index, _counter_factory
+    _title_index = title_index
+    _counter_factory = counter_factory
+
+def _scan_range(filename_range):
+    '''
+    Scan a byte range of an uncompressed clickstream file in a worker.
+    '''
+    (filename, start, end) = filename_range
+
+    def read_range():
+        with open(filename, 'rb') as infile:
+            infile.seek(start)
+            pos = start
+            for line in infile:
+                if pos >= end:
+                    break
+                pos += len(line)
+                yield line.decode('utf-8')
+
+    return(scan_lines(read_range(), _title_index, _counter_factory))
+
+def _scan_batch(lines):
+    '''
+    Scan a batch of clickstream lines in a worker.
+    '''
+    return(scan_lines(lines, _title_index, _counter_factory))
+
+def _read_batches(filename, batch_size):
+    '''
+    Read the given (typically compressed) clickstream file and yield
+    lists of `batch_size` lines.
+    '''
+    with open_clickstream(filename) as infile:
+        infile.readline() # skip header
+        batch = []
+        for line in infile:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def scan(filename, title_index, n_processes=1, batch_size=BATCH_SIZE,
+         counter_factory=set):
+    '''
+    Scan the given clickstream file and return the merged counts for
+    all titles in the title index, see `scan_lines` for the format.
+
+    :param filename: path to the clickstream dataset, optionally
+                     compressed with bz2 or gzip
+    :type filename: str
+
+    :param title_index: map of title to indexes of projects containing it,
+                        as created by `make_title_index`
+    :type title_index: dict
+
+    :param n_processes: number of worker processes to use
+    :type n_processes: int
+
+    :param batch_size: number of lines per batch when the file is compressed
+    :type batch_size: int
+
+    :param counter_factory: callable creating the sets (or counters) of
+                            referring articles, must be picklable
+    :type counter_factory: callable
+    '''
+
+    if n_processes <= 1:
+        with open_clickstream(filename) as infile:
+            infile.readline() # skip header
+            return(scan_lines(infile, title_index, counter_factory))
+
+    if is_compressed(filename):
+        tasks = _read_batches(filename, batch_size)
+        worker = _scan_batch
+    else:
+        tasks = [(filename, start, end) for (start, end)
+                 in chunk_ranges(filename, n_processes * CHUNKS_PER_PROCESS)]
+        worker = _scan_range
+
+    total = {}
+    with Pool(n_processes, initializer=_init_worker,
+              initargs=(title_index, counter_factory)) as pool:
+        for (i, partials) in enumerate(pool.imap_unordered(worker, tasks)):
+            merge_partials(total, partials)
+            logging.info('merged {} chunks of clickstream data'.format(i + 1))
+
+    return(total)
@@ -39,6 +39,8 @@ from sklearn.preprocessing import LabelEncoder
 from sklearn.ensemble import GradientBoostingClassifier as gbm
 from sklearn.metrics import confusion_matrix
 
+import tsvcache
+
 class WikiProjectPredictor:
     def __init__(self):
         self.config = None
@@ -52,15 +54,15 @@ class WikiProjectPredictor:
         '''
 
         # read in snapshot
-        snapshot = pd.read_table(self.config['snapshot file'])
+        snapshot = tsvcache.read_table(self.config['snapshot file'])
         # read in dataset
-        dataset = pd.read_table(self.config['dataset'])
+        dataset = tsvcache.read_table(self.config['dataset'])
         # read in clickstream
-        clickstream = pd.read_table(self.config['clickstream file'])
+        clickstream = tsvcache.read_table(self.config['clickstream file'])
         # read in disambiguations
-        disambiguations = pd.read_table(self.config['disambiguation file'])
+        disambiguations = tsvcache.read_table(self.config['disambiguation file'])
         # read in the list of side-chained articles
-        sidechained = pd.read_table(self.config['sidechain file'])
+        sidechained = tsvcache.read_table(self.config['sidechain file'])
         
         # Log-transform number of inlinks, views, and calculate prop_proj_inlinks
         dataset['log_inlinks'] = np.log10(1 + dataset['num_inlinks'])
@@ -30,20 +30,46 @@ SOFTWARE.
 import yaml
 import logging
 import requests
+import threading
 import networkx as nx
 
-from time import sleep
-from collections import deque
+from time import sleep, time
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-import wikiproject as wp
+import claims
+import wddump
+import wdcache
+import snapshot
 
 class WDGraphBuilder:
-    def __init__(self):
+    def __init__(self, max_requests=4, entity_store=None):
+        '''
+        :param max_requests: maximum number of concurrent requests
+                             to the Wikidata API
+        :type max_requests: int
+
+        :param entity_store: store of Wikidata entities to read through,
+                             defaults to the shared store. A
+                             `wddump.DumpIndex` builds the graph offline.
+        :type entity_store: `wdcache.EntityStore`
+        '''
         self.graph = nx.DiGraph()
 
+        if entity_store is None:
+            entity_store = wdcache.open_store()
+        self.entity_store = entity_store
+
+        ## Counts of entities and claims processed, and claims skipped
+        ## because they do not point to an entity (see the `claims` module)
+        self.claim_metrics = Counter()
+
         # Number of items we process at a time
         self.slice_size = 50
 
+        # Number of requests we keep in flight at a time
+        self.max_requests = max_requests
+
         ## WD API base URL for the query we'd like to run
         self.wd_url = "https://www.wikidata.org/w/api.php?action=wbgetentities&format=json"
         
@@ -56,6 +82,11 @@ class WDGraphBuilder:
         ## Max number of unlagged requests we make to WD API
         self.max_retries = 3
 
+        ## When the API reports that it is lagged, all requests wait
+        ## until this time (in seconds since the epoch) before retrying.
+        self._resume_time = 0
+        self._lag_lock = threading.Lock()
+
         ## Types of properties we use in the initial step out from
         ## the Wikidata items in the dataset. Extending this list
         ## might be necessary to better cover certain WikiProjects.
@@ -70,16 +101,30 @@ class WDGraphBuilder:
             'P279', # subclass of
             ])
 
-    def make_api_request(self, items, http_session):
+    def wait_for_lag(self):
+        '''
+        Wait until the Wikidata API is no longer reported as lagged.
+        '''
+        with self._lag_lock:
+            delay = self._resume_time - time()
+        if delay > 0:
+            sleep(delay)
+
+    def make_api_request(self, items, http_session, props=None):
         '''
         Make an HTTP request to the Wikidata API for info on the given list
-        of items using the given HTTP session.
+        of items using the given HTTP session. This is called from several
+        threads at once, a lagged API pauses all of them.
 
         :param items: the QIDs of the items we'll be getting data about
         :type items: list
 
         :param http_session: the HTTP session we'll use
         :type http_session: requests.Session
+
+        :param props: the properties of the entities to request,
+                      by default all of them
+        :type props: str
         '''
         
         entity_data = {}
@@ -87,11 +132,15 @@ class WDGraphBuilder:
         done = False
         num_retries = 0
         while not done and num_retries < self.max_retries:
+            self.wait_for_lag()
+
             ## We use a default of maxlag=5
             ## ref https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
             item_url = "{base}{maxlag}&ids={idlist}".format(
                 base=self.wd_url, maxlag="&maxlag=5",
                 idlist="|".join(items))
+            if props:
+                item_url = "{}&props={}&languages=en".format(item_url, props)
             response = http_session.get(item_url)
             if response.status_code != 200:
                 logging.warning('Wikidata returned status {}'.format(response.status_code))
@@ -112,10 +161,11 @@ class WDGraphBuilder:
                 continue
 
             if "error" in content and content['error']['code'] == 'maxlag':
-                ## Pause before trying again
+                ## Pause all requests before trying again
                 ptime = max(5, int(response.headers['Retry-After']))
                 logging.warning('WD API is lagged, waiting {} seconds to try again'.format(ptime))
-                sleep(ptime)
+                with self._lag_lock:
+                    self._resume_time = max(self._resume_time, time() + ptime)
                 continue
 
             entity_data = content['entities']
@@ -123,7 +173,69 @@ class WDGraphBuilder:
             continue
 
         return(entity_data)
-        
+
+    def get_entities(self, items, http_session):
+        '''
+        Get the entities for the given items through the entity store,
+        fetching any that are not in it from the Wikidata API.
+
+        :param items: the QIDs of the items we'll be getting data about
+        :type items: list
+
+        :param http_session: the HTTP session we'll use
+        :type http_session: requests.Session
+        '''
+        return(self.entity_store.get_entities(
+            items, fetch=lambda subset, props: self.make_api_request(
+                subset, http_session, props=props)))
+
+    def add_entities(self, entity_data, claim_types, seen_items, queue,
+                     add_labels=False):
+        '''
+        Add edges for the claims of the given entities to the graph, and
+        add previously unseen destinations of those claims to the queue.
+
+        :param entity_data: the entities returned by the Wikidata API
+        :type entity_data: dict
+
+        :param claim_types: the properties of the claims we follow
+        :type claim_types: set
+
+        :param seen_items: QIDs of items we have already seen
+        :type seen_items: set
+
+        :param queue: queue of items to process
+        :type queue: collections.deque
+
+        :param add_labels: label the entities' nodes with their English label
+        :type add_labels: bool
+        '''
+
+        if add_labels:
+            ## Grab the English label for each item, otherwise just
+            ## use the QID
+            for entity in entity_data.values():
+                qid = entity.get('id')
+                if qid is None:
+                    continue
+                try:
+                    self.graph.add_node(qid, title=entity['labels']['en']['value'])
+                except KeyError:
+                    self.graph.add_node(qid, title=qid)
+
+        for (qid, claim, dest_id) in claims.triples(entity_data, claim_types,
+                                                    self.claim_metrics):
+            # Add the destination to the processing queue?
+            # Note that we'll label it when we process it.
+            if dest_id not in seen_items:
+                seen_items.add(dest_id)
+                queue.append(dest_id)
+                self.graph.add_node(dest_id)
+
+            self.graph.add_edge(qid, dest_id, ptype=claim)
+
+        return()
+
     def build_graph(self, config_filename):
         '''
         Read in the WikiProject configuration file, then the associated
@@ -138,9 +250,8 @@ class WDGraphBuilder:
             proj_conf = yaml.load(infile)
         
         ## Read in the snapshot and build a map of page ID to object
-        id_map = {p.page_id:p for p in
-                  wp.read_snapshot(proj_conf['snapshot file'])
-                  if p.page_id != "-1"}
+        snap = snapshot.read(proj_conf['snapshot file'])
+        id_map = {p.page_id:p for p in snap.pages(snap.has_article())}
 
         # read in the dataset
         with open(proj_conf['dataset'], 'r', encoding='utf-8') as infile:
@@ -161,163 +272,72 @@ class WDGraphBuilder:
                 except KeyError:
                     logging.warning('page ID {} not found in the snapshot'.format(page_id))
 
-        # start the HTTP session
+        # start the HTTP session, with a connection pool large enough
+        # for all our concurrent requests
         wd_session = requests.Session()
-                
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.max_requests)
+        wd_session.mount('https://', adapter)
+
         # get a list of all the nodes (which are now all our initial articles)
-        items = self.graph.nodes()
+        items = list(self.graph.nodes())
 
         # things we've seen and processed (starting with our initial articles)
         seen_items = set(items)
-        
-        # create a queue of items to process
-        queue = deque()
-        
-        # make a query to retrieve their claims from Wikidata
-        # for each item in the query result:
-        #   if the type of claim is "has part", ignore it
-        #   
-        #   if the destination of the claim is not seen:
-        #     add the destination to the queue
-        #     add the destination of the claim to the graph
-        #
-        #   Note: we must _always_ add the edge, otherwise we'll only have
-        #         these edges for the first node that has this property.
-        #   add an edge between the item and the destination
-
-        ## Make a query to retrieve the claims for all initial items
-        i = 0
-        while i < len(items):
-            logging.info('processing subset {}:{}'.format(i, i+self.slice_size))
-            subset = items[i : i + self.slice_size]
-            entity_data = self.make_api_request(subset, wd_session)
-            sleep(0.01)
-            ## Iterate over the entities
-            ## The QID is in entity['id']
-            for entity in entity_data.values():
-                try:
-                    qid = entity['id']
-                except KeyError:
-                    logging.warning('unable to get QID for {}'.format(entity['id']))
-                    continue
-
-                if not 'claims' in entity:
-                    ## Item has no claims to help us
-                    continue
 
-                for (claim, cdata) in entity['claims'].items():
-                    # ignore this claim? (see `self.allowed_claims`)
-                    if not claim in self.allowed_claims:
-                        continue
-
-                    if isinstance(cdata, list):
-                        for c in cdata:
-                            try:
-                                dest_id = c['mainsnak']['datavalue']['value']['id']
-                            except KeyError:
-                                # no valid destination for that claim
-                                continue
-                            except TypeError:
-                                # 'value' is most likely not a dict
-                                continue
-                            
-                            # Add the destination to the processing queue?
-                            # Note that we'll label it when we process it.
-                            if dest_id not in seen_items:
-                                seen_items.add(dest_id)
-                                queue.append(dest_id)
-                                self.graph.add_node(dest_id)
-                                
-                            self.graph.add_edge(qid, dest_id, ptype=claim)
-
-                    elif isinstance(cdata, dict):
-                        try:
-                            dest_id = cdata['mainsnak']['datavalue']['value']['id']
-                        except KeyError:
-                            # no valid destination for that claim
-                            continue
-                        
-                        # Add the destination to the processing queue?
-                        if dest_id not in seen_items:
-                            seen_items.add(dest_id)
-                            queue.append(dest_id)
-                            self.graph.add_node(dest_id)
-                            
-                        self.graph.add_edge(qid, dest_id, ptype=claim)
-                    
-            i += self.slice_size
-
-        # while the queue is not empty:
-        while len(queue) > 0:
-            logging.info('iterating... queue holds {} items'.format(len(queue)))
-            
-            # grab up to slice_size number of items from the queue
-            items = []
-            i = 0
-            while len(queue) > 0 and i < self.slice_size:
-                items.append(queue.popleft())
-                i += 1
-            
-            # make a query to Wikidata to retrieve their claims
-            entity_data = self.make_api_request(items, wd_session)
-
-            ## Iterate over the entities
-            ## The QID is in entity['id']
-            for entity in entity_data.values():
-                try:
-                    qid = entity['id']
-                except KeyError:
-                    logging.warning('unable to get QID for {}'.format(entity['id']))
-                    continue
-
-                ## Grab the English label for this item, otherwise just
-                ## use the QID
-                try:
-                    self.graph.add_node(qid, title=entity['labels']['en']['value'])
-                except KeyError:
-                    self.graph.add_node(qid, title=qid)
-                
-                if not 'claims' in entity:
-                    ## Item has no claims to help us
-                    continue
+        # slices of initial items, and a queue of other items to process
+        initial_slices = deque(items[i : i + self.slice_size]
+                               for i in range(0, len(items), self.slice_size))
+        queue = deque()
 
-                for (claim, cdata) in entity['claims'].items():
-                    ## We only concern ourselves with certain claims
-                    if claim in self.network_claims:
-                        if isinstance(cdata, list):
-                            for c in cdata:
-                                try:
-                                    dest_id = c['mainsnak']['datavalue']['value']['id']
-                                except KeyError:
-                                    # no valid destination for that claim
-                                    continue
-                                except TypeError:
-                                    # 'value' is most likely not a dict
-                                    continue
-                            
-                                # Add the destination to the processing queue if
-                                ## necessary. We'll label it when we process it.
-                                if dest_id not in seen_items:
-                                    seen_items.add(dest_id)
-                                    queue.append(dest_id)
-                                    self.graph.add_node(dest_id)
-                                    
-                                self.graph.add_edge(qid, dest_id, ptype=claim)
-                        elif isinstance(cdata, dict):
-                            try:
-                                dest_id = cdata['mainsnak']['datavalue']['value']['id']
-                            except KeyError:
-                                # no valid destination for that claim
-                                continue
-        
-                            if dest_id not in seen_items:
-                                seen_items.add(dest_id)
-                                queue.append(dest_id)
-                                self.graph.add_node(dest_id)
-                                
-                            self.graph.add_edge(qid, dest_id, ptype=claim)
+        # Keep up to `max_requests` requests in flight. The initial items
+        # are requested first, and their claims in `self.allowed_claims`
+        # are followed. For all other items, we follow the claims in
+        # `self.network_claims`. The result of each request is processed
+        # as it arrives, adding unseen destinations of claims to the queue.
+        #
+        # Note: we must _always_ add the edge, otherwise we'll only have
+        #       these edges for the first node that has this property.
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.max_requests) as executor:
+            while initial_slices or queue or in_flight:
+                while len(in_flight) < self.max_requests:
+                    if initial_slices:
+                        subset = initial_slices.popleft()
+                        is_initial = True
+                    elif len(queue) >= self.slice_size or \
+                         (queue and not in_flight):
+                        ## Only request a partial slice if nothing is in
+                        ## flight, otherwise wait for the queue to fill up.
+                        subset = [queue.popleft() for i in
+                                  range(min(self.slice_size, len(queue)))]
+                        is_initial = False
+                    else:
+                        break
+
+                    future = executor.submit(self.get_entities,
+                                             subset, wd_session)
+                    in_flight[future] = is_initial
+
+                (done, not_done) = wait(in_flight,
+                                        return_when=FIRST_COMPLETED)
+                for future in done:
+                    is_initial = in_flight.pop(future)
+                    if is_initial:
+                        self.add_entities(future.result(),
+                                          self.allowed_claims,
+                                          seen_items, queue)
+                    else:
+                        self.add_entities(future.result(),
+                                          self.network_claims,
+                                          seen_items, queue,
+                                          add_labels=True)
+
+                logging.info('{} initial slices left, queue holds {} items, {} requests in flight'.format(len(initial_slices), len(queue), len(in_flight)))
 
         # ok, the graph is built, write it out
+        logging.info('claims processed: {}'.format(
+            claims.format_metrics(self.claim_metrics)))
         logging.info('build complete, writing out the graph')
         nx.write_gexf(self.graph, proj_conf['wikidata network'])
 
@@ -334,6 +354,15 @@ def main():
     cli_parser.add_argument("config_filename", type=str,
                             help="path to the project's YAML configuration file")
 
+    cli_parser.add_argument('-n', '--num-requests', type=int, default=4,
+                            help='maximum number of concurrent requests to the Wikidata API (default: 4)')
+
+    cli_parser.add_argument('--entity-store', type=str,
+                            help='path to the Wikidata entity store (default: {})'.format(wdcache.DEFAULT_PATH))
+
+    cli_parser.add_argument('--wikidata-index', type=str,
+                            help='path to an index of a Wikidata dump (see import-wikidata-dump.py), builds the graph offline instead of using the entity store')
+
     # Verbosity option
     cli_parser.add_argument('-v', '--verbose', action='store_true',
                             help='write informational output')
@@ -343,7 +372,13 @@ def main():
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
-    builder = WDGraphBuilder()
+    if args.wikidata_index:
+        entity_store = wddump.DumpIndex(args.wikidata_index)
+    else:
+        entity_store = wdcache.open_store(args.entity_store)
+
+    builder = WDGraphBuilder(max_requests=args.num_requests,
+                             entity_store=entity_store)
     builder.build_graph(args.config_filename)
 
     return()
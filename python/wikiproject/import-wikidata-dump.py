@@ -0,0 +1,77 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Script that reads a Wikidata JSON dump (e.g. `latest-all.json.bz2`) and
+writes an index of the claims used for building Wikidata networks and
+side-chaining, so that those can run offline. See the `wddump` module.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+
+import wddump
+import wdcache
+
+def main():
+    import argparse
+
+    cli_parser = argparse.ArgumentParser(
+        description="script to index the claims in a Wikidata JSON dump"
+    )
+
+    cli_parser.add_argument('dump_filename', type=str,
+                            help='path to the Wikidata JSON dump, optionally compressed with bz2 or gzip')
+
+    cli_parser.add_argument('index_path', type=str,
+                            help='path to the directory to write the index to')
+
+    cli_parser.add_argument('-p', '--processes', type=int, default=1,
+                            help='number of processes parsing the dump (default: 1)')
+
+    cli_parser.add_argument('--properties', type=str, nargs='+',
+                            default=sorted(wdcache.STORED_PROPERTIES),
+                            help='properties to index claims for (default: {})'.format(' '.join(sorted(wdcache.STORED_PROPERTIES))))
+
+    cli_parser.add_argument('-l', '--lang', type=str, default='en',
+                            help='language of the labels to include, labels are needed when building Wikidata networks (default: en)')
+
+    cli_parser.add_argument('--no-labels', action='store_true',
+                            help='do not include labels in the index')
+
+    # Verbosity option
+    cli_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='write informational output')
+
+    args = cli_parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    lang = None if args.no_labels else args.lang
+    wddump.build_index(args.dump_filename, args.index_path,
+                       properties=args.properties, lang=lang,
+                       n_processes=args.processes)
+
+    return()
+
+if __name__ == '__main__':
+    main()
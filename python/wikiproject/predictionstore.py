@@ -0,0 +1,307 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for a store of importance predictions, so that articles only have
+to be predicted again when their features or the model change.
+
+For each article, by page ID, the store keeps the feature vector the
+article was predicted from (which need not be the model's predictors, but
+can be the per-article inputs they are calculated from), a hash of that
+vector, the version of the model that made the prediction, and the
+predicted rating and rating probabilities. The store is a single NumPy
+`.npz` file.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+def model_version(*filenames):
+    '''
+    Return a version string of a model identifying the contents of the
+    given files, e.g. the pickled model and label encoder.
+
+    :param filenames: paths to the files the model is read from
+    :type filenames: str
+    '''
+    digest = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as infile:
+            for block in iter(lambda: infile.read(1024*1024), b''):
+                digest.update(block)
+    return(digest.hexdigest()[:16])
+
+def feature_hashes(features):
+    '''
+    Return a 64-bit hash of each row of the given feature matrix.
+
+    :param features: the feature matrix, one row per article
+    :type features: `numpy.ndarray`
+    '''
+    return(pd.util.hash_pandas_object(
+        pd.DataFrame(np.asarray(features, dtype=np.float64)),
+        index=False).values)
+
+class PredictionStore:
+    '''
+    A store of the latest prediction of each article.
+    '''
+    def __init__(self, path=None):
+        '''
+        :param path: path to the store file, which is created when the
+                     store is first saved. Without a path, the store is
+                     only held in memory, see `subset`.
+        :type path: str
+        '''
+        self.path = None
+        if path is not None:
+            self.path = os.path.expanduser(path)
+        self.page_ids = np.array([], dtype=np.int64)
+        self.features = None
+        self.hashes = np.array([], dtype=np.uint64)
+        self.versions = np.array([], dtype=str)
+        self.ratings = None
+        self.probabilities = None
+        self.proba_columns = []
+
+        if self.path is not None and os.path.exists(self.path):
+            with np.load(self.path) as store_data:
+                self.page_ids = store_data['page_id']
+                self.features = store_data['features']
+                self.hashes = store_data['hash']
+                self.versions = store_data['version']
+                self.ratings = store_data['rating']
+                self.probabilities = store_data['probabilities']
+                self.proba_columns = store_data['proba_columns'].tolist()
+            logging.info('read predictions of {} articles from {}'.format(
+                len(self.page_ids), self.path))
+
+    def __len__(self):
+        return(len(self.page_ids))
+
+    def find(self, page_ids):
+        '''
+        Find the given articles in the store. Returns a tuple of their
+        positions in the store and whether they were found, positions of
+        articles not found are meaningless.
+
+        :param page_ids: page IDs of the articles
+        :type page_ids: `numpy.ndarray`
+        '''
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        if not len(self.page_ids):
+            return((np.zeros(len(page_ids), dtype=np.intp),
+                    np.zeros(len(page_ids), dtype=bool)))
+
+        pos = np.searchsorted(self.page_ids, page_ids)
+        pos[pos == len(self.page_ids)] = 0
+        return((pos, self.page_ids[pos] == page_ids))
+
+    def subset(self, first_id, last_id):
+        '''
+        Return an in-memory store of the articles in the given range of
+        page IDs, e.g. to hand a shard of the store to a worker process.
+
+        :param first_id: lowest page ID of the range
+        :type first_id: int
+
+        :param last_id: highest page ID of the range
+        :type last_id: int
+        '''
+
+        store = PredictionStore()
+        if not len(self.page_ids):
+            return(store)
+
+        start = np.searchsorted(self.page_ids, first_id, side='left')
+        end = np.searchsorted(self.page_ids, last_id, side='right')
+        store.page_ids = self.page_ids[start:end]
+        store.features = self.features[start:end]
+        store.hashes = self.hashes[start:end]
+        store.versions = self.versions[start:end]
+        store.ratings = self.ratings[start:end]
+        store.probabilities = self.probabilities[start:end]
+        store.proba_columns = self.proba_columns
+        return(store)
+
+    def stale(self, page_ids, features, version, tolerance=0.0,
+              relative_tolerance=0.0):
+        '''
+        Return a boolean array of which of the given articles have to be
+        predicted. That is those that are not in the store, were predicted
+        by a different model version, or have a feature that differs by
+        more than the tolerance from the one they were predicted from.
+        A feature is within the tolerance if the absolute change is at
+        most `tolerance` plus `relative_tolerance` times the stored
+        value, as in `numpy.isclose`. If the stored feature vectors have
+        a different number of features, all articles are stale.
+
+        :param page_ids: page IDs of the articles
+        :type page_ids: `numpy.ndarray`
+
+        :param features: the articles' feature matrix, one row per article
+        :type features: `numpy.ndarray`
+
+        :param version: version of the current model, see `model_version`
+        :type version: str
+
+        :param tolerance: the largest absolute change of a feature that
+                          does not require a new prediction, either for
+                          all features or one per feature
+        :type tolerance: float or `numpy.ndarray`
+
+        :param relative_tolerance: the largest change of a feature relative
+                                   to its stored value that does not
+                                   require a new prediction, either for
+                                   all features or one per feature
+        :type relative_tolerance: float or `numpy.ndarray`
+        '''
+
+        features = np.asarray(features, dtype=np.float64)
+        (pos, found) = self.find(page_ids)
+        stale = ~found
+        if not found.any():
+            return(stale)
+        if self.features.shape[1:] != features.shape[1:]:
+            return(np.ones(len(stale), dtype=bool))
+
+        ## Among the stored articles, those with an identical feature
+        ## vector only have to be checked for the model version
+        found = np.flatnonzero(found)
+        stored = pos[found]
+        changed = (self.hashes[stored] != feature_hashes(features[found]))
+
+        ## Of those that changed, check by how much
+        (changed_rows, changed_stored) = (found[changed], stored[changed])
+        old = self.features[changed_stored]
+        new = features[changed_rows]
+        with np.errstate(invalid='ignore'):
+            same = ((np.abs(new - old)
+                     <= tolerance + relative_tolerance * np.abs(old))
+                    | (np.isnan(new) & np.isnan(old)))
+        changed[changed] = ~same.all(axis=1)
+
+        stale[found] = changed | (self.versions[stored] != version)
+        return(stale)
+
+    def lookup(self, page_ids):
+        '''
+        Return a tuple of the stored ratings and rating probabilities of
+        the given articles, which must be in the store.
+
+        :param page_ids: page IDs of the articles
+        :type page_ids: `numpy.ndarray`
+        '''
+        (pos, found) = self.find(page_ids)
+        if not found.all():
+            raise(KeyError('{} of the articles are not in the store'.format(
+                (~found).sum())))
+        return((self.ratings[pos], self.probabilities[pos]))
+
+    def update(self, page_ids, features, version, ratings, probabilities,
+               proba_columns, keep_page_ids=None):
+        '''
+        Store new predictions of the given articles, replacing any
+        previous ones. Articles not in `keep_page_ids`, if given, are
+        removed from the store. The store file is not updated until
+        `save` is called.
+
+        :param page_ids: page IDs of the articles
+        :type page_ids: `numpy.ndarray`
+
+        :param features: feature matrix the articles were predicted from
+        :type features: `numpy.ndarray`
+
+        :param version: version of the model that made the predictions
+        :type version: str
+
+        :param ratings: the predicted ratings
+        :type ratings: `numpy.ndarray`
+
+        :param probabilities: the rating probabilities, one column
+                              per rating
+        :type probabilities: `numpy.ndarray`
+
+        :param proba_columns: names of the probability columns
+        :type proba_columns: list
+
+        :param keep_page_ids: page IDs of the articles to keep
+        :type keep_page_ids: `numpy.ndarray`
+        '''
+
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        features = np.asarray(features, dtype=np.float64)
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+
+        ## Previous predictions are dropped if the ratings or the
+        ## features changed
+        if (not len(self.page_ids)
+            or list(proba_columns) != self.proba_columns
+            or self.features.shape[1:] != features.shape[1:]):
+            old = np.zeros(len(self.page_ids), dtype=bool)
+        else:
+            old = ~np.isin(self.page_ids, page_ids)
+            if keep_page_ids is not None:
+                old &= np.isin(self.page_ids, keep_page_ids)
+
+        def combine(stored, new):
+            if not old.any():
+                return(np.asarray(new))
+            return(np.concatenate((stored[old], new)))
+
+        all_page_ids = combine(self.page_ids, page_ids)
+        order = np.argsort(all_page_ids, kind='stable')
+        self.page_ids = all_page_ids[order]
+        self.features = combine(self.features, features)[order]
+        self.hashes = combine(self.hashes, feature_hashes(features))[order]
+        self.versions = combine(self.versions,
+                                np.full(len(page_ids), version))[order]
+        self.ratings = combine(self.ratings, ratings)[order]
+        self.probabilities = combine(self.probabilities,
+                                     probabilities)[order]
+        self.proba_columns = list(proba_columns)
+        return()
+
+    def save(self):
+        '''
+        Write the store file. The file is replaced atomically, so an
+        interrupted save leaves the previous store intact.
+        '''
+
+        store_dir = os.path.dirname(self.path)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        tmp_path = '{}-tmp{}'.format(self.path, os.getpid())
+        with open(tmp_path, 'wb') as outfile:
+            np.savez(outfile, page_id=self.page_ids, features=self.features,
+                     hash=self.hashes, version=self.versions,
+                     rating=self.ratings, probabilities=self.probabilities,
+                     proba_columns=np.array(self.proba_columns))
+        os.replace(tmp_path, self.path)
+
+        logging.info('saved predictions of {} articles to {}'.format(
+            len(self.page_ids), self.path))
+        return()
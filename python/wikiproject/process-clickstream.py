@@ -25,71 +25,73 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import os
 import yaml
 
 import logging
 
-import wikiproject as wp
+import snapshot
+import clickstream
+import cardinality
 
 class ClickProcessor:
-    def __init__(self):
-        pass
+    def __init__(self, counter_backend='set', counter_error=cardinality.HLL_ERROR):
+        '''
+        :param counter_backend: name of the backend used to count unique
+                                active inlinks, see `cardinality.BACKENDS`
+        :type counter_backend: str
 
-    def process_clickstream(self, config_filename, clickstream_filename):
+        :param counter_error: relative standard error of the "hll" backend
+        :type counter_error: float
         '''
-        Read in the configuration file and the snapshot dataset defined
-        in it. Then stream the given clickstream dataset, counting clicks
-        for the articles in the snapshot.
+        self.counter_factory = cardinality.counter_factory(counter_backend,
+                                                           counter_error)
+
+    def load_project(self, config_filename):
+        '''
+        Read in the given project configuration and the snapshot defined
+        in it. Relative paths in the configuration are resolved against
+        the directory of the configuration file, allowing configurations
+        from several project directories to be processed together.
+
+        Returns a tuple of the configuration and a map from titles (in
+        clickstream format) to `wikiproject.RatedPage` objects.
 
         :param config_filename: path to the YAML project configuration
         :type config_filename: str
-
-        :param clickstream_filename: path to the clickstream dataset
-        :type clickstream_filename: str
         '''
 
         with open(config_filename) as infile:
             proj_conf = yaml.load(infile)
 
+        conf_dir = os.path.dirname(config_filename)
+        for key in ['snapshot file', 'clickstream file']:
+            proj_conf[key] = os.path.join(conf_dir, proj_conf[key])
+
         # Mapping titles (in clickstream format) to article objects
+        snap = snapshot.read(proj_conf['snapshot file'])
         title_map = {p.talk_page_title:p for p in
-                     wp.read_snapshot(proj_conf['snapshot file'])
-                     if p.page_id != "-1"}
+                     snap.pages(snap.has_article(),
+                                counter_factory=self.counter_factory)}
 
-        logging.info('read in snapshot with {} articles'.format(len(title_map)))
-            
-        # process the clickstream dataset
-        i = 0
-        with open(clickstream_filename, 'r', encoding='utf-8') as clickstream:
-            clickstream.readline() # skip the header
-            for line in clickstream:
-                i += 1
-                if i % 1000 == 0:
-                    logging.info('processed {} lines of clickstream data'.format(i))
-                
-                (prev, curr, click_type, n) = line.strip().split('\t')
-
-                # not in our dataset...
-                if curr not in title_map:
-                    continue
+        logging.info('read in snapshot of {} with {} articles'.format(
+            proj_conf.get('name', config_filename), len(title_map)))
+
+        return((proj_conf, title_map))
 
-                n = int(n)
-                art_obj = title_map[curr]
-                art_obj.n_clicks += n
-                
-                if click_type == "link":
-                    art_obj.n_from_articles += n
-                    art_obj.active_inlinks.add(prev)
-                    
-                    # We're processing a WikiProject dataset and the source
-                    # is an article in the project
-                    if prev in title_map:
-                        art_obj.n_from_project_articles += n
-                        art_obj.project_active_inlinks.add(prev)
-
-        # open the output file
-        with open(proj_conf['clickstream file'], 'w',
-                  encoding='utf-8') as outfile:
+    def write_clickstream(self, title_map, clickstream_output):
+        '''
+        Write out the clickstream counts for the articles in the given
+        title map.
+
+        :param title_map: map of article titles to `wikiproject.RatedPage` objects
+        :type title_map: dict
+
+        :param clickstream_output: path to the output TSV file
+        :type clickstream_output: str
+        '''
+
+        with open(clickstream_output, 'w', encoding='utf-8') as outfile:
             # Article page ID, total number of views, number of views from other
             # articles, number of other articles being sources of clicks,
             # number of views from articles within the WikiProject, and
@@ -102,13 +104,99 @@ class ClickProcessor:
                 art_obj.n_project_active_inlinks = len(
                     art_obj.project_active_inlinks)
                 outfile.write('{0.page_id}\t{0.n_clicks}\t{0.n_from_articles}\t{0.n_active_inlinks}\t{0.n_from_project_articles}\t{0.n_project_active_inlinks}\n'.format(art_obj))
-            
-        ## ok, close the output file
-        outfile.close()
 
         ## ok, done
         return()
-    
+
+    def process_clickstream(self, config_filename, clickstream_filename,
+                            n_processes=1):
+        '''
+        Read in the configuration file and the snapshot dataset defined
+        in it. Then stream the given clickstream dataset, counting clicks
+        for the articles in the snapshot.
+
+        :param config_filename: path to the YAML project configuration
+        :type config_filename: str
+
+        :param clickstream_filename: path to the clickstream dataset
+        :type clickstream_filename: str
+
+        :param n_processes: number of worker processes scanning the dataset
+        :type n_processes: int
+        '''
+
+        return(self.process_clickstreams([config_filename],
+                                         clickstream_filename,
+                                         n_processes=n_processes))
+
+    def process_clickstreams(self, config_filenames, clickstream_filename,
+                             n_processes=1):
+        '''
+        Read in the configuration files and the snapshot datasets defined
+        in them, then stream the given clickstream dataset once, counting
+        clicks for the articles in all the snapshots. Each project's
+        clickstream file is written out at the end.
+
+        :param config_filenames: paths to the YAML project configurations
+        :type config_filenames: list
+
+        :param clickstream_filename: path to the clickstream dataset,
+                                     optionally compressed with bz2 or gzip
+        :type clickstream_filename: str
+
+        :param n_processes: number of worker processes scanning the dataset
+        :type n_processes: int
+        '''
+
+        projects = [self.load_project(config_filename)
+                    for config_filename in config_filenames]
+
+        ## Combined index mapping a title to the projects containing it.
+        ## An article can be rated by several projects, and the
+        ## project-internal counts are only updated when the referrer
+        ## is in the same project.
+        title_maps = [title_map for (proj_conf, title_map) in projects]
+        title_index = clickstream.make_title_index(title_maps)
+
+        logging.info('combined index of {} projects holds {} titles'.format(
+            len(projects), len(title_index)))
+
+        # process the clickstream dataset
+        counts = clickstream.scan(clickstream_filename, title_index,
+                                  n_processes=n_processes,
+                                  counter_factory=self.counter_factory)
+
+        logging.info('found clicks for {} titles'.format(len(counts)))
+
+        ## Populate the article objects with the counts, popping them off
+        ## so that we do not hold two copies of the inlink sets.
+        while counts:
+            (title, title_counts) = counts.popitem()
+            for proj_idx in title_index[title]:
+                art_obj = title_maps[proj_idx][title]
+                art_obj.n_clicks += title_counts[clickstream.N_CLICKS]
+                art_obj.n_from_articles += title_counts[
+                    clickstream.N_FROM_ARTICLES]
+                art_obj.active_inlinks.update(
+                    title_counts[clickstream.ACTIVE_INLINKS])
+
+                try:
+                    proj_counts = title_counts[clickstream.PROJECTS][proj_idx]
+                except KeyError:
+                    continue
+
+                art_obj.n_from_project_articles += proj_counts[
+                    clickstream.N_FROM_PROJECT]
+                art_obj.project_active_inlinks.update(
+                    proj_counts[clickstream.PROJECT_INLINKS])
+
+        ## Write out every project's results
+        for (proj_conf, title_map) in projects:
+            self.write_clickstream(title_map, proj_conf['clickstream file'])
+
+        ## ok, done
+        return()
+
 def main():
     import argparse
 
@@ -116,12 +204,23 @@ def main():
         description="script to process clickstream data"
     )
 
-    cli_parser.add_argument("config_filename", type=str,
-                            help="path to the project YAML configuration file")
+    cli_parser.add_argument("config_filenames", type=str, nargs='+',
+                            help="path to one or more project YAML configuration files, the clickstream dataset is read once for all of them")
 
     cli_parser.add_argument("clickstream_filename", type=str,
-                            help="path to the clickstream dataset")
+                            help="path to the clickstream dataset, optionally compressed with bz2 or gzip")
+
+    cli_parser.add_argument('-p', '--processes', type=int, default=1,
+                            help='number of worker processes used to scan the clickstream dataset (default: 1)')
     
+    cli_parser.add_argument('-c', '--counter', default='set',
+                            choices=cardinality.BACKENDS,
+                            help='how to count unique active inlinks: sets of titles, sets of integer IDs ("exact"), sorted arrays of integer IDs ("sorted"), or HyperLogLog sketches ("hll") (default: set)')
+
+    cli_parser.add_argument('-e', '--error', type=float,
+                            default=cardinality.HLL_ERROR,
+                            help='relative standard error of the HyperLogLog counter (default: {})'.format(cardinality.HLL_ERROR))
+
     # Verbosity option
     cli_parser.add_argument('-v', '--verbose', action='store_true',
                             help='write informational output')
@@ -131,11 +230,12 @@ def main():
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
-    processor = ClickProcessor()
-    processor.process_clickstream(args.config_filename,
-                                  args.clickstream_filename)
+    processor = ClickProcessor(counter_backend=args.counter,
+                               counter_error=args.error)
+    processor.process_clickstreams(args.config_filenames,
+                                   args.clickstream_filename,
+                                   n_processes=args.processes)
     return()
 
 if __name__ == '__main__':
     main()
-
@@ -28,30 +28,27 @@ SOFTWARE.
 import yaml
 import logging
 
+from collections import Counter
+
+import numpy as np
+
+import claims
+import wddump
+import wdcache
 import sidechain
 import wikiproject
 
-def process_sidechain(config_file):
+def read_dataset(dataset_file):
     '''
-    Load in the given WikiProject configuration and its dataset,
-    iterate through and write out a dataset of all articles that
-    should be side-chained together with their ratings.
+    Read the given WikiProject dataset and return a dict mapping the QID
+    of every article that has one to its page ID, in dataset order.
 
-    :param config_file: path to the WikiProject YAML configuration file
-    :type config_file: str
+    :param dataset_file: path to the dataset
+    :type dataset_file: str
     '''
 
-    with open(config_file) as infile:
-        config = yaml.load(infile)
-    
-    (project, rules) = sidechain.load(config['ruleset file'])
-    print("Testing using rules from the {} project".format(project))
-
-    sidechained_articles = []
-    
-    # load in the dataset
     qid_pageid_map = {}
-    with open(config['dataset']) as infile:
+    with open(dataset_file) as infile:
         infile.readline() # skip header
         for line in infile:
             (page_id, qid, num_links,
@@ -59,26 +56,141 @@ def process_sidechain(config_file):
             if qid:
                 qid_pageid_map[qid] = page_id
 
-    qids = list(qid_pageid_map.keys())
+    return(qid_pageid_map)
+
+def claim_arrays(qids, properties, entity_store, metrics=None):
+    '''
+    Get the claims with the given properties of the given Wikidata items
+    as a tuple of arrays of the position in `qids` of the item each claim
+    belongs to, and the numbers of the claim's property and target, as
+    expected by `sidechain.CompiledRuleset.match`.
+
+    :param qids: QIDs of the Wikidata items
+    :type qids: list
+
+    :param properties: the properties of the claims we need
+    :type properties: set
+
+    :param entity_store: store of Wikidata entities to read from
+    :type entity_store: `wdcache.EntityStore` or `wddump.DumpIndex`
+
+    :param metrics: counter of processed and skipped claims, see
+                    the `claims` module
+    :type metrics: collections.Counter
+    '''
+
+    entity_store.require_properties(properties)
+
+    if hasattr(entity_store, 'edge_arrays'):
+        ## A dump index gives us all the claims in one go
+        return(entity_store.edge_arrays(
+            [sidechain.entity_number(qid) for qid in qids]))
+
+    qid_pos = {qid:i for (i, qid) in enumerate(qids)}
+    triples = []
     i = 0
     while i < len(qids):
         subset = qids[i:i + sidechain.MAX_ITEMS]
-        sidechain_result = sidechain.sidechain_q(config['lang'],
-                                                 subset,
-                                                 rules)
-        
-        for (qid, ratings) in sidechain_result['sidechain'].items():
-            sidechained_articles.append({'page_id': qid_pageid_map[qid],
-                                         'ratings': ",".join(ratings)})
+        triples.extend(claims.triples(entity_store.get_entities(subset),
+                                      properties, metrics,
+                                      skip_redirects=True))
+        logging.info('retrieved entities [{}:{}] of {}'.format(i, i+sidechain.MAX_ITEMS, len(qids)))
+        i += sidechain.MAX_ITEMS
+
+    triples = [(qid, prop, target) for (qid, prop, target) in triples
+               if qid in qid_pos]
+    owners = np.fromiter((qid_pos[qid] for (qid, prop, target) in triples),
+                         dtype=np.int64, count=len(triples))
+    props = np.fromiter((sidechain.entity_number(prop) for (qid, prop, target)
+                         in triples), dtype=np.int64, count=len(triples))
+    targets = np.fromiter((sidechain.entity_number(target)
+                           if target[:1] == 'Q' else -1
+                           for (qid, prop, target) in triples),
+                          dtype=np.int64, count=len(triples))
+    return((owners, props, targets))
+
+def process_sidechain(config_file, entity_store=None):
+    '''
+    Load in the given WikiProject configuration and its dataset,
+    iterate through and write out a dataset of all articles that
+    should be side-chained together with their ratings.
 
+    :param config_file: path to the WikiProject YAML configuration file
+    :type config_file: str
 
-        logging.info('completed processing of subset [{}:{}], currently {} articles in the side chain'.format(i, i+sidechain.MAX_ITEMS, len(sidechained_articles)))
-        i += sidechain.MAX_ITEMS
+    :param entity_store: store of Wikidata entities to read from,
+                         defaults to the shared store
+    :type entity_store: `wdcache.EntityStore` or `wddump.DumpIndex`
+    '''
+    return(process_sidechains([config_file], entity_store=entity_store))
 
-    with open(config['sidechain file'], 'w') as outfile:
-        outfile.write('page_id\tratings\n')
-        for article in sidechained_articles:
-            outfile.write('{page_id}\t{ratings}\n'.format_map(article))
+def process_sidechains(config_files, entity_store=None):
+    '''
+    Load in the given WikiProject configurations and their datasets,
+    get the claims of all their articles' Wikidata items once, match them
+    against each project's ruleset, and write out a dataset per project
+    of all articles that should be side-chained together with their ratings.
+
+    :param config_files: paths to the WikiProject YAML configuration files
+    :type config_files: list
+
+    :param entity_store: store of Wikidata entities to read from,
+                         defaults to the shared store
+    :type entity_store: `wdcache.EntityStore` or `wddump.DumpIndex`
+    '''
+
+    if entity_store is None:
+        entity_store = wdcache.open_store()
+
+    configs = []
+    rulesets = []
+    datasets = []
+    for config_file in config_files:
+        with open(config_file) as infile:
+            config = yaml.load(infile)
+        configs.append(config)
+
+        (project, rules) = sidechain.load(config['ruleset file'])
+        print("Testing using rules from the {} project".format(project))
+        rulesets.append(rules.compile())
+
+        datasets.append(read_dataset(config['dataset']))
+
+    ## Get the claims of the union of all projects' items
+    qid_pos = {}
+    for qid_pageid_map in datasets:
+        for qid in qid_pageid_map:
+            qid_pos.setdefault(qid, len(qid_pos))
+    qids = list(qid_pos.keys())
+    properties = set().union(*[r.properties for r in rulesets])
+
+    claim_metrics = Counter()
+    (owners, props, targets) = claim_arrays(qids, properties, entity_store,
+                                            metrics=claim_metrics)
+    logging.info('got {} claims for {} items'.format(len(owners), len(qids)))
+    if claim_metrics:
+        logging.info('claims processed: {}'.format(
+            claims.format_metrics(claim_metrics)))
+
+    for (config, rules, qid_pageid_map) in zip(configs, rulesets, datasets):
+        matches = rules.group(*rules.match(owners, props, targets))
+
+        sidechained_articles = []
+        for (qid, page_id) in qid_pageid_map.items():
+            try:
+                ratings = matches[qid_pos[qid]]
+            except KeyError:
+                continue
+            sidechained_articles.append({'page_id': page_id,
+                                         'ratings': ",".join(ratings)})
+
+        logging.info('{} articles in the side chain of {}'.format(
+            len(sidechained_articles), config['dataset']))
+
+        with open(config['sidechain file'], 'w') as outfile:
+            outfile.write('page_id\tratings\n')
+            for article in sidechained_articles:
+                outfile.write('{page_id}\t{ratings}\n'.format_map(article))
         
     return()
 
@@ -93,15 +205,22 @@ def main():
     cli_parser.add_argument('-v', '--verbose', action='store_true',
                             help='write informational output')
 
-    cli_parser.add_argument('config_file',
-                            help='path to the WikiProject YAML configuration file')
+    cli_parser.add_argument('config_files', nargs='+',
+                            help='path to the WikiProject YAML configuration file(s)')
+
+    cli_parser.add_argument('--wikidata-index', type=str,
+                            help='path to an index of a Wikidata dump (see import-wikidata-dump.py), evaluates the rules offline')
 
     args = cli_parser.parse_args()
 
     if args.verbose:
         logging.basicConfig(level=logging.INFO)
 
-    process_sidechain(args.config_file)
+    entity_store = None
+    if args.wikidata_index:
+        entity_store = wddump.DumpIndex(args.wikidata_index)
+
+    process_sidechains(args.config_files, entity_store=entity_store)
 
     return()
 
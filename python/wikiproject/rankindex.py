@@ -0,0 +1,164 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for exact percentile ranks of articles' number of inlinks and views.
+
+A rank index holds the distinct values of a variable across a dataset and,
+for each of them, its rank as `pandas.Series.rank(method='min')` gives it
+(one plus the number of smaller values). It is built in one counting pass
+over the values, which can be fed to it in chunks, and is the size of the
+number of distinct values rather than of the dataset. Any value, whether
+or not it is in the index, is then ranked with a binary search, so a chunk
+of a dataset or a single article gets the same rank and percentile as it
+would have had in a rank of the whole dataset.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+
+import numpy as np
+
+## The ranked variables and the prefix of their rank columns
+RANKED_COLUMNS = [('num_inlinks', 'rank_links'),
+                  ('num_views', 'rank_views')]
+
+class RankIndex:
+    '''
+    A lookup table of value to minimum rank.
+    '''
+    def __init__(self, values=None):
+        '''
+        :param values: values to add to the index, see `update`
+        :type values: array-like
+        '''
+        self.values = np.array([], dtype=np.float64)
+        self.counts = np.array([], dtype=np.int64)
+
+        ## Number of values smaller than each distinct value,
+        ## set by `update`
+        self.n_smaller = np.array([], dtype=np.int64)
+
+        if values is not None:
+            self.update(values)
+
+    def __len__(self):
+        return(int(self.counts.sum()))
+
+    def update(self, values):
+        '''
+        Add the given values to the index, e.g. one chunk of a dataset
+        at a time. Missing values are not ranked, as in pandas.
+
+        :param values: the values to add
+        :type values: array-like
+        '''
+
+        values = np.asarray(values, dtype=np.float64)
+        (chunk_values, chunk_counts) = np.unique(values[~np.isnan(values)],
+                                                 return_counts=True)
+
+        ## Merge the chunk's counts into the index's
+        (self.values, inverse) = np.unique(
+            np.concatenate((self.values, chunk_values)), return_inverse=True)
+        self.counts = np.bincount(
+            inverse, weights=np.concatenate((self.counts, chunk_counts)),
+            minlength=len(self.values)).astype(np.int64)
+
+        self.n_smaller = np.concatenate(([0], np.cumsum(self.counts)))
+        return()
+
+    def min_rank(self, values):
+        '''
+        Return the ranks of the given values, as `pandas.Series.rank` with
+        `method='min'` ranks them among the values in the index. Missing
+        values get a missing rank.
+
+        :param values: the values to rank
+        :type values: array-like
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        ranks = 1.0 + self.n_smaller[np.searchsorted(self.values, values)]
+        ranks[np.isnan(values)] = np.nan
+        return(ranks)
+
+    def percentile(self, values):
+        '''
+        Return the percentile ranks of the given values, as
+        `pandas.Series.rank` with `method='min'` and `pct=True` calculates
+        them among the values in the index.
+
+        :param values: the values to rank
+        :type values: array-like
+        '''
+        return(self.min_rank(values) / len(self))
+
+    def save(self, path):
+        '''
+        Write the index to a NumPy `.npz` file at the given path.
+
+        :param path: path to the index file
+        :type path: str
+        '''
+        with open(os.path.expanduser(path), 'wb') as outfile:
+            np.savez(outfile, values=self.values, counts=self.counts)
+        return()
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Read an index written by `save`.
+
+        :param path: path to the index file
+        :type path: str
+        '''
+        index = cls()
+        with np.load(os.path.expanduser(path)) as index_data:
+            index.values = index_data['values']
+            index.counts = index_data['counts']
+        index.n_smaller = np.concatenate(([0], np.cumsum(index.counts)))
+        return(index)
+
+def add_ranks(dataset, indexes=None):
+    '''
+    Add the rank columns of the number of inlinks and views (`rank_links`,
+    `rank_links_perc`, `rank_views`, and `rank_views_perc`) to the given
+    dataset. Returns a dictionary of the rank index used for each column.
+
+    :param dataset: the dataset
+    :type dataset: `pandas.DataFrame`
+
+    :param indexes: rank index of each ranked column, by default built
+                    from the dataset itself
+    :type indexes: dict
+    '''
+
+    if indexes is None:
+        indexes = {column: RankIndex(dataset[column].values)
+                   for (column, rank_column) in RANKED_COLUMNS}
+
+    for (column, rank_column) in RANKED_COLUMNS:
+        index = indexes[column]
+        dataset[rank_column] = index.min_rank(dataset[column].values)
+        dataset['{}_perc'.format(rank_column)] = index.percentile(
+            dataset[column].values)
+
+    return(indexes)
@@ -32,6 +32,11 @@ import requests
 from time import sleep
 from collections import defaultdict
 
+import numpy as np
+
+import claims
+import wdcache
+
 ## Maximum number of articles, set to 50 for now, unless we get to be a bot,
 ## then it can be raised to 500.
 MAX_ITEMS = 50
@@ -144,6 +149,13 @@ class Ruleset:
 
         if not self.rules[predicate_p]:
             del(self.rules[redicate_p])
+
+    def compile(self):
+        '''
+        Return a `CompiledRuleset` for matching claims of many entities
+        against this ruleset at once.
+        '''
+        return(CompiledRuleset(self))
         
 def load(rule_file):
     '''
@@ -173,7 +185,138 @@ def load(rule_file):
 
     return((project_name, ruleset))
 
-def sidechain_entities(entity_data, ruleset):
+def entity_number(entity_id):
+    '''
+    Return the numeric part of the given Wikidata item or property
+    identifier (e.g. 5 for "Q5" and 31 for "P31"), or -1 if it is not
+    an item or property.
+
+    :param entity_id: the identifier
+    :type entity_id: str
+    '''
+    if entity_id[:1] in ('Q', 'P') and entity_id[1:].isdigit():
+        return(int(entity_id[1:]))
+    return(-1)
+
+class CompiledRuleset:
+    '''
+    A `Ruleset` compiled for matching large numbers of claims at once.
+    Every rule's (property, object) pair is encoded as a single integer,
+    stored in a sorted array, and claims are matched against it by
+    binary search in NumPy.
+    '''
+    def __init__(self, ruleset):
+        '''
+        :param ruleset: the ruleset to compile
+        :type ruleset: `Ruleset`
+        '''
+        self.properties = set(ruleset.rules.keys())
+
+        keys = []
+        ratings = []
+        for (predicate_p, objects) in ruleset.rules.items():
+            for (object_q, importance_rating) in objects.items():
+                (prop, obj) = (entity_number(predicate_p),
+                               entity_number(object_q))
+                if prop < 0 or obj < 0:
+                    logging.warning('unable to compile rule {} {}'.format(
+                        predicate_p, object_q))
+                    continue
+                keys.append(self.encode(prop, obj))
+                ratings.append(importance_rating)
+
+        ## Importance ratings are stored as codes into `self.ratings`
+        self.ratings = np.array(sorted(set(ratings)), dtype=object)
+        keys = np.array(keys, dtype=np.int64)
+        codes = np.searchsorted(self.ratings, np.array(ratings, dtype=object))
+
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.codes = codes[order]
+
+    def __len__(self):
+        return(len(self.keys))
+
+    @staticmethod
+    def encode(props, targets):
+        '''
+        Encode the given properties and targets (as numbers, either single
+        values or NumPy arrays) as the integers used as keys of the rules.
+        '''
+        return((np.int64(props) << 32) | np.int64(targets))
+
+    def match(self, owners, props, targets):
+        '''
+        Match the given claims against the rules. The claims are given as
+        equal-length arrays of the owning entity of each claim (e.g. an
+        index into a list of entities), and the numbers of the claim's
+        property and target. Returns a tuple of an array of the owners of
+        the matching claims, in the order given, and an array of the
+        importance ratings of the matched rules.
+
+        :param owners: owning entity of each claim
+        :type owners: numpy.ndarray
+
+        :param props: property number of each claim
+        :type props: numpy.ndarray
+
+        :param targets: target item number of each claim, or -1 for
+                        targets that are not items
+        :type targets: numpy.ndarray
+        '''
+        owners = np.asarray(owners)
+        if not len(self.keys) or not len(owners):
+            return((owners[:0], self.ratings[:0]))
+
+        keys = self.encode(np.asarray(props, dtype=np.int64),
+                           np.asarray(targets, dtype=np.int64))
+        pos = np.searchsorted(self.keys, keys)
+        pos[pos == len(self.keys)] = 0
+        matched = (self.keys[pos] == keys) & (np.asarray(targets) >= 0)
+
+        return((owners[matched], self.ratings[self.codes[pos[matched]]]))
+
+    def match_triples(self, triples):
+        '''
+        Match the given (QID, property, target) triples, as returned by
+        `claims.triples`, against the rules. Returns a dict mapping the
+        QID of every matching entity to a list of importance ratings,
+        in the order of its claims.
+
+        :param triples: the claim triples
+        :type triples: list
+        '''
+        qid_index = {}
+        owners = np.fromiter((qid_index.setdefault(qid, len(qid_index))
+                              for (qid, prop, target) in triples),
+                             dtype=np.int64, count=len(triples))
+        qids = list(qid_index.keys())
+        props = np.fromiter((entity_number(prop) for (qid, prop, target)
+                             in triples), dtype=np.int64, count=len(triples))
+        targets = np.fromiter((entity_number(target) if target[:1] == 'Q'
+                               else -1 for (qid, prop, target) in triples),
+                              dtype=np.int64, count=len(triples))
+
+        return(self.group(*self.match(owners, props, targets), keys=qids))
+
+    @staticmethod
+    def group(owners, ratings, keys=None):
+        '''
+        Group the result of `match` into a dict mapping each owner (or its
+        key, if a sequence of keys is given) to a list of ratings.
+        '''
+        result = {}
+        for (owner, rating) in zip(owners.tolist(), ratings.tolist()):
+            if keys is not None:
+                owner = keys[owner]
+            try:
+                result[owner].append(rating)
+            except KeyError:
+                result[owner] = [rating]
+
+        return(result)
+
+def sidechain_entities(entity_data, ruleset, metrics=None):
     '''
     Process a set of entity data from Wikidata's API and identify any entities
     that should be side-chained based on the given set of rules.
@@ -183,6 +326,10 @@ def sidechain_entities(entity_data, ruleset):
 
     :param ruleset: the side-chaining ruleset
     :type ruleset: `Ruleset`
+
+    :param metrics: counter of processed and skipped claims, see
+                    the `claims` module
+    :type metrics: collections.Counter
     '''
 
     ## By default, all entities are not side-chained, and we move entities
@@ -190,75 +337,27 @@ def sidechain_entities(entity_data, ruleset):
     non_sidechained_entities = set(entity_data.keys())
     sidechained_entities = {}
 
-    for entity in entity_data.values():
-        if "redirects" in entity:
-            ## This is a Wikidata redirect, cannot be side-chained.
-            ## If we don't ignore them, the entity ID selected below will
-            ## point to the redirect.
-            continue
-        
+    ## Wikidata redirects are skipped, they cannot be side-chained.
+    ## If we don't ignore them, the entity ID would point to the redirect.
+    ## Only claims that match a rule are extracted.
+    rules = ruleset.rules
+    for (qid, claim, object_q) in claims.triples(entity_data,
+                                                 metrics=metrics,
+                                                 skip_redirects=True,
+                                                 targets=rules):
+        rating = rules[claim][object_q]
         try:
-            qid = entity['id']
+            sidechained_entities[qid].append(rating)
         except KeyError:
-            logging.warning('unable to get QID for {}'.format(entity))
-            continue
-
-        if not 'claims' in entity:
-            ## No claims about this entity, it should not be side-chained
-            continue
-
-        ## Importance ratings of matched rules for this entity
-        ratings = []
-        
-        for (claim, claimdata) in entity['claims'].items():
-            ## If this claim does not occur in the ruleset, this claim
-            ## cannot lead to the article being side-chained
-            if not claim in ruleset.rules:
-                continue
-            
-            if isinstance(claimdata, dict):
-                try:
-                    object_q = claimdata['mainsnak']['datavalue']['value']['id']
-                    if object_q in ruleset.rules[claim]:
-                        ratings.append(ruleset.rules[claim][object_q])
-                except KeyError:
-                    ## Claim does not point to a Wikidata entity
-                    logging.warning('not a wikidata entity:')
-                    logging.warning(claimdata)
-                    continue
-                except TypeError:
-                    ## Something along the line might not be a dict,
-                    ## which means there is not a side-chain possibility
-                    logging.warning('TypeError:')
-                    logging.warning(claimdata)
-                    continue
-            elif isinstance(claimdata, list):
-                for c in claimdata:
-                    try:
-                        object_q = c['mainsnak']['datavalue']['value']['id']
-                        if object_q in ruleset.rules[claim]:
-                            ratings.append(ruleset.rules[claim][object_q])
-                    except KeyError:
-                        ## Claim does not point to a Wikidata entity
-                        logging.warning('not a Wikidata entity?')
-                        logging.warning(c)
-                        continue
-                    except TypeError:
-                        ## Something along the line might not be a dict,
-                        ## which means there is not a side-chain possibility
-                        logging.warning('TypeError:')
-                        logging.warning(c)
-                        continue
-
-        if ratings:
             non_sidechained_entities.remove(qid)
-            sidechained_entities[qid] = ratings
+            sidechained_entities[qid] = [rating]
                 
     ## Return the sidechain
     return({'sidechain': sidechained_entities,
             'non_sidechain': list(non_sidechained_entities)})
 
-def sidechain_q(lang, wikidata_items, ruleset):
+def sidechain_q(lang, wikidata_items, ruleset, entity_store=None,
+                metrics=None):
     '''
     Determine which of the given wikidata items should be side-chained
     in the given context of a WikiProject, as defined through the ruleset.
@@ -272,23 +371,30 @@ def sidechain_q(lang, wikidata_items, ruleset):
 
     :param ruleset: the set of rules to be used for side-chaining
     :type ruleset: `Ruleset`
+
+    :param entity_store: store of Wikidata entities to read through,
+                         defaults to the shared store
+    :type entity_store: `wdcache.EntityStore`
+
+    :param metrics: counter of processed and skipped claims, see
+                    the `claims` module
+    :type metrics: collections.Counter
     '''
 
     if len(wikidata_items) > MAX_ITEMS:
         raise(TooManyItemsError)
 
-    wikidata_query_params = {'action': 'wbgetentities',
-                             'sites': '{}wiki'.format(lang),
-                             'languages': lang,
-                             'maxlag': 5,
-                             'format': 'json',
-                             'ids': "|".join(wikidata_items)}
+    if entity_store is None:
+        entity_store = wdcache.open_store()
+
+    ## Make sure the store has the claims the rules need
+    entity_store.require_properties(ruleset.rules.keys())
 
     # get the Wikidata entities for all the associated articles
-    wikidata = wd_api_request(wikidata_query_params)
-    return(sidechain_entities(wikidata['entities'], ruleset))
+    entity_data = entity_store.get_entities(wikidata_items)
+    return(sidechain_entities(entity_data, ruleset, metrics=metrics))
     
-def sidechain(lang, articles, ruleset):
+def sidechain(lang, articles, ruleset, entity_store=None):
     ''''
     Determine which of the articles should be side-chained in the given
     context of a WikiProject, per the given set of rules.
@@ -301,6 +407,10 @@ def sidechain(lang, articles, ruleset):
 
     :param ruleset: the set of rules to be used for side-chaining
     :type ruleset: `Ruleset`
+
+    :param entity_store: store of Wikidata entities to read through,
+                         defaults to the shared store
+    :type entity_store: `wdcache.EntityStore`
     '''
 
     if len(articles) > MAX_ITEMS:
@@ -318,13 +428,6 @@ def sidechain(lang, articles, ruleset):
                          'titles': '',  # titles added later
                          'format': 'json'}
 
-    wikidata_query_params = {'action': 'wbgetentities',
-                             'sites': '{}wiki'.format(lang),
-                             'ids': '', # added later
-                             'languages': lang,
-                             'maxlag': 5,
-                             'format': 'json'}
-
     ## Mapping Wikidata identifier to article title
     q_title_map = {}
     
@@ -353,7 +456,8 @@ def sidechain(lang, articles, ruleset):
         except KeyError:
             continue # article does not have a Wikidata item associated with it
 
-    sidechain_result = sidechain_q(lang, q_title_map.keys(), ruleset)
+    sidechain_result = sidechain_q(lang, list(q_title_map.keys()), ruleset,
+                                   entity_store=entity_store)
 
     # Translate Wikidata QIDs to article titles if anything got side-chained
     if sidechain_result['sidechain']:
@@ -0,0 +1,226 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for reading WikiProject snapshots into columnar NumPy arrays,
+which is much faster and uses far less memory than creating one
+`wikiproject.RatedPage` object per page for large (e.g. global) snapshots.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import csv
+
+import numpy as np
+
+import tsvcache
+import wikiproject as wp
+
+## Importance ratings, in order. Ratings not in this list (e.g. "None" in
+## the global snapshot) are appended to a snapshot's categories as found.
+IMPORTANCE_RATINGS = ['Top', 'High', 'Mid', 'Low']
+
+## Columns of the snapshot TSV, in order
+SNAPSHOT_COLUMNS = ['talk_page_id', 'talk_revision_id', 'talk_page_title',
+                    'talk_is_archive', 'art_page_id', 'art_revision_id',
+                    'art_is_redirect', 'importance_rating']
+
+## Integer columns in the snapshot and the type we store them as
+INT_COLUMNS = [('talk_page_id', np.int64),
+               ('talk_revision_id', np.int64),
+               ('talk_is_archive', np.int8),
+               ('art_page_id', np.int64),
+               ('art_revision_id', np.int64),
+               ('art_is_redirect', np.int8)]
+
+class TitleArray:
+    '''
+    An immutable array of titles stored as a single UTF-8 encoded buffer
+    and an array of offsets into it, avoiding one Python string per title.
+    '''
+    def __init__(self, buffer, offsets):
+        '''
+        :param buffer: the concatenated UTF-8 encoded titles
+        :type buffer: numpy.ndarray of uint8
+
+        :param offsets: start offset of every title, followed by the length
+                        of the buffer
+        :type offsets: numpy.ndarray of int64
+        '''
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, titles):
+        '''
+        Create a `TitleArray` from a sequence of strings.
+
+        :param titles: the titles
+        :type titles: sequence of str
+        '''
+        encoded = [t.encode('utf-8') for t in titles]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in encoded], out=offsets[1:])
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return(cls(buffer, offsets))
+
+    def __len__(self):
+        return(len(self.offsets) - 1)
+
+    def __getitem__(self, idx):
+        return(self.buffer[self.offsets[idx]:self.offsets[idx + 1]]
+               .tobytes().decode('utf-8'))
+
+    def __iter__(self):
+        data = self.buffer.tobytes()
+        offsets = self.offsets.tolist()
+        for (start, end) in zip(offsets[:-1], offsets[1:]):
+            yield data[start:end].decode('utf-8')
+
+class Snapshot:
+    '''
+    A WikiProject snapshot stored as columns. Integer columns are NumPy
+    arrays named as in the snapshot TSV, the importance rating is stored as
+    integer codes into `categories`, and titles are in a `TitleArray`.
+    '''
+    def __init__(self, columns, rating_codes, categories, titles):
+        '''
+        :param columns: map of column name to NumPy array, see `INT_COLUMNS`
+        :type columns: dict
+
+        :param rating_codes: index into `categories` of every page's rating
+        :type rating_codes: numpy.ndarray of int8
+
+        :param categories: the importance ratings found in the snapshot
+        :type categories: list
+
+        :param titles: titles of the talk pages (without namespace)
+        :type titles: `TitleArray`
+        '''
+        self.columns = columns
+        self.rating_codes = rating_codes
+        self.categories = categories
+        self.titles = titles
+
+    def __len__(self):
+        return(len(self.rating_codes))
+
+    def __getitem__(self, column):
+        return(self.columns[column])
+
+    def has_article(self):
+        '''
+        Return a boolean mask of the pages that have an associated article.
+        '''
+        return(self.columns['art_page_id'] != -1)
+
+    def rating_mask(self, rating):
+        '''
+        Return a boolean mask of the pages with the given importance rating.
+
+        :param rating: the importance rating
+        :type rating: str
+        '''
+        try:
+            return(self.rating_codes == self.categories.index(rating))
+        except ValueError:
+            return(np.zeros(len(self), dtype=bool))
+
+    def ratings(self):
+        '''
+        Return the importance ratings as an array of strings.
+        '''
+        return(np.array(self.categories, dtype=object)[self.rating_codes])
+
+    def page(self, idx, counter_factory=set):
+        '''
+        Create a `wikiproject.RatedPage` for the page at the given index.
+        The fields are strings, as they are when created by
+        `wikiproject.read_snapshot`.
+
+        :param idx: index of the page
+        :type idx: int
+
+        :param counter_factory: callable creating the counters used to
+                                track unique article inlinks
+        :type counter_factory: callable
+        '''
+        cols = self.columns
+        return(wp.RatedPage(str(cols['talk_page_id'][idx]),
+                            str(cols['talk_revision_id'][idx]),
+                            self.titles[idx],
+                            str(cols['talk_is_archive'][idx]),
+                            self.categories[self.rating_codes[idx]],
+                            str(cols['art_page_id'][idx]),
+                            str(cols['art_revision_id'][idx]),
+                            str(cols['art_is_redirect'][idx]),
+                            counter_factory=counter_factory))
+
+    def pages(self, mask=None, counter_factory=set):
+        '''
+        Lazily create `wikiproject.RatedPage` objects for all pages, or
+        the pages selected by the given mask.
+
+        :param mask: boolean mask of the pages to create objects for
+        :type mask: numpy.ndarray
+
+        :param counter_factory: callable creating the counters used to
+                                track unique article inlinks
+        :type counter_factory: callable
+        '''
+        if mask is None:
+            indexes = range(len(self))
+        else:
+            indexes = np.flatnonzero(mask).tolist()
+
+        for idx in indexes:
+            yield self.page(idx, counter_factory=counter_factory)
+
+def read(snapshot_filename):
+    '''
+    Read the given snapshot TSV file and return it as a `Snapshot`.
+
+    :param snapshot_filename: path to the snapshot TSV file
+    :type snapshot_filename: str
+    '''
+
+    dtypes = {name:dtype for (name, dtype) in INT_COLUMNS}
+    dtypes['talk_page_title'] = str
+    dtypes['importance_rating'] = 'category'
+
+    ## Titles can contain quotes and be things like "NaN" or "None",
+    ## so turn off quoting and missing value detection. The header is
+    ## skipped and the columns read by position, like `read_snapshot` does.
+    df = tsvcache.read_table(snapshot_filename, header=0,
+                             names=SNAPSHOT_COLUMNS, dtype=dtypes,
+                             quoting=csv.QUOTE_NONE, na_filter=False)
+
+    columns = {name:df[name].values for (name, dtype) in INT_COLUMNS}
+
+    ## Order the ratings so that the known ones have fixed codes
+    found = list(df['importance_rating'].cat.categories)
+    categories = list(IMPORTANCE_RATINGS) + \
+                 [r for r in found if r not in IMPORTANCE_RATINGS]
+    rating_codes = df['importance_rating'].cat.set_categories(
+        categories).cat.codes.values.astype(np.int8)
+
+    titles = TitleArray.from_strings(df['talk_page_title'].values)
+
+    return(Snapshot(columns, rating_codes, categories, titles))
@@ -25,14 +25,20 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import os
+import copy
+import json
+import random
 import logging
 import pickle
+import itertools
 
 import numpy as np
 import pandas as pd
 
 from random import choice
 from operator import itemgetter
+from multiprocessing import Pool
 
 from yaml import load
 
@@ -45,6 +51,198 @@ from sklearn.ensemble import GradientBoostingClassifier as gbm
 
 from imblearn.over_sampling import SMOTE
 
+import tsvcache
+import rankindex
+
+## Separator between the levels of a nested configuration setting in the
+## name of a swept setting, e.g. "model parameters/max_depth"
+SETTING_SEPARATOR = '/'
+
+## Metric sweep results are ranked by unless the sweep configures another
+RANKING_METRIC = 'f1_macro'
+
+## Trainer used by the worker processes of a sweep, set by `_init_worker`
+_trainer = None
+
+def _init_worker(trainer):
+    '''
+    Set the trainer of a worker process.
+    '''
+    global _trainer
+    _trainer = trainer
+
+def _run_settings(run):
+    '''
+    Train and evaluate a model with the given settings in a worker.
+    '''
+    (key, settings, repeat, seed) = run
+    try:
+        metrics = _trainer.run_settings(settings, seed)
+        error = None
+    except ValueError as e:
+        ## E.g. asking for more articles of a rating than there are
+        metrics = None
+        error = str(e)
+    return({'key': key, 'settings': settings, 'repeat': repeat,
+            'metrics': metrics, 'error': error})
+
+def apply_settings(config, settings):
+    '''
+    Return a copy of the given configuration with the given settings.
+
+    :param config: the configuration
+    :type config: dict
+
+    :param settings: map of setting name, with nested configuration levels
+                     separated by `SETTING_SEPARATOR`, to its value
+    :type settings: dict
+    '''
+    config = copy.deepcopy(config)
+    for (name, value) in settings.items():
+        path = name.split(SETTING_SEPARATOR)
+        level = config
+        for key in path[:-1]:
+            level = level.setdefault(key, {})
+        level[path[-1]] = value
+    return(config)
+
+def flatten_space(space, prefix=''):
+    '''
+    Flatten a nested search space into a list of tuples of setting name
+    and the list of values to search, see `apply_settings`.
+
+    :param space: the search space, a mapping of configuration keys to
+                  either a list of values or a nested search space
+    :type space: dict
+
+    :param prefix: name of the configuration level of the search space
+    :type prefix: str
+    '''
+    flat = []
+    for (key, values) in space.items():
+        name = '{}{}'.format(prefix, key)
+        if isinstance(values, dict):
+            flat.extend(flatten_space(values, name + SETTING_SEPARATOR))
+        elif isinstance(values, list):
+            flat.append((name, values))
+        else:
+            flat.append((name, [values]))
+    return(flat)
+
+def make_settings(space, search='grid', n_samples=None, seed=None):
+    '''
+    Return the list of settings to evaluate from the given search space.
+    A grid search evaluates every combination of values, a random search
+    `n_samples` different combinations drawn at random.
+
+    :param space: the search space, see `flatten_space`
+    :type space: dict
+
+    :param search: type of search, "grid" or "random"
+    :type search: str
+
+    :param n_samples: number of combinations in a random search,
+                      required for a random search
+    :type n_samples: int
+
+    :param seed: seed of the random search
+    :type seed: int
+    '''
+
+    flat = flatten_space(space)
+    names = [name for (name, values) in flat]
+    sizes = [len(values) for (name, values) in flat]
+    n_combinations = int(np.prod(sizes))
+
+    if search == 'grid':
+        combinations = range(n_combinations)
+    elif search == 'random':
+        if n_samples is None:
+            raise(ValueError('a random search needs the number of combinations to draw, set "samples" in the sweep file'))
+        combinations = random.Random(seed).sample(
+            range(n_combinations), min(n_samples, n_combinations))
+    else:
+        raise(ValueError('unknown search type {}'.format(search)))
+
+    ## Decode each combination's number into the index of each value
+    settings = []
+    for combination in combinations:
+        indexes = np.unravel_index(combination, sizes) if sizes else []
+        settings.append({name: values[i] for ((name, values), i)
+                         in zip(flat, indexes)})
+    return(settings)
+
+def settings_key(settings, repeat):
+    '''
+    Return a string identifying a run of the given settings.
+
+    :param settings: the run's settings
+    :type settings: dict
+
+    :param repeat: the run's repetition of the settings
+    :type repeat: int
+    '''
+    return(json.dumps([settings, repeat], sort_keys=True))
+
+def read_checkpoint(filename):
+    '''
+    Read the results of completed runs from the given checkpoint file,
+    returning a list of them. A partially written last line, from an
+    interrupted sweep, is ignored.
+
+    :param filename: path to the checkpoint file
+    :type filename: str
+    '''
+    results = []
+    if not os.path.exists(filename):
+        return(results)
+    with open(filename, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                logging.warning('ignoring incomplete line in {}'.format(
+                    filename))
+    return(results)
+
+def rank_results(results, metric=RANKING_METRIC):
+    '''
+    Make a table of the mean metrics of each combination of settings
+    across its runs, ranked by the given metric. Runs that failed are
+    counted, but not part of the means.
+
+    :param results: results of all runs, see `_run_settings`
+    :type results: list
+
+    :param metric: the metric to rank by
+    :type metric: str
+    '''
+
+    rows = []
+    for result in results:
+        row = dict(result['settings'])
+        row['settings'] = json.dumps(result['settings'], sort_keys=True)
+        row['failed'] = int(result['metrics'] is None)
+        row.update(result['metrics'] or {})
+        rows.append(row)
+    runs = pd.DataFrame(rows)
+
+    metrics = sorted(set(itertools.chain.from_iterable(
+        result['metrics'] for result in results if result['metrics'])))
+    grouped = runs.groupby('settings', sort=False)
+    table = grouped.first().drop(metrics + ['failed'], axis=1,
+                                 errors='ignore')
+    table['n_runs'] = grouped.size()
+    table['n_failed'] = grouped.failed.sum()
+    for col in metrics:
+        table[col] = grouped[col].mean()
+    if metric in metrics:
+        table['{}_std'.format(metric)] = grouped[metric].std()
+        table = table.sort_values(metric, ascending=False,
+                                  na_position='last')
+
+    return(table.reset_index(drop=True))
+
 class Dataset:
     def __init__(self, training_data, training_labels,
                  test_data, test_labels):
@@ -69,15 +267,15 @@ class ModelTrainer:
         '''
 
         # read in snapshot
-        snapshot = pd.read_table(self.config['snapshot file'])
+        snapshot = tsvcache.read_table(self.config['snapshot file'])
         # read in dataset
-        dataset = pd.read_table(self.config['dataset'])
+        dataset = tsvcache.read_table(self.config['dataset'])
         # read in clickstream
-        clickstream = pd.read_table(self.config['clickstream file'])
+        clickstream = tsvcache.read_table(self.config['clickstream file'])
         # read in disambiguations
-        disambiguations = pd.read_table(self.config['disambiguation file'])
+        disambiguations = tsvcache.read_table(self.config['disambiguation file'])
         # read in the list of side-chained articles
-        sidechained = pd.read_table(self.config['sidechain file'])
+        sidechained = tsvcache.read_table(self.config['sidechain file'])
         
         # Log-transform number of inlinks, views, and calculate prop_proj_inlinks
         dataset['log_inlinks'] = np.log10(1 + dataset['num_inlinks'])
@@ -116,10 +314,7 @@ class ModelTrainer:
             1.0, res['n_act_links']/(1 + res['num_inlinks']))
 
         # add rank variables for views and inlinks, and make them percentiles
-        res['rank_links'] = res.num_inlinks.rank(method='min')
-        res['rank_links_perc'] = res.num_inlinks.rank(method='min', pct=True)
-        res['rank_views'] = res.num_views.rank(method='min')
-        res['rank_views_perc'] = res.num_views.rank(method='min', pct=True)
+        rankindex.add_ranks(res)
 
         # make sure importance ratings are an ordered categorical variable
         res['importance_rating'] = res.importance_rating.astype(
@@ -204,6 +399,157 @@ class ModelTrainer:
         
         return()
 
+    def evaluate_model(self, dataset):
+        '''
+        Evaluate the model on the given dataset's test data, returning a
+        dictionary of the mean accuracy, the mean of the per-class ROC AUC
+        and the macro-averaged F1-score, as well as per-class F1-scores.
+
+        :param dataset: the dataset we're testing on
+        :type dataset: Dataset
+        '''
+
+        label_preds = self.model.predict(dataset.test_data)
+        label_probs = self.model.predict_proba(dataset.test_data)
+
+        metrics = {'accuracy': self.model.score(dataset.test_data,
+                                                dataset.test_labels)}
+
+        aucs = []
+        for label in np.unique(dataset.test_labels):
+            fpr, tpr, thresholds = roc_curve(
+                dataset.test_labels,
+                label_probs[:, label],
+                pos_label=label)
+            aucs.append(auc(fpr, tpr))
+        metrics['auc_mean'] = float(np.mean(aucs))
+
+        f1_scores = f1_score(dataset.test_labels, label_preds, average=None)
+        metrics['f1_macro'] = float(np.mean(f1_scores))
+        for (label, f1) in enumerate(f1_scores):
+            label_name = self.le.inverse_transform([label])[0]
+            metrics['f1_{}'.format(label_name)] = float(f1)
+
+        return(metrics)
+
+    def run_settings(self, settings, seed):
+        '''
+        Split the dataset into training and test sets, train a model and
+        evaluate it, using the configuration with the given settings
+        applied. Returns the model's metrics, see `evaluate_model`. The
+        trainer itself is not changed.
+
+        :param settings: the settings, see `apply_settings`
+        :type settings: dict
+
+        :param seed: seed of the random sampling of training and test sets
+                     and of SMOTE
+        :type seed: int
+        '''
+
+        trainer = copy.copy(self)
+        trainer.config = apply_settings(self.config, settings)
+
+        random.seed(seed)
+        np.random.seed(seed)
+
+        dataset = trainer.split_train_test()
+        trainer.train_model(dataset)
+        return(trainer.evaluate_model(dataset))
+
+    def sweep(self, sweep_file, n_processes=1):
+        '''
+        Evaluate models trained with every combination of settings in the
+        search space of the given sweep configuration, in parallel, and
+        return a table of the results ranked by the sweep's ranking metric.
+
+        Each run's result is appended to the sweep's checkpoint file as it
+        completes, and runs already in the file are not run again, so an
+        interrupted sweep resumes where it stopped.
+
+        Every combination is run `repeats` times. Runs with the same
+        repetition number use the same seed, so combinations are compared
+        on the same random samples where their sizes are the same.
+
+        :param sweep_file: path to the YAML sweep configuration
+        :type sweep_file: str
+
+        :param n_processes: number of processes training models
+        :type n_processes: int
+        '''
+
+        with open(sweep_file) as infile:
+            sweep_config = load(infile)
+
+        settings = make_settings(sweep_config['parameters'],
+                                 search=sweep_config.get('search', 'grid'),
+                                 n_samples=sweep_config.get('samples'),
+                                 seed=sweep_config.get('seed'))
+        seed = sweep_config.get('seed', 0)
+        runs = [(settings_key(run_settings, repeat), run_settings,
+                 repeat, seed + repeat)
+                for run_settings in settings
+                for repeat in range(sweep_config.get('repeats', 1))]
+
+        checkpoint_file = sweep_config['checkpoint file']
+        results = read_checkpoint(checkpoint_file)
+        done = set(result['key'] for result in results)
+        runs = [run for run in runs if run[0] not in done]
+        logging.info('{} combinations of settings, {} runs left'.format(
+            len(settings), len(runs)))
+
+        ## The label encoder is fit once, so workers share it
+        if not self.le:
+            self.fit_labels()
+
+        pool = None
+        if n_processes > 1:
+            ## Workers are forked with the dataset, which they only read
+            pool = Pool(n_processes, initializer=_init_worker,
+                        initargs=(self,))
+        else:
+            _init_worker(self)
+
+        try:
+            if pool:
+                new_results = pool.imap_unordered(_run_settings, runs)
+            else:
+                new_results = map(_run_settings, runs)
+
+            with open(checkpoint_file, 'a', encoding='utf-8') as outfile:
+                ## End a partially written last line of an interrupted
+                ## sweep, so the next result starts on a line of its own
+                if outfile.tell() > 0:
+                    with open(checkpoint_file, 'rb') as infile:
+                        infile.seek(-1, os.SEEK_END)
+                        if infile.read(1) != b'\n':
+                            outfile.write('\n')
+
+                for (i, result) in enumerate(new_results, 1):
+                    outfile.write('{}\n'.format(json.dumps(result)))
+                    outfile.flush()
+                    results.append(result)
+                    logging.info('completed run {} of {}: {}'.format(
+                        i, len(runs), result['key']))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        ## Only rank the runs of the current search space
+        keys = set(settings_key(run_settings, repeat)
+                   for run_settings in settings
+                   for repeat in range(sweep_config.get('repeats', 1)))
+        table = rank_results([result for result in results
+                              if result['key'] in keys],
+                             metric=sweep_config.get('ranking metric',
+                                                     RANKING_METRIC))
+
+        if sweep_config.get('results file'):
+            table.to_csv(sweep_config['results file'], sep='\t',
+                         index=False)
+        return(table)
+
     def make_final(self):
         '''
         Sample the full dataset according to the final training size,
@@ -435,6 +781,12 @@ def main():
     # YAML configuration file
     cli_parser.add_argument('config_file',
                             help='path to the YAML configuration file')
+
+    cli_parser.add_argument('--sweep', type=str,
+                            help='path to a YAML sweep configuration, evaluate the settings in its search space instead of training a model')
+
+    cli_parser.add_argument('-p', '--processes', type=int, default=1,
+                            help='number of processes training models in a sweep (default: 1)')
     
     args = cli_parser.parse_args()
 
@@ -444,6 +796,11 @@ def main():
     trainer = ModelTrainer(args.config_file)
     trainer.read_dataset()
 
+    if args.sweep:
+        table = trainer.sweep(args.sweep, n_processes=args.processes)
+        print(table.to_string(index=False))
+        return()
+
     ## Make a training/test set and evaluate model performance
     split_dataset = trainer.split_train_test()
     trainer.train_model(split_dataset)
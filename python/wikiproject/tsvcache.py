@@ -0,0 +1,348 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for caching TSV datasets (snapshots, datasets, clickstream,
+disambiguations, side-chains, etc) as binary columnar files, so that
+repeated reads of the same file memory-map the cache instead of parsing
+the TSV again.
+
+A cache is a directory with one `.npy` file per column and a JSON manifest.
+Numeric and boolean columns are memory-mapped copy-on-write when loaded,
+so the data frames can be modified like any other without changing the
+cache. Text columns are stored as a single UTF-8 buffer with a mask of
+missing values, and decoded on load. The cache is keyed by the source
+file's absolute path, size and modification time as well as the arguments
+used to read it, so a changed source file is parsed again and its cache
+replaced.
+
+A read can be restricted to some of the columns and to the rows where a
+numeric column is in a given range, e.g. a range of page IDs. Only the
+selected columns are loaded, and the rows are selected from the
+memory-mapped columns, so only the selected values of text columns are
+decoded.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+## Name of the directory holding the caches, created next to the source
+## file unless the TSVCACHE_DIR environment variable points elsewhere.
+CACHE_DIRNAME = '.tsvcache'
+
+## Version of the cache format, part of the cache key
+CACHE_VERSION = 1
+
+## Separator between values in a text column's buffer. TSV values
+## cannot contain newlines, so it cannot occur in the data.
+TEXT_SEPARATOR = '\n'
+
+def cache_dir(filename):
+    '''
+    Return the path to the directory holding the caches of the given
+    source file.
+
+    :param filename: path to the source TSV file
+    :type filename: str
+    '''
+    return(os.environ.get('TSVCACHE_DIR',
+                          os.path.join(os.path.dirname(
+                              os.path.abspath(filename)), CACHE_DIRNAME)))
+
+def cache_path(filename, read_args):
+    '''
+    Return the path to the cache directory for the given source file
+    and arguments to `pandas.read_table`. The name of the cache is
+    the name of the source file followed by a digest of its path, size
+    and modification time, and a digest of the arguments.
+
+    :param filename: path to the source TSV file
+    :type filename: str
+
+    :param read_args: keyword arguments used to read the file
+    :type read_args: dict
+    '''
+
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    source_key = repr((CACHE_VERSION, filename, stat.st_size,
+                       stat.st_mtime_ns))
+    args_key = repr(sorted(read_args.items()))
+
+    return(os.path.join(cache_dir(filename), '{}.{}.{}'.format(
+        os.path.basename(filename),
+        hashlib.sha1(source_key.encode('utf-8')).hexdigest()[:16],
+        hashlib.sha1(args_key.encode('utf-8')).hexdigest()[:16])))
+
+def write_cache(df, path):
+    '''
+    Write the given data frame to a cache directory at the given path.
+
+    :param df: the data frame to cache
+    :type df: `pandas.DataFrame`
+
+    :param path: path to the cache directory
+    :type path: str
+    '''
+
+    ## Write to a temporary directory and rename it when complete,
+    ## so a reader never sees a partial cache.
+    tmp_path = '{}-tmp{}'.format(path, os.getpid())
+    os.makedirs(tmp_path)
+
+    manifest = {'columns': []}
+    for (i, name) in enumerate(df.columns):
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            kind = 'category'
+            np.save(os.path.join(tmp_path, '{}.npy'.format(i)),
+                    column.cat.codes.values)
+            categories = column.cat.categories.tolist()
+        elif column.dtype.kind in 'biufcmM':
+            kind = 'array'
+            np.save(os.path.join(tmp_path, '{}.npy'.format(i)),
+                    column.values)
+            categories = None
+        else:
+            kind = 'text'
+            is_null = column.isnull().values
+            text = TEXT_SEPARATOR.join(
+                ['' if null else str(value) for (value, null)
+                 in zip(column.values, is_null)])
+            np.save(os.path.join(tmp_path, '{}.npy'.format(i)),
+                    np.frombuffer(text.encode('utf-8'), dtype=np.uint8))
+            np.save(os.path.join(tmp_path, '{}.null.npy'.format(i)), is_null)
+            categories = None
+
+        manifest['columns'].append({'name': name, 'kind': kind,
+                                    'categories': categories})
+
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as outfile:
+        json.dump(manifest, outfile)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        ## Another process wrote the cache first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return()
+
+def decode_text(data, is_null, rows=None):
+    '''
+    Decode a text column from its UTF-8 buffer. Returns an object array
+    of the values, with missing values as NaN.
+
+    :param data: the column's buffer
+    :type data: `numpy.ndarray`
+
+    :param is_null: mask of missing values
+    :type is_null: `numpy.ndarray`
+
+    :param rows: positions of the rows to decode, by default all of them
+    :type rows: `numpy.ndarray`
+    '''
+
+    if rows is None:
+        values = np.array(data.tobytes().decode('utf-8').split(
+            TEXT_SEPARATOR), dtype=object)
+        if len(values) != len(is_null):
+            ## An empty column decodes to a single empty string
+            values = np.array([''] * len(is_null), dtype=object)
+        values[is_null] = np.nan
+        return(values)
+
+    ## Each value runs from the end of the previous one to the next
+    ## separator, so only the selected values are decoded
+    separators = np.flatnonzero(data == ord(TEXT_SEPARATOR))
+    starts = np.concatenate(([0], separators + 1))
+    ends = np.concatenate((separators, [len(data)]))
+    values = np.empty(len(rows), dtype=object)
+    for (j, row) in enumerate(rows):
+        values[j] = data[starts[row]:ends[row]].tobytes().decode('utf-8')
+    values[is_null[rows]] = np.nan
+    return(values)
+
+def read_cache(path, mmap=True, columns=None, value_range=None):
+    '''
+    Read the cache at the given path and return it as a data frame.
+
+    :param path: path to the cache directory
+    :type path: str
+
+    :param mmap: memory-map numeric columns rather than reading them
+    :type mmap: bool
+
+    :param columns: names of the columns to read, by default all of
+                    them. Names that are not columns of the table are
+                    ignored.
+    :type columns: list
+
+    :param value_range: only read the rows where a numeric column is in
+                        a range, given as a tuple of (column name, lowest
+                        value, highest value)
+    :type value_range: tuple
+    '''
+
+    with open(os.path.join(path, 'manifest.json')) as infile:
+        manifest = json.load(infile)
+
+    ## Copy-on-write, so the columns can be written to like those of a
+    ## data frame read from the TSV, without changing the cache
+    mmap_mode = 'c' if mmap else None
+    def load_column(i):
+        return(np.load(os.path.join(path, '{}.npy'.format(i)),
+                       mmap_mode=mmap_mode))
+
+    names = [column['name'] for column in manifest['columns']]
+
+    ## Positions of the selected rows, found from the range column
+    rows = None
+    if value_range is not None:
+        (name, low, high) = value_range
+        if name not in names:
+            raise(KeyError('{} is not a column of the table'.format(name)))
+        i = names.index(name)
+        if manifest['columns'][i]['kind'] != 'array':
+            raise(ValueError('{} is not a numeric column'.format(name)))
+        key = load_column(i)
+        rows = np.flatnonzero((key >= low) & (key <= high))
+
+    data_columns = {}
+    for (i, column) in enumerate(manifest['columns']):
+        if columns is not None and column['name'] not in columns:
+            continue
+
+        data = load_column(i)
+        if rows is not None and column['kind'] != 'text':
+            data = data[rows]
+
+        if column['kind'] == 'array':
+            ## A plain view of the memory map, pandas expects an ndarray
+            data_columns[column['name']] = data.view(np.ndarray)
+        elif column['kind'] == 'category':
+            data_columns[column['name']] = pd.Categorical.from_codes(
+                data, categories=column['categories'])
+        else:
+            is_null = np.load(os.path.join(path, '{}.null.npy'.format(i)))
+            data_columns[column['name']] = decode_text(data, is_null, rows)
+
+    return(pd.DataFrame(data_columns,
+                        columns=[name for name in names
+                                 if name in data_columns],
+                        copy=False))
+
+def select(df, columns=None, value_range=None):
+    '''
+    Select columns and rows of a data frame the way `read_cache` does.
+
+    :param df: the data frame
+    :type df: `pandas.DataFrame`
+
+    :param columns: names of the columns to keep, see `read_cache`
+    :type columns: list
+
+    :param value_range: range of values of a column of the rows to keep,
+                        see `read_cache`
+    :type value_range: tuple
+    '''
+    if value_range is not None:
+        (name, low, high) = value_range
+        df = df[(df[name] >= low) & (df[name] <= high)]
+    if columns is not None:
+        df = df[[name for name in df.columns if name in columns]]
+    return(df)
+
+def read_table(filename, mmap=True, columns=None, value_range=None,
+               **read_args):
+    '''
+    Read the given TSV file like `pandas.read_table`, using the binary
+    cache if it is up to date and creating it if not. The whole file is
+    parsed and cached even if only some columns or rows are read.
+
+    :param filename: path to the TSV file
+    :type filename: str
+
+    :param mmap: memory-map numeric columns when reading the cache
+    :type mmap: bool
+
+    :param columns: names of the columns to read, see `read_cache`
+    :type columns: list
+
+    :param value_range: range of values of a column of the rows to read,
+                        see `read_cache`
+    :type value_range: tuple
+
+    :param read_args: keyword arguments passed to `pandas.read_table`
+    :type read_args: dict
+    '''
+
+    path = cache_path(filename, read_args)
+    if os.path.isdir(path):
+        logging.info('reading {} from cache'.format(filename))
+        return(read_cache(path, mmap=mmap, columns=columns,
+                          value_range=value_range))
+
+    df = pd.read_table(filename, **read_args)
+    try:
+        clear(filename, keep_current=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_cache(df, path)
+    except OSError as e:
+        ## Not being able to cache should not stop us
+        logging.warning('unable to cache {}: {}'.format(filename, e))
+
+    return(select(df, columns=columns, value_range=value_range))
+
+def clear(filename, keep_current=False):
+    '''
+    Remove the caches of the given source file.
+
+    :param filename: path to the source TSV file
+    :type filename: str
+
+    :param keep_current: only remove caches of previous versions of the file
+    :type keep_current: bool
+    '''
+
+    directory = cache_dir(filename)
+    if not os.path.isdir(directory):
+        return()
+
+    basename = os.path.basename(filename)
+    current = None
+    if keep_current:
+        current = os.path.basename(cache_path(filename, {})).split('.')[-2]
+
+    for entry in os.listdir(directory):
+        parts = entry.rsplit('.', 2)
+        if len(parts) != 3 or parts[0] != basename or parts[1] == current:
+            continue
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    return()
@@ -0,0 +1,411 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for a persistent on-disk store of Wikidata entities, shared by
+the tools that request entities from the Wikidata API.
+
+Only the parts of an entity that we use are stored: the targets of its
+claims for a set of properties (by default P31, P279 and P361) and its
+English label, together with the entity's revision ID and when it was
+fetched. Entities are returned in the same format as the `entities` part
+of a `wbgetentities` response, trimmed down to what is stored, so they
+can be processed by the same code as API responses.
+
+Entities older than the store's TTL are revalidated by requesting only
+their revision IDs, and fetched again only if they have changed.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import json
+import sqlite3
+import logging
+import requests
+import threading
+
+from time import sleep, time
+
+## Path to the store unless another one is given, can be set through
+## the WDCACHE_PATH environment variable.
+DEFAULT_PATH = os.environ.get(
+    'WDCACHE_PATH',
+    os.path.join(os.path.expanduser('~'), '.cache', 'wikidata-entities.sqlite'))
+
+## Number of seconds an entity is used before it is revalidated (30 days)
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+## Properties whose claims are stored
+STORED_PROPERTIES = set(['P31', # instance of
+                         'P279', # subclass of
+                         'P361' # part of
+                         ])
+
+## Maximum number of entities in a request, 500 if we are a bot
+MAX_ITEMS = 50
+
+## Maximum number of retries we'll make to the Wikidata API
+MAX_RETRIES = 3
+
+WIKIDATA_API_URL = 'https://www.wikidata.org/w/api.php'
+
+## Properties of entities to request when fetching and revalidating
+FETCH_PROPS = 'info|claims|labels'
+REVALIDATE_PROPS = 'info'
+
+def fetch_entities(qids, props, session=None, lang='en'):
+    '''
+    Request the given entities from the Wikidata API and return the
+    `entities` part of the response, or an empty dict if the request
+    failed.
+
+    :param qids: the QIDs of the entities, at most `MAX_ITEMS`
+    :type qids: list
+
+    :param props: the properties of the entities to request
+    :type props: str
+
+    :param session: the HTTP session to use
+    :type session: requests.Session
+
+    :param lang: language code of the labels to request
+    :type lang: str
+    '''
+
+    if session is None:
+        session = requests
+
+    params = {'action': 'wbgetentities',
+              'ids': '|'.join(qids),
+              'props': props,
+              'languages': lang,
+              'maxlag': 5,
+              'format': 'json'}
+
+    done = False
+    num_retries = 0
+    while not done and num_retries < MAX_RETRIES:
+        response = session.get(WIKIDATA_API_URL, params=params)
+        if response.status_code != 200:
+            logging.warning('Wikidata returned status {}'.format(
+                response.status_code))
+            done = True
+            continue
+
+        try:
+            content = response.json()
+        except ValueError:
+            logging.warning('Unable to decode Wikidata response as JSON')
+            sleep(1)
+            num_retries += 1
+            continue
+
+        if "error" in content and content['error']['code'] == 'maxlag':
+            ## Pause before trying again
+            ptime = max(5, int(response.headers['Retry-After']))
+            logging.warning('WD API is lagged, waiting {} seconds to try again'.format(ptime))
+            sleep(ptime)
+            continue
+
+        return(content.get('entities', {}))
+
+    return({})
+
+class EntityStore:
+    '''
+    A SQLite-backed store of trimmed Wikidata entities keyed by QID.
+    The store can be used from several threads.
+    '''
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL,
+                 properties=STORED_PROPERTIES, lang='en'):
+        '''
+        :param path: path to the SQLite database, created if necessary
+        :type path: str
+
+        :param ttl: number of seconds before an entity is revalidated
+        :type ttl: int
+
+        :param properties: properties whose claims are stored
+        :type properties: set
+
+        :param lang: language code of the stored labels
+        :type lang: str
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.properties = set(properties)
+        self.lang = lang
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS entities (
+                                qid TEXT PRIMARY KEY,
+                                entity_id TEXT,
+                                lastrevid INTEGER,
+                                missing INTEGER,
+                                label TEXT,
+                                claims TEXT,
+                                fetched REAL)''')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS meta (
+                                key TEXT PRIMARY KEY,
+                                value TEXT)''')
+        self._check_meta()
+
+    def _check_meta(self):
+        '''
+        Make sure the stored entities have labels in our language and
+        claims for all our properties.
+        '''
+        rows = dict(self._conn.execute('SELECT key, value FROM meta'))
+        if rows and rows.get('lang') != self.lang:
+            logging.warning('entity store {} has labels in a different language, clearing it'.format(self.path))
+            with self._conn:
+                self._conn.execute('DELETE FROM entities')
+            rows = {}
+
+        stored_props = set(json.loads(rows.get('properties', '[]')))
+        self.properties |= stored_props
+        if rows and self.properties != stored_props:
+            self._invalidate()
+
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                               ('lang', self.lang))
+        self._write_properties()
+
+    def _write_properties(self):
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                ('properties', json.dumps(sorted(self.properties))))
+
+    def _invalidate(self):
+        '''
+        Make all stored entities be fetched again the next time they
+        are requested, used when they lack claims for a new property.
+        '''
+        logging.info('entity store {} now stores claims for {}, entities will be fetched again'.format(self.path, ', '.join(sorted(self.properties))))
+        with self._conn:
+            self._conn.execute(
+                'UPDATE entities SET lastrevid=NULL, fetched=0')
+
+    def require_properties(self, properties):
+        '''
+        Make sure claims for the given properties are stored, extending
+        the store's properties if necessary.
+
+        :param properties: the properties
+        :type properties: iterable
+        '''
+        properties = set(properties)
+        with self._lock:
+            if properties <= self.properties:
+                return()
+            self.properties |= properties
+            self._invalidate()
+            self._write_properties()
+        return()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _as_entity(self, row):
+        '''
+        Turn a database row into an entity in the API response format.
+        '''
+        (qid, entity_id, lastrevid, missing, label, claims, fetched) = row
+        if missing:
+            return({'id': qid, 'missing': ''})
+
+        entity = {'id': entity_id, 'lastrevid': lastrevid,
+                  'claims': {prop: [{'mainsnak': {'datavalue': {
+                      'value': {'id': target}}}} for target in targets]
+                             for (prop, targets) in json.loads(claims).items()}}
+        if label is not None:
+            entity['labels'] = {self.lang: {'language': self.lang,
+                                            'value': label}}
+        if entity_id != qid:
+            entity['redirects'] = {'from': qid, 'to': entity_id}
+        return(entity)
+
+    def _read(self, qids):
+        '''
+        Return the database rows of the given QIDs.
+        '''
+        rows = []
+        with self._lock:
+            for i in range(0, len(qids), 500):
+                subset = list(qids[i : i + 500])
+                rows.extend(self._conn.execute(
+                    'SELECT * FROM entities WHERE qid IN ({})'.format(
+                        ','.join('?' * len(subset))), subset))
+        return(rows)
+
+    def lookup(self, qids):
+        '''
+        Look up the given QIDs in the store. Returns a tuple of a dict of
+        QID to entity for the entities that are fresh, a dict of QID to
+        revision ID for the entities that have expired, and a list of QIDs
+        that are not in the store or have to be fetched again.
+
+        :param qids: the QIDs to look up
+        :type qids: list
+        '''
+        fresh = {}
+        expired = {}
+        oldest = time() - self.ttl
+        for row in self._read(qids):
+            if row[6] >= oldest:
+                fresh[row[0]] = self._as_entity(row)
+            elif row[2] is not None:
+                expired[row[0]] = row[2]
+            ## else: no revision ID to revalidate with, fetch it
+
+        missing = [qid for qid in qids
+                   if qid not in fresh and qid not in expired]
+        return((fresh, expired, missing))
+
+    def put(self, entity_data):
+        '''
+        Store the given entities, as returned by the Wikidata API, and
+        return them trimmed down to what is stored.
+
+        :param entity_data: the `entities` part of a `wbgetentities` response
+        :type entity_data: dict
+        '''
+        now = time()
+        rows = []
+        for (qid, entity) in entity_data.items():
+            if 'missing' in entity:
+                rows.append((qid, qid, None, 1, None, '{}', now))
+                continue
+
+            claims = {}
+            for (prop, cdata) in entity.get('claims', {}).items():
+                if prop not in self.properties:
+                    continue
+                if isinstance(cdata, dict):
+                    cdata = [cdata]
+                targets = []
+                for c in cdata:
+                    try:
+                        targets.append(
+                            c['mainsnak']['datavalue']['value']['id'])
+                    except (KeyError, TypeError):
+                        continue
+                claims[prop] = targets
+
+            try:
+                label = entity['labels'][self.lang]['value']
+            except KeyError:
+                label = None
+
+            rows.append((qid, entity.get('id', qid), entity.get('lastrevid'),
+                         0, label, json.dumps(claims), now))
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    rows)
+
+        return({row[0]: self._as_entity(row) for row in rows})
+
+    def touch(self, qids):
+        '''
+        Mark the given entities as fetched now.
+
+        :param qids: the QIDs of the entities
+        :type qids: list
+        '''
+        now = time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    'UPDATE entities SET fetched=? WHERE qid=?',
+                    [(now, qid) for qid in qids])
+
+    def get_entities(self, qids, fetch=None):
+        '''
+        Return the given entities, reading them from the store if they
+        are fresh and otherwise through the given fetch function. Entities
+        that could not be fetched are not in the returned dict.
+
+        :param qids: the QIDs of the entities
+        :type qids: list
+
+        :param fetch: function taking a list of at most `MAX_ITEMS` QIDs and
+                      a string of properties to request, returning the
+                      `entities` part of a `wbgetentities` response.
+                      Defaults to `fetch_entities`.
+        :type fetch: callable
+        '''
+        if fetch is None:
+            fetch = lambda items, props: fetch_entities(items, props,
+                                                        lang=self.lang)
+
+        qids = list(qids)
+        (entities, expired, missing) = self.lookup(qids)
+
+        ## Revalidate expired entities using their revision IDs
+        expired_qids = list(expired.keys())
+        for i in range(0, len(expired_qids), MAX_ITEMS):
+            subset = expired_qids[i : i + MAX_ITEMS]
+            info = fetch(subset, REVALIDATE_PROPS)
+            unchanged = [qid for qid in subset if qid in info
+                         and 'missing' not in info[qid]
+                         and info[qid].get('lastrevid') == expired[qid]]
+            self.touch(unchanged)
+            entities.update({row[0]: self._as_entity(row)
+                             for row in self._read(unchanged)})
+            missing.extend([qid for qid in subset if qid not in unchanged])
+
+        for i in range(0, len(missing), MAX_ITEMS):
+            subset = missing[i : i + MAX_ITEMS]
+            entities.update(self.put(fetch(subset, FETCH_PROPS)))
+
+        logging.info('{} of {} entities read from the store'.format(
+            len(qids) - len(missing), len(qids)))
+
+        return(entities)
+
+## Stores opened through `open_store`, by path
+_stores = {}
+
+def open_store(path=None):
+    '''
+    Open the entity store at the given path, or the default store, reusing
+    it if it has already been opened.
+
+    :param path: path to the SQLite database
+    :type path: str
+    '''
+    if path is None:
+        path = DEFAULT_PATH
+    if path not in _stores:
+        _stores[path] = EntityStore(path)
+    return(_stores[path])
@@ -0,0 +1,402 @@
+#!/usr/env/python
+# -*- coding: utf-8 -*-
+'''
+Library for building and reading an offline index of the claims in a
+Wikidata JSON dump (e.g. `latest-all.json.bz2`), so that graph building
+and side-chaining can run without access to the Wikidata API.
+
+The index stores, for every item, the targets of its claims for a set of
+properties as integers (Q5 is 5, P31 is 31) in sorted NumPy arrays:
+`qids` holds the item IDs, and the edges of the item at position `i` are
+`props[offsets[i]:offsets[i+1]]` and `targets[offsets[i]:offsets[i+1]]`.
+English labels can optionally be included. Items are looked up by binary
+search in the memory-mapped arrays.
+
+A `DumpIndex` returns entities in the same format as the entity store in
+the `wdcache` module, and can be used wherever such a store is expected.
+
+Copyright (c) 2017 Morten Wang
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import bz2
+import gzip
+import json
+import logging
+
+import numpy as np
+
+from multiprocessing import Pool
+
+import claims
+import wdcache
+import snapshot
+
+## Number of lines (entities) in a batch handed to a worker process
+BATCH_SIZE = 10000
+
+## Properties and label language used by the worker processes,
+## set by `_init_worker`
+_properties = None
+_lang = None
+
+def open_dump(filename):
+    '''
+    Open the given Wikidata JSON dump for reading text, decompressing it
+    if its name ends in ".bz2" or ".gz".
+
+    :param filename: path to the dump
+    :type filename: str
+    '''
+    if filename.endswith('.bz2'):
+        return(bz2.open(filename, 'rt', encoding='utf-8'))
+    elif filename.endswith('.gz'):
+        return(gzip.open(filename, 'rt', encoding='utf-8'))
+    return(open(filename, 'r', encoding='utf-8'))
+
+def parse_entity(line, properties, lang=None):
+    '''
+    Parse a line of a Wikidata JSON dump. Returns None if the line is not
+    an item, otherwise a tuple of the item's integer ID, a list of
+    (property, target) tuples of integer IDs for its claims with the given
+    properties, and its label in the given language (None if the item has
+    no such label, or no language is given).
+
+    :param line: the line from the dump
+    :type line: str
+
+    :param properties: the properties to extract claims for
+    :type properties: set
+
+    :param lang: language code of the label to extract
+    :type lang: str
+    '''
+
+    line = line.strip().rstrip(',')
+    if not line.startswith('{'):
+        ## The opening and closing brackets of the array
+        return(None)
+
+    entity = json.loads(line)
+    qid = entity.get('id', '')
+    if not qid.startswith('Q'):
+        return(None)
+
+    edges = [(int(prop[1:]), int(target[1:])) for (_, prop, target)
+             in claims.entity_triples(entity, properties)
+             if isinstance(target, str) and target.startswith('Q')]
+
+    label = None
+    if lang:
+        try:
+            label = entity['labels'][lang]['value']
+        except KeyError:
+            pass
+
+    return((int(qid[1:]), edges, label))
+
+def parse_lines(lines, properties, lang=None):
+    '''
+    Parse the given lines of a Wikidata JSON dump, returning a tuple of
+    NumPy arrays of item IDs, number of edges per item, properties and
+    targets of the edges, and a list of labels (None if `lang` is None).
+
+    :param lines: lines from the dump
+    :type lines: iterable
+
+    :param properties: the properties to extract claims for
+    :type properties: set
+
+    :param lang: language code of the labels to extract
+    :type lang: str
+    '''
+    qids = []
+    n_edges = []
+    props = []
+    targets = []
+    labels = [] if lang else None
+    for line in lines:
+        parsed = parse_entity(line, properties, lang)
+        if parsed is None:
+            continue
+
+        (qid, edges, label) = parsed
+        qids.append(qid)
+        n_edges.append(len(edges))
+        for (prop, target) in edges:
+            props.append(prop)
+            targets.append(target)
+        if lang:
+            labels.append(label or '')
+
+    return((np.array(qids, dtype=np.int64), np.array(n_edges, dtype=np.int64),
+            np.array(props, dtype=np.int32), np.array(targets, dtype=np.int64),
+            labels))
+
+def _init_worker(properties, lang):
+    '''
+    Set the properties and label language of a worker process.
+    '''
+    global _properties, _lang
+    _properties = properties
+    _lang = lang
+
+def _parse_batch(lines):
+    '''
+    Parse a batch of dump lines in a worker.
+    '''
+    return(parse_lines(lines, _properties, _lang))
+
+def _read_batches(filename, batch_size):
+    '''
+    Read the given dump and yield lists of `batch_size` lines.
+    '''
+    with open_dump(filename) as infile:
+        batch = []
+        for line in infile:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def build_index(dump_filename, index_path,
+                properties=wdcache.STORED_PROPERTIES, lang=None,
+                n_processes=1, batch_size=BATCH_SIZE):
+    '''
+    Stream the given Wikidata JSON dump and write an index of the claims
+    with the given properties to a directory at the given path.
+
+    :param dump_filename: path to the JSON dump, optionally compressed
+                          with bz2 or gzip
+    :type dump_filename: str
+
+    :param index_path: path to the index directory, created if necessary
+    :type index_path: str
+
+    :param properties: the properties to index claims for
+    :type properties: set
+
+    :param lang: language code of the labels to include, if any
+    :type lang: str
+
+    :param n_processes: number of worker processes parsing the dump
+    :type n_processes: int
+
+    :param batch_size: number of lines per batch handed to a worker
+    :type batch_size: int
+    '''
+
+    properties = set(properties)
+    batches = _read_batches(dump_filename, batch_size)
+    parts = []
+    if n_processes <= 1:
+        results = (parse_lines(batch, properties, lang) for batch in batches)
+        for result in results:
+            parts.append(result)
+            logging.info('parsed {} batches of the dump'.format(len(parts)))
+    else:
+        with Pool(n_processes, initializer=_init_worker,
+                  initargs=(properties, lang)) as pool:
+            ## imap keeps the batches in order, so items are mostly sorted
+            for result in pool.imap(_parse_batch, batches):
+                parts.append(result)
+                logging.info('parsed {} batches of the dump'.format(
+                    len(parts)))
+
+    qids = np.concatenate([p[0] for p in parts])
+    n_edges = np.concatenate([p[1] for p in parts])
+    props = np.concatenate([p[2] for p in parts])
+    targets = np.concatenate([p[3] for p in parts])
+    labels = None
+    if lang:
+        labels = [label for p in parts for label in p[4]]
+    del(parts)
+
+    ## Sort items by ID, moving their edges along with them
+    order = np.argsort(qids, kind='stable')
+    if not np.array_equal(order, np.arange(len(qids))):
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        edge_order = np.argsort(np.repeat(rank, n_edges), kind='stable')
+        props = props[edge_order]
+        targets = targets[edge_order]
+        qids = qids[order]
+        n_edges = n_edges[order]
+        if labels is not None:
+            labels = [labels[i] for i in order]
+
+    offsets = np.zeros(len(qids) + 1, dtype=np.int64)
+    np.cumsum(n_edges, out=offsets[1:])
+
+    os.makedirs(index_path, exist_ok=True)
+    np.save(os.path.join(index_path, 'qids.npy'), qids)
+    np.save(os.path.join(index_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(index_path, 'props.npy'), props)
+    np.save(os.path.join(index_path, 'targets.npy'), targets)
+    if labels is not None:
+        label_array = snapshot.TitleArray.from_strings(labels)
+        np.save(os.path.join(index_path, 'label_buffer.npy'),
+                label_array.buffer)
+        np.save(os.path.join(index_path, 'label_offsets.npy'),
+                label_array.offsets)
+
+    with open(os.path.join(index_path, 'manifest.json'), 'w') as outfile:
+        json.dump({'properties': sorted(properties), 'lang': lang,
+                   'source': os.path.abspath(dump_filename)}, outfile)
+
+    logging.info('indexed {} items with {} edges'.format(len(qids),
+                                                         len(targets)))
+    return()
+
+class DumpIndex:
+    '''
+    An index of claims built from a Wikidata JSON dump by `build_index`.
+    '''
+    def __init__(self, index_path):
+        '''
+        :param index_path: path to the index directory
+        :type index_path: str
+        '''
+        with open(os.path.join(index_path, 'manifest.json')) as infile:
+            manifest = json.load(infile)
+
+        self.properties = set(manifest['properties'])
+        self.lang = manifest['lang']
+
+        load = lambda name: np.load(os.path.join(index_path, name),
+                                    mmap_mode='r')
+        self.qids = load('qids.npy')
+        self.offsets = load('offsets.npy')
+        self.props = load('props.npy')
+        self.targets = load('targets.npy')
+
+        self.labels = None
+        if self.lang:
+            self.labels = snapshot.TitleArray(load('label_buffer.npy'),
+                                              load('label_offsets.npy'))
+
+    def find(self, qid):
+        '''
+        Return the position of the given item in the index, or -1 if
+        it is not in the index.
+
+        :param qid: the item's integer ID
+        :type qid: int
+        '''
+        idx = int(np.searchsorted(self.qids, qid))
+        if idx < len(self.qids) and self.qids[idx] == qid:
+            return(idx)
+        return(-1)
+
+    def edges(self, qid):
+        '''
+        Return a list of (property, target) tuples of integer IDs for the
+        claims of the given item.
+
+        :param qid: the item's integer ID
+        :type qid: int
+        '''
+        idx = self.find(qid)
+        if idx < 0:
+            return([])
+        (start, end) = (self.offsets[idx], self.offsets[idx + 1])
+        return(list(zip(self.props[start:end].tolist(),
+                        self.targets[start:end].tolist())))
+
+    def edge_arrays(self, qids):
+        '''
+        Return the claims of the given items as a tuple of equal-length
+        arrays: the position in `qids` of the item each claim belongs to,
+        and the claim's property and target. Items not in the index have
+        no claims.
+
+        :param qids: the items' integer IDs
+        :type qids: numpy.ndarray
+        '''
+        qids = np.asarray(qids, dtype=np.int64)
+        if not len(self.qids):
+            return((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros(0, dtype=np.int64)))
+
+        idx = np.searchsorted(self.qids, qids)
+        idx[idx == len(self.qids)] = 0
+        found = self.qids[idx] == qids
+
+        starts = np.where(found, self.offsets[idx], 0)
+        lengths = np.where(found, self.offsets[idx + 1] - starts, 0)
+
+        ## Position of every edge in the index, consecutive for each item
+        first = np.cumsum(lengths) - lengths
+        edge_idx = np.repeat(starts - first, lengths) + \
+                   np.arange(lengths.sum())
+
+        return((np.repeat(np.arange(len(qids)), lengths),
+                np.asarray(self.props[edge_idx], dtype=np.int64),
+                np.asarray(self.targets[edge_idx])))
+
+    def require_properties(self, properties):
+        '''
+        Make sure the index has claims for the given properties.
+
+        :param properties: the properties
+        :type properties: iterable
+        '''
+        missing = set(properties) - self.properties
+        if missing:
+            raise ValueError('the Wikidata index does not have claims for {}'.format(', '.join(sorted(missing))))
+        return()
+
+    def get_entities(self, qids, fetch=None):
+        '''
+        Return the given entities in the format of the `entities` part
+        of a `wbgetentities` response, trimmed down to the indexed claims
+        and label. Items not in the index are returned as missing.
+
+        :param qids: the QIDs of the entities
+        :type qids: list
+
+        :param fetch: ignored, the index does not fetch anything
+        :type fetch: callable
+        '''
+        entities = {}
+        for qid in qids:
+            idx = self.find(int(qid[1:]))
+            if idx < 0:
+                entities[qid] = {'id': qid, 'missing': ''}
+                continue
+
+            (start, end) = (self.offsets[idx], self.offsets[idx + 1])
+            claims = {}
+            for (prop, target) in zip(self.props[start:end].tolist(),
+                                      self.targets[start:end].tolist()):
+                claims.setdefault('P{}'.format(prop), []).append(
+                    {'mainsnak': {'datavalue': {'value': {
+                        'id': 'Q{}'.format(target)}}}})
+
+            entity = {'id': qid, 'claims': claims}
+            if self.labels is not None and self.labels[idx]:
+                entity['labels'] = {self.lang: {'language': self.lang,
+                                                'value': self.labels[idx]}}
+            entities[qid] = entity
+
+        return(entities)
@@ -25,10 +25,19 @@ SOFTWARE.
 '''
 
 class RatedPage():
+    ## Slots keep the memory footprint down when we have millions of pages.
+    ## `view_data` is only set for "new" pages, see build-global-dataset.py
+    __slots__ = ['page_id', 'revision_id', 'is_redirect', 'talk_page_id',
+                 'talk_page_title', 'talk_revision_id', 'talk_is_archive',
+                 'importance_rating', 'q', 'num_inlinks', 'num_proj_inlinks',
+                 'num_views', 'n_clicks', 'n_from_articles', 'n_active_inlinks',
+                 'n_from_project_articles', 'n_project_active_inlinks',
+                 'active_inlinks', 'project_active_inlinks', 'view_data']
+
     def __init__(self, talk_page_id, talk_revision_id, talk_page_title,
                  talk_is_archive, importance_rating,
                  art_page_id = -1, art_revision_id = -1,
-                 art_is_redirect = 0):
+                 art_is_redirect = 0, counter_factory = set):
         '''
         Instantiate a page with a given importance rating.  This is
         intended for pages within a specific WikiProject, meaning an
@@ -65,6 +74,11 @@ class RatedPage():
 
         :param art_is_redirect: is the article a redirect
         :type art_is_redirect: int
+
+        :param counter_factory: callable creating the counters used to
+                                track unique article inlinks, see the
+                                `cardinality` module
+        :type counter_factory: callable
         '''
 
         self.page_id = art_page_id
@@ -92,9 +106,9 @@ class RatedPage():
         self.n_from_project_articles = 0 # referrer refers to a project article
         self.n_project_active_inlinks = 0 # no. of unique project articles
 
-        ## Sets used to track unique article inlinks
-        self.active_inlinks = set()
-        self.project_active_inlinks = set()
+        ## Sets (or counters) used to track unique article inlinks
+        self.active_inlinks = counter_factory()
+        self.project_active_inlinks = counter_factory()
 
     def __hash__(self):
         return(self.talk_page_id)
@@ -105,13 +119,17 @@ class RatedPage():
 
         return(self.talk_page_id == other.talk_page_id)
         
-def read_snapshot(snapshot_filename):
+def read_snapshot(snapshot_filename, counter_factory=set):
     '''
     Open the given snapshot filename, read it in and return a list
     of RatedPage objects corresponding to all pages in the snapshot.
 
     :param snapshot_filename: path to the snapshot TSV file
     :type snapshot_filename: str
+
+    :param counter_factory: callable creating the counters used to track
+                            unique article inlinks of each page
+    :type counter_factory: callable
     '''
     pages = list()
     
@@ -126,7 +144,7 @@ def read_snapshot(snapshot_filename):
             ## so we splice it in:
             cols = cols[:4] + cols[-1:] + cols[4:-1]
 
-            page = RatedPage(*cols)
+            page = RatedPage(*cols, counter_factory=counter_factory)
             pages.append(page)
     
     return(pages)
@@ -30,7 +30,8 @@ import pywikibot
 from pywikibot.data.api import Request
 
 import requests
-from time import sleep
+
+import wdcache
 
 class WikidataItem:
     def __init__(self, title):
@@ -146,43 +147,26 @@ class InstanceGrabber:
             i += self.slice_size
 
         # query Wikidata for the instance of associated with these titles
-        # and store that
+        # and store that, reading through the entity store
+        entity_store = wdcache.open_store()
         wd_session = requests.Session()
+        q_map = {item.Q:item for item in all_items.values()
+                 if item.Q and item.Q != "None"}
+        qids = list(q_map.keys())
         i = 0
-        item_list = list(all_items.values())
-        while i < len(item_list):
-            subset = item_list[i : i + self.slice_size]
-            item_url = "{base}{idlist}".format(
-                base=self.wd_url, idlist="|".join(
-                    [i.Q for i in subset if i.Q != "None"]))
-            response = wd_session.get(item_url)
-            sleep(0.01)
-            if response.status_code != 200:
-                logging.warning('Wikidata returned status {}'.format(response.status_code))
-                continue
-
-            try:
-                content = response.json()
-                entity_data = content['entities']
-            except ValueError:
-                logging.warning('Unable to decode Wikidata response as JSON')
-            except KeyError:
-                logging.warning("Wikidata response keys not as expected")
-
-            ## Iterate over the entities
-            ## article title is in entity['sitelinks']['enwiki']['title']
-            for entity in entity_data.values():
-                try:
-                    title = entity['sitelinks']['enwiki']['title']
-                except KeyError:
-                    logging.warning('unable to get article title for {}'.format(entity['id']))
-                    continue
+        while i < len(qids):
+            subset = qids[i : i + self.slice_size]
+            entity_data = entity_store.get_entities(
+                subset, fetch=lambda items, props: wdcache.fetch_entities(
+                    items, props, session=wd_session))
+
+            ## Iterate over the entities, keyed by the QIDs we asked for
+            for (qid, entity) in entity_data.items():
+                item = q_map[qid]
 
-                item = all_items[title]
-                
                 ## We're interested in a claim for property P31 ("instance of")
                 ## Where we'll store the entity for that property.
-                claims = entity['claims']
+                claims = entity.get('claims', {})
                 if not 'P31' in claims:
                     logging.warning('{} is not an instance of anything'.format(item.title))
                     continue
@@ -190,16 +174,12 @@ class InstanceGrabber:
                 inst_data = claims['P31']
                 ## P31 is either a list (multiple instances)
                 ## or a dict (single instance)
-                if isinstance(inst_data, list):
-                    for inst_data_item in inst_data:
-                        try:
-                            item.instance_of.append(
-                                self.get_instance_id(inst_data_item))
-                        except KeyError:
-                            logging.warning('unexpected data structure for P31 for {}'.format(item.title))
-                else:
+                if not isinstance(inst_data, list):
+                    inst_data = [inst_data]
+                for inst_data_item in inst_data:
                     try:
-                        item.instace_of.append(self.get_instance_id(inst_data))
+                        item.instance_of.append(
+                            self.get_instance_id(inst_data_item))
                     except KeyError:
                         logging.warning('unexpected data structure for P31 for {}'.format(item.title))
 